@@ -0,0 +1,318 @@
+"""
+Archival of old transactions to compressed files.
+
+`python -m app.archive` moves every month older than ARCHIVE_AFTER_MONTHS out
+of the database into ARCHIVE_DIR, one file per month (gzip-compressed CSV, or
+Parquet when ARCHIVE_FORMAT=parquet and pyarrow is installed), listed in
+ARCHIVE_DIR/manifest.json. When the table is partitioned (app.partitions) the
+month's partition is detached and dropped, otherwise its rows are deleted.
+
+Archived transactions still count in the running analytics, which archival
+doesn't touch, and are read back by the bucketed analytics, the export and
+rebuild_user_analytics. Names stay encrypted in the archive files. Reading
+the archives scans the month files, so it is meant for cold data. Archiving
+invalidates the cached entries and ETags of the users whose rows it moved,
+since their transaction lists change.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.engine import Engine
+
+from app.cache import invalidate_users
+from app.models.models import Transaction
+from app.partitions import add_months, is_partitioned, list_partitions, month_start, supports_partitioning
+from app.settings import current_settings
+
+logger = logging.getLogger(__name__)
+
+# Users invalidated per round trip after a month is archived
+INVALIDATE_BATCH = 1000
+
+ARCHIVE_COLUMNS = (
+    Transaction.id,
+    Transaction.user_id,
+    Transaction.full_name,
+    Transaction.transaction_date,
+    Transaction.transaction_amount,
+    Transaction.transaction_type,
+)
+ARCHIVE_FIELDS = [column.key for column in ARCHIVE_COLUMNS]
+ARCHIVE_FORMATS = {"csv": ".csv.gz", "parquet": ".parquet"}
+MANIFEST = "manifest.json"
+
+_manifest_cache = {}
+
+
+def _archive_dir(archive_dir: Optional[str]) -> str:
+    return archive_dir or current_settings().archive_dir
+
+
+def load_manifest(archive_dir: Optional[str] = None) -> dict:
+    """
+    Read the archive manifest: {"files": [{"month", "file", "format", "rows"}, ...]}.
+    Cached until the file changes, so checking for archives on the read path is cheap.
+    """
+    path = os.path.join(_archive_dir(archive_dir), MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {"files": []}
+    cached = _manifest_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as manifest_file:
+            cached = _manifest_cache[path] = (mtime, json.load(manifest_file))
+    return cached[1]
+
+
+def _save_manifest(manifest: dict, archive_dir: str):
+    path = os.path.join(archive_dir, MANIFEST)
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _month_bounds(month: date) -> Tuple[datetime, datetime]:
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end_month = add_months(month, 1)
+    return start, datetime(end_month.year, end_month.month, 1, tzinfo=timezone.utc)
+
+
+def _write_csv(path: str, rows) -> int:
+    count = 0
+    with gzip.open(path, "wt", newline="") as archive_file:
+        writer = csv.writer(archive_file)
+        writer.writerow(ARCHIVE_FIELDS)
+        for row in rows:
+            row = list(row)
+            row[3] = row[3].isoformat() if row[3] is not None else ""
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_parquet(path: str, rows) -> int:
+    # pyarrow is only needed when archiving to Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("full_name", pa.string()),
+        ("transaction_date", pa.timestamp("us", tz="UTC")),
+        ("transaction_amount", pa.float64()),
+        ("transaction_type", pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        batch = []
+        for row in rows:
+            batch.append(dict(zip(ARCHIVE_FIELDS, row)))
+            if len(batch) >= 10_000:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch or not count:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def _read_csv(path: str, user_id: Optional[int]) -> Iterator[tuple]:
+    with gzip.open(path, "rt", newline="") as archive_file:
+        reader = csv.reader(archive_file)
+        next(reader)
+        for transaction_id, row_user_id, full_name, transaction_date, amount, transaction_type in reader:
+            if user_id is not None and int(row_user_id) != user_id:
+                continue
+            yield (
+                int(transaction_id),
+                int(row_user_id),
+                full_name,
+                datetime.fromisoformat(transaction_date) if transaction_date else None,
+                float(amount),
+                transaction_type,
+            )
+
+
+def _read_parquet(path: str, user_id: Optional[int]) -> Iterator[tuple]:
+    import pyarrow.parquet as pq
+
+    filters = [("user_id", "=", user_id)] if user_id is not None else None
+    for record in pq.read_table(path, filters=filters).to_pylist():
+        yield tuple(record[field] for field in ARCHIVE_FIELDS)
+
+
+def _comparable(bound: datetime, value: datetime) -> datetime:
+    # Archives from Postgres hold aware datetimes and from SQLite naive ones; bounds may be either
+    if value.tzinfo is not None and bound.tzinfo is None:
+        return bound.replace(tzinfo=timezone.utc)
+    if value.tzinfo is None and bound.tzinfo is not None:
+        return bound.astimezone(timezone.utc).replace(tzinfo=None)
+    return bound
+
+
+def has_archives(archive_dir: Optional[str] = None) -> bool:
+    return bool(load_manifest(archive_dir)["files"])
+
+
+def iter_archived_rows(user_id: Optional[int] = None, start: Optional[datetime] = None, end: Optional[datetime] = None, archive_dir: Optional[str] = None) -> Iterator[tuple]:
+    """
+    Read archived transactions as (id, user_id, full_name, transaction_date,
+    transaction_amount, transaction_type) tuples, oldest month first.
+
+    Parameters:
+    user_id (int): Only return this user's transactions. Default is all users.
+    start (datetime): Only return transactions at or after this time.
+    end (datetime): Only return transactions before this time.
+    archive_dir (str): The archive directory. Default is ARCHIVE_DIR.
+    """
+    archive_dir = _archive_dir(archive_dir)
+    for entry in sorted(load_manifest(archive_dir)["files"], key=lambda entry: entry["month"]):
+        month_first, month_end = _month_bounds(date.fromisoformat(entry["month"] + "-01"))
+        # Skip whole files outside the range
+        if end is not None and _comparable(end, month_first) <= month_first:
+            continue
+        if start is not None and _comparable(start, month_end) >= month_end:
+            continue
+        path = os.path.join(archive_dir, entry["file"])
+        rows = _read_parquet(path, user_id) if entry["format"] == "parquet" else _read_csv(path, user_id)
+        for row in rows:
+            transaction_date = row[3]
+            if transaction_date is not None:
+                if start is not None and transaction_date < _comparable(start, transaction_date):
+                    continue
+                if end is not None and transaction_date >= _comparable(end, transaction_date):
+                    continue
+            yield row
+
+
+def archive_month(engine: Engine, month: date, archive_dir: Optional[str] = None, archive_format: Optional[str] = None) -> int:
+    """
+    Move one month of transactions from the database to an archive file.
+
+    The file and its manifest entry are written before the rows are removed
+    in the same database transaction that read them, so a failure leaves the
+    rows in the database rather than losing them. If that transaction fails,
+    commit included, the manifest entry and the file are removed again.
+
+    Returns:
+    int: The number of rows archived.
+    """
+    archive_dir = _archive_dir(archive_dir)
+    archive_format = archive_format or current_settings().archive_format
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format {archive_format!r}")
+    os.makedirs(archive_dir, exist_ok=True)
+
+    start, end = _month_bounds(month)
+    manifest = load_manifest(archive_dir)
+    # A month archived again (late rows in the default partition) gets another file
+    existing = sum(1 for entry in manifest["files"] if entry["month"] == f"{month:%Y-%m}")
+    file_name = f"transactions_{month:%Y_%m}{f'_{existing}' if existing else ''}{ARCHIVE_FORMATS[archive_format]}"
+    path = os.path.join(archive_dir, file_name)
+
+    saved = False
+    try:
+        with engine.begin() as connection:
+            partition = None
+            if supports_partitioning(engine) and is_partitioned(connection):
+                partition = dict((partition_month, name) for partition_month, name in list_partitions(connection)).get(month)
+
+            rows = connection.execution_options(yield_per=1000).execute(
+                select(*ARCHIVE_COLUMNS)
+                .where(Transaction.transaction_date >= start, Transaction.transaction_date < end)
+                .order_by(Transaction.transaction_date, Transaction.id)
+            )
+            user_ids = set()
+            rows = _collect_user_ids(rows, user_ids)
+            count = _write_parquet(path, rows) if archive_format == "parquet" else _write_csv(path, rows)
+
+            entry = {"month": f"{month:%Y-%m}", "file": file_name, "format": archive_format, "rows": count}
+            if count:
+                _save_manifest({"files": manifest["files"] + [entry]}, archive_dir)
+                saved = True
+            if partition is not None:
+                connection.execute(text(f"ALTER TABLE transactions DETACH PARTITION {partition}"))
+                connection.execute(text(f"DROP TABLE {partition}"))
+            if count:
+                connection.execute(delete(Transaction).where(Transaction.transaction_date >= start, Transaction.transaction_date < end))
+    except Exception:
+        # Including a failed commit: the rows stay in the database, so their file is dropped
+        if saved:
+            _save_manifest(manifest, archive_dir)
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    if not count:
+        os.remove(path)
+    user_ids = sorted(user_ids)
+    for index in range(0, len(user_ids), INVALIDATE_BATCH):
+        invalidate_users(user_ids[index:index + INVALIDATE_BATCH])
+    return count
+
+
+def _collect_user_ids(rows, user_ids: set):
+    for row in rows:
+        user_ids.add(row[1])
+        yield row
+
+
+def months_to_archive(engine: Engine, cutoff: date) -> List[date]:
+    """
+    The months before `cutoff` that still have rows or partitions in the database.
+    """
+    start, _ = _month_bounds(cutoff)
+    with engine.connect() as connection:
+        months = set()
+        oldest = connection.execute(select(func.min(Transaction.transaction_date)).where(Transaction.transaction_date < start)).scalar()
+        if oldest is not None:
+            if isinstance(oldest, str):
+                oldest = datetime.fromisoformat(oldest)
+            month = month_start(oldest.date())
+            while month < cutoff:
+                months.add(month)
+                month = add_months(month, 1)
+        if supports_partitioning(engine) and is_partitioned(connection):
+            months.update(month for month, _ in list_partitions(connection) if month < cutoff)
+    return sorted(months)
+
+
+def archive_old_months(engine: Engine, after_months: Optional[int] = None, archive_dir: Optional[str] = None, archive_format: Optional[str] = None) -> List[Tuple[date, int]]:
+    """
+    Archive every month older than `after_months` months before the current one.
+
+    Returns:
+    List[Tuple[date, int]]: The archived months and their row counts.
+    """
+    after_months = current_settings().archive_after_months if after_months is None else after_months
+    if after_months is None:
+        raise ValueError("Set ARCHIVE_AFTER_MONTHS to enable archival")
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -after_months)
+    archived = []
+    for month in months_to_archive(engine, cutoff):
+        count = archive_month(engine, month, archive_dir, archive_format)
+        logger.info("Archived %s rows for %s", count, f"{month:%Y-%m}")
+        archived.append((month, count))
+    return archived
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old transactions out of the database into compressed archive files.")
+    parser.add_argument("--after-months", type=int, default=None, help="Months to keep in the database. Default is ARCHIVE_AFTER_MONTHS")
+    parser.add_argument("--format", choices=sorted(ARCHIVE_FORMATS), default=None, help="Default is ARCHIVE_FORMAT")
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    for archived_month, rows in archive_old_months(engine, args.after_months, archive_format=args.format):
+        print(f"{archived_month:%Y-%m}: archived {rows} rows")
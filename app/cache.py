@@ -0,0 +1,843 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+
+from app.lru import LRUCache
+from app.metrics import cache_duration, cache_requests, timed
+from app.redis_client import redis_client, async_redis_client
+from app.settings import Settings, current_settings, settings
+
+logger = logging.getLogger(__name__)
+
+# From the settings (see Settings.cache_ttl and below), and replaced by
+# configure() with the settings of the app being served
+CACHE_TTL = settings.cache_ttl
+REDIS_RETRY_AFTER = settings.redis_retry_after
+CACHE_LEASE_SECONDS = settings.cache_lease_seconds
+CACHE_LEASE_POLL = settings.cache_lease_poll
+CACHE_STALE_WHILE_REVALIDATE = settings.cache_stale_while_revalidate
+
+# In-process tier in front of Redis. Entries are dropped on invalidation
+# messages from other workers; the TTL bounds staleness if one is missed.
+LOCAL_CACHE_SIZE = settings.local_cache_size
+LOCAL_CACHE_TTL = settings.local_cache_ttl
+INVALIDATION_CHANNEL = settings.cache_invalidation_channel
+
+ANALYTICS = "user_analytics"
+# First page of a user's transactions as an encrypted, pre-encoded response body
+TRANSACTIONS = "user_transaction_page"
+USER_CACHE_KINDS = (ANALYTICS, TRANSACTIONS)
+# Cached single transactions, keyed and versioned by transaction ID
+TRANSACTION = "transaction"
+
+local_cache = LRUCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+# The cache versions of the values in local_cache, for HTTP validators (app.conditional)
+local_versions = LRUCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+
+# Read-your-writes markers for replica routing, only kept when replicas are configured
+TRACK_RECENT_WRITES = bool(settings.database_replica_urls)
+RECENT_WRITE_SECONDS = settings.read_your_writes_seconds
+_recent_writes = LRUCache(100_000, RECENT_WRITE_SECONDS)
+
+_redis_down_until = 0.0
+
+# Invalidations that didn't reach Redis. They are sent again with the next
+# invalidation and by the listener thread, until Redis takes them; until then
+# other workers may serve the old entries.
+_pending_users: Set[int] = set()
+_pending_transactions: Set[int] = set()
+_pending_lock = threading.Lock()
+
+
+def version_key(user_id: int) -> str:
+    return f"user_cache_version:{user_id}"
+
+
+def transaction_version_key(transaction_id: int) -> str:
+    return f"transaction_cache_version:{transaction_id}"
+
+
+def _version_key(kind: str, owner_id: int) -> str:
+    # `kind` may also be the scope "transaction" or "user"
+    return transaction_version_key(owner_id) if kind in (TRANSACTION, "transaction") else version_key(owner_id)
+
+
+def user_key(kind: str, user_id: int) -> str:
+    return f"{kind}:{user_id}"
+
+
+def recent_write_key(scope: str, owner_id: int) -> str:
+    return f"recent_write:{scope}:{owner_id}"
+
+
+def lease_key(kind: str, user_id: int) -> str:
+    return f"cache_fill_lease:{kind}:{user_id}"
+
+
+def configure(config: Settings):
+    # The cache settings, local tier size and read-your-writes markers follow the app being served
+    global CACHE_TTL, REDIS_RETRY_AFTER, CACHE_LEASE_SECONDS, CACHE_LEASE_POLL, CACHE_STALE_WHILE_REVALIDATE
+    global LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL, INVALIDATION_CHANNEL, TRACK_RECENT_WRITES, RECENT_WRITE_SECONDS, _recent_writes
+    CACHE_TTL, REDIS_RETRY_AFTER = config.cache_ttl, config.redis_retry_after
+    CACHE_LEASE_SECONDS, CACHE_LEASE_POLL = config.cache_lease_seconds, config.cache_lease_poll
+    CACHE_STALE_WHILE_REVALIDATE = config.cache_stale_while_revalidate
+    LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL = config.local_cache_size, config.local_cache_ttl
+    local_cache.resize(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+    local_versions.resize(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+    # The listener subscribes when the lifespan starts it, after this
+    INVALIDATION_CHANNEL = config.cache_invalidation_channel
+    TRACK_RECENT_WRITES = bool(config.database_replica_urls)
+    if config.read_your_writes_seconds != RECENT_WRITE_SECONDS:
+        RECENT_WRITE_SECONDS = config.read_your_writes_seconds
+        _recent_writes = LRUCache(100_000, RECENT_WRITE_SECONDS)
+
+
+def redis_available() -> bool:
+    return time.monotonic() >= _redis_down_until
+
+
+def mark_redis_down(exc: Exception):
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+    logger.warning("Redis unavailable, bypassing cache for %ss: %s", REDIS_RETRY_AFTER, exc)
+
+
+def _decode_entry(kind: str, current_version: Optional[str], cached: Optional[str]) -> Tuple[Optional[Any], int, Optional[Any]]:
+    # Returns (value, version, stale value). Entries from an older version are
+    # kept by invalidation so they can be served while the new value is filled.
+    version = int(current_version or 0)
+    if cached:
+        entry = json.loads(cached)
+        if entry.get("version") == version:
+            cache_requests.inc(kind, "hit")
+            return entry["value"], version, None
+        cache_requests.inc(kind, "miss")
+        return None, version, entry["value"]
+    cache_requests.inc(kind, "miss")
+    return None, version, None
+
+
+def _encode_entry(version: int, value: Any) -> str:
+    return json.dumps({"version": version, "value": value})
+
+
+# Writes set a version to the Redis server time in microseconds (or one more
+# than the current version, if that is larger). Versions keep increasing even
+# if Redis loses the counters, and double as the last modification time.
+# Numbers are formatted with %d, since Lua would print large ones in
+# exponent notation. Written versions don't expire. KEYS: the version keys.
+_BUMP_VERSIONS = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000000 + tonumber(clock[2])
+for _, key in ipairs(KEYS) do
+    local version = tonumber(redis.call('GET', key) or '0')
+    redis.call('INCRBY', key, string.format('%d', math.max(1, now - version)))
+    redis.call('PERSIST', key)
+end
+return 0
+"""
+_bump_versions = redis_client.register_script(_BUMP_VERSIONS)
+_abump_versions = async_redis_client.register_script(_BUMP_VERSIONS)
+
+# Returns {version, 1} after starting a missing version at the current time,
+# or {version, 0} for an existing one. Reads may start versions of IDs that
+# don't exist, so started versions expire unless a write bumps them; one that
+# expired restarts later, and so higher. KEYS[1]: the version key. ARGV[1]:
+# the TTL in seconds.
+_START_VERSION = """
+local version = redis.call('GET', KEYS[1])
+if version then
+    return {version, 0}
+end
+local clock = redis.call('TIME')
+version = string.format('%d', tonumber(clock[1]) * 1000000 + tonumber(clock[2]))
+redis.call('SET', KEYS[1], version, 'EX', ARGV[1])
+return {version, 1}
+"""
+_start_version = redis_client.register_script(_START_VERSION)
+_astart_version = async_redis_client.register_script(_START_VERSION)
+
+
+def current_version(scope: str, owner_id: int) -> Tuple[Optional[int], bool]:
+    """
+    Read a user's ('user') or a transaction's ('transaction') cache version,
+    starting it at the current time if it doesn't exist yet.
+
+    Returns:
+    Tuple[int, bool]: The version (None when Redis is unavailable), and
+    whether this call started it.
+    """
+    if not redis_available():
+        return None, False
+    try:
+        version, started = _start_version(keys=[_version_key(scope, owner_id)], args=[CACHE_TTL])
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None, False
+    return int(version), bool(int(started))
+
+
+async def acurrent_version(scope: str, owner_id: int) -> Tuple[Optional[int], bool]:
+    if not redis_available():
+        return None, False
+    try:
+        version, started = await _astart_version(keys=[_version_key(scope, owner_id)], args=[CACHE_TTL])
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None, False
+    return int(version), bool(int(started))
+
+
+def _local_hit(kind: str, user_id: int) -> Optional[Any]:
+    value = local_cache.get((kind, user_id))
+    if value is not None:
+        cache_requests.inc(kind, "local_hit")
+    return value
+
+
+def _read_entry(user_id: int, kind: str) -> Tuple[Optional[Any], Optional[int], Optional[Any]]:
+    value = _local_hit(kind, user_id)
+    if value is not None:
+        return value, local_versions.get((kind, user_id)), None
+    if not redis_available():
+        cache_requests.inc(kind, "error")
+        return None, None, None
+    generation = _local_generation
+    try:
+        with timed(cache_duration, kind, "get", component="cache"):
+            current_version, cached = redis_client.mget(_version_key(kind, user_id), user_key(kind, user_id))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        cache_requests.inc(kind, "error")
+        return None, None, None
+
+    value, version, stale = _decode_entry(kind, current_version, cached)
+    if value is not None:
+        _set_local(user_id, kind, version, generation, value)
+    return value, version, stale
+
+
+def get_user_cached(user_id: int, kind: str) -> Tuple[Optional[Any], Optional[int]]:
+    """
+    Read a cached value for a user together with the user's cache version.
+
+    Values are stored with the version they were computed under, and only
+    count as a hit while that version is still current. The version and the
+    value are fetched in a single MGET round trip.
+
+    Parameters:
+    user_id (int): The ID of the user.
+    kind (str): The kind of cached value, e.g. ANALYTICS or TRANSACTIONS.
+
+    Returns:
+    Tuple[Any, int]: The cached value (None on a miss) and the current version
+    to pass to set_user_cached. The version is None when Redis is unavailable.
+    """
+    value, version, _ = _read_entry(user_id, kind)
+    return value, version
+
+
+def set_user_cached(user_id: int, kind: str, version: Optional[int], value: Any, ttl: Optional[int] = None):
+    """
+    Store a value computed while the user's cache version was `version`.
+
+    If a write bumped the version in the meantime, the entry is simply never
+    read back, so a slow reader cannot reinstate stale data.
+    """
+    if version is None or not redis_available():
+        return
+    try:
+        with timed(cache_duration, kind, "set", component="cache"):
+            redis_client.setex(user_key(kind, user_id), ttl or CACHE_TTL, _encode_entry(version, value))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def find_cold_entries(kind: str, user_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Find the users whose `kind` entry is missing or outdated, with one pipelined round trip.
+
+    Parameters:
+    kind (str): The kind of cached value, e.g. ANALYTICS or TRANSACTIONS.
+    user_ids (Iterable[int]): The IDs of the users to check.
+
+    Returns:
+    Dict[int, int]: The current cache version of each cold user, to pass to
+    set_user_cached_many. Empty when Redis is unavailable.
+    """
+    user_ids = list(user_ids)
+    if not user_ids or not redis_available():
+        return {}
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.mget(_version_key(kind, user_id), user_key(kind, user_id))
+        results = pipe.execute()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return {}
+    cold = {}
+    for user_id, (current_version, cached) in zip(user_ids, results):
+        version = int(current_version or 0)
+        if not cached or json.loads(cached).get("version") != version:
+            cold[user_id] = version
+    return cold
+
+
+def set_user_cached_many(kind: str, entries: Dict[int, Tuple[int, Any]], ttl: Optional[int] = None):
+    """
+    Store several users' values, given as {user_id: (version, value)}, with
+    one pipelined round trip. Like set_user_cached, a value computed before
+    a write bumped the version is never read back.
+    """
+    if not entries or not redis_available():
+        return
+    try:
+        with timed(cache_duration, kind, "set", component="cache"):
+            pipe = redis_client.pipeline(transaction=False)
+            for user_id, (version, value) in entries.items():
+                pipe.setex(user_key(kind, user_id), ttl or CACHE_TTL, _encode_entry(version, value))
+            pipe.execute()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def invalidate_user(user_id: int, transaction_ids: Iterable[int] = ()):
+    """
+    Invalidate every cached value for a user after a committed write.
+
+    Bumps the user's cache version. The old entries stop counting as hits but
+    are kept, so they can be served as stale values while they are refilled.
+
+    Parameters:
+    user_id (int): The ID of the user whose data changed.
+    transaction_ids (Iterable[int]): The IDs of updated or deleted transactions.
+    """
+    invalidate_users([user_id], transaction_ids)
+
+
+def _invalidation_message(user_ids, transaction_ids) -> str:
+    return json.dumps({"users": list(user_ids), "transactions": list(transaction_ids)})
+
+
+def _with_pending(user_ids: List[int], transaction_ids: List[int]) -> Tuple[List[int], List[int]]:
+    # Takes the queued invalidations, to send along with these ones
+    with _pending_lock:
+        user_ids = list(_pending_users.union(user_ids))
+        transaction_ids = list(_pending_transactions.union(transaction_ids))
+        _pending_users.clear()
+        _pending_transactions.clear()
+    return user_ids, transaction_ids
+
+
+def _queue_invalidations(user_ids: Iterable[int], transaction_ids: Iterable[int]):
+    with _pending_lock:
+        _pending_users.update(user_ids)
+        _pending_transactions.update(transaction_ids)
+
+
+def has_pending_invalidations() -> bool:
+    return bool(_pending_users or _pending_transactions)
+
+
+def invalidate_users(user_ids: Iterable[int], transaction_ids: Iterable[int] = ()):
+    """
+    Invalidate the cached values of several users in one pipelined round trip,
+    and tell the other workers to drop them from their in-process tier.
+
+    The version bump is attempted even while reads bypass Redis after a
+    failure. If it fails, it is queued and sent again with the next
+    invalidation, or by the listener thread once Redis is back.
+
+    Parameters:
+    user_ids (Iterable[int]): The IDs of the users whose data changed.
+    transaction_ids (Iterable[int]): The IDs of updated or deleted transactions.
+    """
+    user_ids, transaction_ids = list(user_ids), list(transaction_ids)
+    drop_local(user_ids, transaction_ids)
+    _mark_recent_writes(None, user_ids, transaction_ids)
+    user_ids, transaction_ids = _with_pending(user_ids, transaction_ids)
+    if not user_ids and not transaction_ids:
+        return
+    try:
+        with timed(cache_duration, "user", "invalidate", component="cache"):
+            pipe = redis_client.pipeline(transaction=False)
+            keys = [version_key(user_id) for user_id in user_ids] + [transaction_version_key(transaction_id) for transaction_id in transaction_ids]
+            _bump_versions(keys=keys, client=pipe)
+            pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(user_ids, transaction_ids))
+            _mark_recent_writes(pipe, user_ids, transaction_ids)
+            pipe.execute()
+    except redis.RedisError as exc:
+        _queue_invalidations(user_ids, transaction_ids)
+        mark_redis_down(exc)
+
+
+def retry_pending_invalidations():
+    """
+    Send the queued invalidations, if there are any.
+    """
+    if has_pending_invalidations():
+        invalidate_users([])
+
+
+# Async variants for the ASYNC_MODE request path
+async def _aread_entry(user_id: int, kind: str) -> Tuple[Optional[Any], Optional[int], Optional[Any]]:
+    value = _local_hit(kind, user_id)
+    if value is not None:
+        return value, local_versions.get((kind, user_id)), None
+    if not redis_available():
+        cache_requests.inc(kind, "error")
+        return None, None, None
+    generation = _local_generation
+    try:
+        with timed(cache_duration, kind, "get", component="cache"):
+            current_version, cached = await async_redis_client.mget(_version_key(kind, user_id), user_key(kind, user_id))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        cache_requests.inc(kind, "error")
+        return None, None, None
+
+    value, version, stale = _decode_entry(kind, current_version, cached)
+    if value is not None:
+        _set_local(user_id, kind, version, generation, value)
+    return value, version, stale
+
+
+async def aget_user_cached(user_id: int, kind: str) -> Tuple[Optional[Any], Optional[int]]:
+    value, version, _ = await _aread_entry(user_id, kind)
+    return value, version
+
+
+async def aset_user_cached(user_id: int, kind: str, version: Optional[int], value: Any, ttl: Optional[int] = None):
+    if version is None or not redis_available():
+        return
+    try:
+        with timed(cache_duration, kind, "set", component="cache"):
+            await async_redis_client.setex(user_key(kind, user_id), ttl or CACHE_TTL, _encode_entry(version, value))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+async def ainvalidate_user(user_id: int, transaction_ids: Iterable[int] = ()):
+    transaction_ids = list(transaction_ids)
+    drop_local([user_id], transaction_ids)
+    _mark_recent_writes(None, [user_id], transaction_ids)
+    user_ids, transaction_ids = _with_pending([user_id], transaction_ids)
+    try:
+        with timed(cache_duration, "user", "invalidate", component="cache"):
+            pipe = async_redis_client.pipeline(transaction=False)
+            keys = [version_key(user_id) for user_id in user_ids] + [transaction_version_key(transaction_id) for transaction_id in transaction_ids]
+            await _abump_versions(keys=keys, client=pipe)
+            pipe.publish(INVALIDATION_CHANNEL, _invalidation_message(user_ids, transaction_ids))
+            _mark_recent_writes(pipe, user_ids, transaction_ids)
+            await pipe.execute()
+    except redis.RedisError as exc:
+        _queue_invalidations(user_ids, transaction_ids)
+        mark_redis_down(exc)
+
+
+# Read-your-writes. Writes mark the user and transactions in this worker and,
+# within the invalidation pipeline, in Redis for the other workers; reads of
+# marked users or transactions go to the primary instead of a replica.
+def _recent_write_keys(user_id: Optional[int], transaction_id: Optional[int]):
+    keys = []
+    if user_id is not None:
+        keys.append(recent_write_key("user", user_id))
+    if transaction_id is not None:
+        keys.append(recent_write_key("transaction", transaction_id))
+    return keys
+
+
+def _mark_recent_writes(pipe, user_ids: Iterable[int], transaction_ids: Iterable[int]):
+    # Marks the writes locally when pipe is None, otherwise queues them on the Redis pipeline
+    if not TRACK_RECENT_WRITES:
+        return
+    keys = [recent_write_key("user", user_id) for user_id in user_ids]
+    keys += [recent_write_key("transaction", transaction_id) for transaction_id in transaction_ids]
+    for key in keys:
+        if pipe is None:
+            _recent_writes.set(key, True)
+        else:
+            pipe.set(key, 1, px=int(RECENT_WRITE_SECONDS * 1000))
+
+
+def recently_written(user_id: Optional[int] = None, transaction_id: Optional[int] = None) -> bool:
+    """
+    Whether the user or transaction was written within the read-your-writes
+    window, in which case it should be read from the primary.
+
+    When Redis is unavailable only this worker's own writes are known.
+    """
+    keys = _recent_write_keys(user_id, transaction_id)
+    if not keys or not TRACK_RECENT_WRITES:
+        return False
+    if any(_recent_writes.get(key) for key in keys):
+        return True
+    if not redis_available():
+        return False
+    try:
+        return redis_client.exists(*keys) > 0
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return False
+
+
+async def arecently_written(user_id: Optional[int] = None, transaction_id: Optional[int] = None) -> bool:
+    keys = _recent_write_keys(user_id, transaction_id)
+    if not keys or not TRACK_RECENT_WRITES:
+        return False
+    if any(_recent_writes.get(key) for key in keys):
+        return True
+    if not redis_available():
+        return False
+    try:
+        return await async_redis_client.exists(*keys) > 0
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return False
+
+
+# In-process tier invalidation. Every write drops the entries locally and
+# publishes them on INVALIDATION_CHANNEL; a listener thread in each worker
+# drops them from that worker's tier.
+_local_generation = 0
+_listener: Optional[threading.Thread] = None
+
+
+def drop_local(user_ids: Iterable[int], transaction_ids: Iterable[int] = ()):
+    global _local_generation
+    _local_generation += 1
+    for user_id in user_ids:
+        for kind in USER_CACHE_KINDS:
+            local_cache.pop((kind, user_id))
+            local_versions.pop((kind, user_id))
+    for transaction_id in transaction_ids:
+        local_cache.pop((TRANSACTION, transaction_id))
+        local_versions.pop((TRANSACTION, transaction_id))
+
+
+def _listen_for_invalidations():
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Messages published while we were disconnected are lost
+            local_cache.clear()
+            local_versions.clear()
+            while True:
+                retry_pending_invalidations()
+                message = pubsub.get_message(timeout=1.0)
+                if message is not None:
+                    payload = json.loads(message["data"])
+                    drop_local(payload.get("users", ()), payload.get("transactions", ()))
+        except (redis.RedisError, ValueError) as exc:
+            logger.debug("Cache invalidation listener disconnected: %s", exc)
+            time.sleep(REDIS_RETRY_AFTER)
+        finally:
+            pubsub.close()
+
+
+def start_invalidation_listener():
+    """
+    Start the thread that applies other workers' invalidations to this
+    worker's in-process tier, and sends this worker's queued invalidations
+    once Redis is back.
+    """
+    global _listener
+    if _listener is None:
+        _listener = threading.Thread(target=_listen_for_invalidations, name="cache-invalidation", daemon=True)
+        _listener.start()
+
+
+# Responses to POST /transactions/ by Idempotency-Key, so retries are answered
+# without touching the database. The database keeps the durable record.
+def idempotency_cache_key(key: str) -> str:
+    return f"idempotency:{key}"
+
+
+def get_idempotent_response(key: str) -> Optional[dict]:
+    """
+    Return the cached {"request_hash", "response"} for an Idempotency-Key, or None.
+    """
+    if not redis_available():
+        return None
+    try:
+        cached = redis_client.get(idempotency_cache_key(key))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+    return json.loads(cached) if cached else None
+
+
+def set_idempotent_response(key: str, request_hash: str, response: dict):
+    if not redis_available():
+        return
+    try:
+        redis_client.setex(idempotency_cache_key(key), current_settings().idempotency_key_ttl, json.dumps({"request_hash": request_hash, "response": response}))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+async def aget_idempotent_response(key: str) -> Optional[dict]:
+    if not redis_available():
+        return None
+    try:
+        cached = await async_redis_client.get(idempotency_cache_key(key))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return None
+    return json.loads(cached) if cached else None
+
+
+async def aset_idempotent_response(key: str, request_hash: str, response: dict):
+    if not redis_available():
+        return
+    try:
+        await async_redis_client.setex(idempotency_cache_key(key), current_settings().idempotency_key_ttl, json.dumps({"request_hash": request_hash, "response": response}))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+# Single-flight cache fills. On a miss only one request per key recomputes the
+# value: requests in the same process wait for it in memory, and other workers
+# are held off by a short Redis lease (SET NX) and poll for the result, or get
+# the previous value while the fill runs.
+_RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_release_lease = redis_client.register_script(_RELEASE_LEASE)
+_arelease_lease = async_redis_client.register_script(_RELEASE_LEASE)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value = None
+        self.version = None
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _acquire_lease(kind: str, user_id: int) -> Optional[str]:
+    # Returns the lease token, "" when Redis is unavailable (fill locally), or None if another worker holds it
+    if not redis_available():
+        return ""
+    token = uuid.uuid4().hex
+    try:
+        acquired = redis_client.set(lease_key(kind, user_id), token, nx=True, px=int(CACHE_LEASE_SECONDS * 1000))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return ""
+    return token if acquired else None
+
+
+def _release(kind: str, user_id: int, token: str):
+    if not token or not redis_available():
+        return
+    try:
+        _release_lease(keys=[lease_key(kind, user_id)], args=[token])
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+def _set_local(user_id: int, kind: str, version: Optional[int], generation: int, value: Any):
+    # Only values that also went to Redis, and that no invalidation raced with
+    if version is not None and generation == _local_generation:
+        local_cache.set((kind, user_id), value)
+        local_versions.set((kind, user_id), version)
+
+
+def _fill(user_id: int, kind: str, version: Optional[int], stale: Optional[Any], compute: Callable[[], Any], ttl: int) -> Tuple[Any, Optional[int]]:
+    token = _acquire_lease(kind, user_id)
+    if token is None:
+        # Another worker is filling the entry: serve the old value, or wait for the new one
+        if stale is not None and CACHE_STALE_WHILE_REVALIDATE:
+            cache_requests.inc(kind, "stale")
+            return stale, None
+        deadline = time.monotonic() + CACHE_LEASE_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(CACHE_LEASE_POLL)
+            value, version, _ = _read_entry(user_id, kind)
+            if value is not None:
+                return value, version
+        # The other worker is taking too long, or failed; fill it ourselves
+
+    generation = _local_generation
+    try:
+        value = compute()
+        if value is not None:
+            set_user_cached(user_id, kind, version, value, ttl)
+            _set_local(user_id, kind, version, generation, value)
+        return value, version
+    finally:
+        _release(kind, user_id, token)
+
+
+def get_or_fill_user_cached(user_id: int, kind: str, compute: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+    """
+    Return a user's cached value, computing and caching it on a miss with
+    at most one concurrent `compute` per key.
+
+    Concurrent misses in this process wait for the first one's result. Across
+    workers, a Redis lease lets one worker recompute while the others serve
+    the previous (stale) value, or poll for the new one when there is none.
+
+    Parameters:
+    user_id (int): The ID of the user.
+    kind (str): The kind of cached value, e.g. ANALYTICS or TRANSACTIONS.
+    compute (Callable[[], Any]): Computes the value. A None result is returned but not cached.
+    ttl (int): The time to live of the cached value in seconds, CACHE_TTL by default.
+
+    Returns:
+    Any: The cached or freshly computed value.
+    """
+    return get_or_fill_versioned(user_id, kind, compute, ttl)[0]
+
+
+def get_or_fill_versioned(user_id: int, kind: str, compute: Callable[[], Any], ttl: Optional[int] = None) -> Tuple[Any, Optional[int]]:
+    """
+    get_or_fill_user_cached, also returning the cache version the value
+    belongs to: a freshly computed value was computed after that version was
+    read. The version is None when it isn't known, e.g. for a stale value.
+    """
+    value, version, stale = _read_entry(user_id, kind)
+    if value is not None:
+        return value, version
+
+    key = user_key(kind, user_id)
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if stale is not None and CACHE_STALE_WHILE_REVALIDATE:
+            cache_requests.inc(kind, "stale")
+            return stale, None
+        if flight.done.wait(CACHE_LEASE_SECONDS) and flight.ok:
+            return flight.value, flight.version
+        return compute(), None
+
+    try:
+        flight.value, flight.version = _fill(user_id, kind, version, stale, compute, ttl)
+        flight.ok = True
+        return flight.value, flight.version
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+_aflights: Dict[str, asyncio.Future] = {}
+_FILL_FAILED = object()
+
+
+async def _aacquire_lease(kind: str, user_id: int) -> Optional[str]:
+    if not redis_available():
+        return ""
+    token = uuid.uuid4().hex
+    try:
+        acquired = await async_redis_client.set(lease_key(kind, user_id), token, nx=True, px=int(CACHE_LEASE_SECONDS * 1000))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return ""
+    return token if acquired else None
+
+
+async def _arelease(kind: str, user_id: int, token: str):
+    if not token or not redis_available():
+        return
+    try:
+        await _arelease_lease(keys=[lease_key(kind, user_id)], args=[token])
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+
+
+async def _afill(user_id: int, kind: str, version: Optional[int], stale: Optional[Any], compute: Callable[[], Awaitable[Any]], ttl: int) -> Tuple[Any, Optional[int]]:
+    token = await _aacquire_lease(kind, user_id)
+    if token is None:
+        if stale is not None and CACHE_STALE_WHILE_REVALIDATE:
+            cache_requests.inc(kind, "stale")
+            return stale, None
+        deadline = time.monotonic() + CACHE_LEASE_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CACHE_LEASE_POLL)
+            value, version, _ = await _aread_entry(user_id, kind)
+            if value is not None:
+                return value, version
+
+    generation = _local_generation
+    try:
+        value = await compute()
+        if value is not None:
+            await aset_user_cached(user_id, kind, version, value, ttl)
+            _set_local(user_id, kind, version, generation, value)
+        return value, version
+    finally:
+        await _arelease(kind, user_id, token)
+
+
+async def aget_or_fill_user_cached(user_id: int, kind: str, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+    """
+    Async variant of get_or_fill_user_cached; `compute` is a coroutine function.
+    """
+    return (await aget_or_fill_versioned(user_id, kind, compute, ttl))[0]
+
+
+async def aget_or_fill_versioned(user_id: int, kind: str, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Tuple[Any, Optional[int]]:
+    value, version, stale = await _aread_entry(user_id, kind)
+    if value is not None:
+        return value, version
+
+    key = user_key(kind, user_id)
+    flight = _aflights.get(key)
+    if flight is not None:
+        if stale is not None and CACHE_STALE_WHILE_REVALIDATE:
+            cache_requests.inc(kind, "stale")
+            return stale, None
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight), CACHE_LEASE_SECONDS)
+        except asyncio.TimeoutError:
+            result = _FILL_FAILED
+        return result if result is not _FILL_FAILED else (await compute(), None)
+
+    flight = _aflights[key] = asyncio.get_running_loop().create_future()
+    result = _FILL_FAILED
+    try:
+        result = await _afill(user_id, kind, version, stale, compute, ttl)
+        return result
+    finally:
+        _aflights.pop(key, None)
+        flight.set_result(result)
+
+
+def get_or_fill_transaction_cached(transaction_id: int, compute: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+    """
+    get_or_fill_user_cached for a single transaction, versioned by its ID.
+    """
+    return get_or_fill_user_cached(transaction_id, TRANSACTION, compute, ttl)
+
+
+async def aget_or_fill_transaction_cached(transaction_id: int, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Any:
+    return await aget_or_fill_user_cached(transaction_id, TRANSACTION, compute, ttl)
+
+
+def get_or_fill_transaction_versioned(transaction_id: int, compute: Callable[[], Any], ttl: Optional[int] = None) -> Tuple[Any, Optional[int]]:
+    return get_or_fill_versioned(transaction_id, TRANSACTION, compute, ttl)
+
+
+async def aget_or_fill_transaction_versioned(transaction_id: int, compute: Callable[[], Awaitable[Any]], ttl: Optional[int] = None) -> Tuple[Any, Optional[int]]:
+    return await aget_or_fill_versioned(transaction_id, TRANSACTION, compute, ttl)
@@ -0,0 +1,165 @@
+"""
+Conditional GETs for transaction and analytics reads.
+
+GET /transactions/{transaction_id}, GET /transactions/ and
+GET /transactions/analytics/{user_id} send an ETag and, where known, a
+Last-Modified date derived from the cache version of the transaction or
+user. Every write through the CRUD functions sets that version to the Redis
+server time (see app.cache). A request whose If-None-Match, or without it
+If-Modified-Since, still matches the current version is answered with 304
+after one Redis round trip, without a database query or building the body.
+
+A response only gets validators when the version its body belongs to is
+known: not for stale values served while another request refills the
+cache, and not while Redis is unavailable. Writes that can't reach Redis
+change the version once it is back (see app.cache.invalidate_users).
+"""
+import math
+import time
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+
+from app.cache import acurrent_version, current_version
+
+# Versions below this (2001 in microseconds) are counters from before versions were times
+TIMESTAMP_VERSIONS = 10 ** 15
+# Clients may store the responses, but must revalidate them on every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(scope: str, owner_id: int, version: int) -> str:
+    # Weak, since the same version may be encoded by different code paths
+    return f'W/"{scope}-{owner_id}-{version}"'
+
+
+def modified_at(version: int) -> Optional[float]:
+    return version / 1_000_000 if version >= TIMESTAMP_VERSIONS else None
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    # Weak comparison, as required for If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag[2:] if tag.startswith("W/") else tag
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def is_not_modified(request: Request, tag: str, modified: Optional[float]) -> bool:
+    """
+    Whether the request's If-None-Match, or without it its If-Modified-Since,
+    matches the current representation.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # `*` asks whether the resource exists, which the version doesn't
+        # tell (reads start versions of any ID), so the lookup answers it
+        return if_none_match.strip() != "*" and etag_matches(if_none_match, tag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return math.floor(modified) <= since.timestamp()
+
+
+class ConditionalRead:
+    """
+    The validators of a read of a user's ('user') or a transaction's
+    ('transaction') data.
+
+    Routes return the 304 from check() when there is one. Otherwise they
+    build the body and label() the response with the version the body
+    belongs to: the one returned by app.cache.get_or_fill_versioned, or
+    current() read before querying the database.
+    """
+
+    def __init__(self, request: Request, scope: str, owner_id: int):
+        self.request = request
+        self.scope = scope
+        self.owner_id = owner_id
+        self.version = None
+        self.started = False
+        self._read = False
+
+    @property
+    def conditional(self) -> bool:
+        headers = self.request.headers
+        if "if-none-match" in headers:
+            return headers["if-none-match"].strip() != "*"
+        return "if-modified-since" in headers
+
+    def current(self) -> Optional[int]:
+        """
+        The current version, read from Redis once per request. None when Redis is unavailable.
+        """
+        if not self._read:
+            self.version, self.started = current_version(self.scope, self.owner_id)
+            self._read = True
+        return self.version
+
+    async def acurrent(self) -> Optional[int]:
+        if not self._read:
+            self.version, self.started = await acurrent_version(self.scope, self.owner_id)
+            self._read = True
+        return self.version
+
+    def check(self) -> Optional[Response]:
+        """
+        The 304 response, if the request is conditional and still matches.
+        """
+        if self.conditional:
+            return self._not_modified(self.current())
+        return None
+
+    async def acheck(self) -> Optional[Response]:
+        if self.conditional:
+            return self._not_modified(await self.acurrent())
+        return None
+
+    def label(self, response: Response, version: Optional[int]):
+        """
+        Set the validators of a body built from `version` on the response.
+        """
+        if version == 0 and not self._read:
+            # No write since the version was lost, or ever: start it now.
+            # Only if this request started it, no write came in between.
+            self.current()
+        self._set_headers(response, self._label_version(version))
+
+    async def alabel(self, response: Response, version: Optional[int]):
+        if version == 0 and not self._read:
+            await self.acurrent()
+        self._set_headers(response, self._label_version(version))
+
+    def _label_version(self, version: Optional[int]) -> Optional[int]:
+        if version == 0:
+            return self.version if self.started else None
+        if version is None or (self._read and version != self.version):
+            # Stale, or written to since the current version was read
+            return None
+        return version
+
+    def _not_modified(self, version: Optional[int]) -> Optional[Response]:
+        if version is None or not is_not_modified(self.request, etag(self.scope, self.owner_id, version), modified_at(version)):
+            return None
+        response = Response(status_code=304)
+        self._set_headers(response, version)
+        return response
+
+    def _set_headers(self, response: Response, version: Optional[int]):
+        if version is None:
+            return
+        response.headers["ETag"] = etag(self.scope, self.owner_id, version)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        modified = modified_at(version)
+        # A write later in the same second would keep the same Last-Modified,
+        # so it is only sent once that second is over
+        if modified is not None and math.floor(modified) < math.floor(time.time()):
+            response.headers["Last-Modified"] = formatdate(math.floor(modified), usegmt=True)
@@ -0,0 +1,307 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.archive import has_archives, iter_archived_rows
+from app.models.models import Transaction, UserAnalytics, UserDailyCount
+
+
+def _transaction_day(transaction_date: Optional[datetime]) -> date:
+    if transaction_date is None:
+        return datetime.now().date()
+    if isinstance(transaction_date, datetime):
+        return transaction_date.date()
+    return transaction_date
+
+
+def _upsert(db: Session):
+    # INSERT ... ON CONFLICT DO UPDATE, on Postgres and SQLite alike
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+
+def _is_top_day(count: int, day: date, top_count: int, top_day: Optional[date]) -> bool:
+    # The day with the most transactions, the earliest on a tie, like rebuild_user_analytics
+    return count > top_count or (count == top_count and top_day is not None and day < top_day)
+
+
+def _refresh_top_day(db: Session, user_id: int):
+    # Only the per-day histogram is read here, never the transaction history
+    top = db.execute(
+        select(UserDailyCount.day, UserDailyCount.transaction_count)
+        .where(UserDailyCount.user_id == user_id, UserDailyCount.transaction_count > 0)
+        .order_by(UserDailyCount.transaction_count.desc(), UserDailyCount.day.asc())
+        .limit(1)
+    ).first()
+    _set_top_day(db, user_id, top.day if top else None, top.transaction_count if top else 0)
+
+
+def _set_top_day(db: Session, user_id: int, day: Optional[date], count: int):
+    db.execute(update(UserAnalytics).where(UserAnalytics.user_id == user_id).values(top_day=day, top_day_count=count))
+
+
+def apply_transaction_delta(db: Session, user_id: int, amount: float, transaction_date: Optional[datetime], sign: int = 1, count: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) transactions from a user's running aggregates.
+
+    Both rows are changed with upserts, which insert a missing row or lock an
+    existing one, so concurrent writes for a new user or day can't overwrite
+    each other. The changes are not committed, so they land in the same
+    database transaction as the caller's insert, update or delete.
+
+    Parameters:
+    db (Session): The database session.
+    user_id (int): The ID of the user the transactions belong to.
+    amount (float): The summed amount of the transactions.
+    transaction_date (datetime): The date of the transactions.
+    sign (int): 1 to add the transactions, -1 to remove them.
+    count (int): The number of transactions on that day. Default is 1.
+    """
+    day = _transaction_day(transaction_date)
+    insert = _upsert(db)
+
+    stats_insert = insert(UserAnalytics).values(
+        user_id=user_id, total_value=sign * amount, transaction_count=sign * count, top_day=None, top_day_count=0,
+    )
+    stats = db.execute(
+        stats_insert.on_conflict_do_update(
+            index_elements=[UserAnalytics.user_id],
+            set_={
+                "total_value": UserAnalytics.total_value + stats_insert.excluded.total_value,
+                "transaction_count": UserAnalytics.transaction_count + stats_insert.excluded.transaction_count,
+            },
+        ).returning(UserAnalytics.transaction_count, UserAnalytics.top_day, UserAnalytics.top_day_count)
+    ).one()
+
+    daily_insert = insert(UserDailyCount).values(user_id=user_id, day=day, transaction_count=sign * count)
+    daily_count = db.execute(
+        daily_insert.on_conflict_do_update(
+            index_elements=[UserDailyCount.user_id, UserDailyCount.day],
+            set_={"transaction_count": UserDailyCount.transaction_count + daily_insert.excluded.transaction_count},
+        ).returning(UserDailyCount.transaction_count)
+    ).scalar_one()
+
+    if sign > 0:
+        if _is_top_day(daily_count, day, stats.top_day_count, stats.top_day):
+            _set_top_day(db, user_id, day, daily_count)
+    else:
+        if daily_count <= 0:
+            db.execute(delete(UserDailyCount).where(UserDailyCount.user_id == user_id, UserDailyCount.day == day))
+        if stats.transaction_count <= 0:
+            db.execute(
+                update(UserAnalytics)
+                .where(UserAnalytics.user_id == user_id)
+                .values(total_value=0.0, transaction_count=0, top_day=None, top_day_count=0)
+            )
+        elif stats.top_day == day:
+            _refresh_top_day(db, user_id)
+
+
+def get_user_analytics_summary(db: Session, user_id: int):
+    """
+    Read a user's analytics from the running aggregates.
+
+    Parameters:
+    db (Session): The database session.
+    user_id (int): The ID of the user.
+
+    Returns:
+    dict: The user's analytics, or None if the user has no transactions.
+    """
+    stats = db.get(UserAnalytics, user_id)
+    if stats is None or stats.transaction_count <= 0:
+        return None
+
+    return {
+        "average_transaction_value": stats.total_value / stats.transaction_count,
+        "day_with_most_transactions": stats.top_day.isoformat() if stats.top_day else None,
+        "total_transaction_count": stats.transaction_count,
+    }
+
+
+def rebuild_user_analytics(db: Session, user_ids: Optional[Iterable[int]] = None):
+    """
+    Recompute the running aggregates from the transactions table with SQL
+    GROUP BY queries, plus the archived transactions. Used to backfill
+    existing data and after bulk loads that write rows without going through
+    the CRUD functions.
+
+    Parameters:
+    db (Session): The database session.
+    user_ids (Iterable[int]): Restrict the rebuild to these users. Default is all users.
+    """
+    day = func.date(Transaction.transaction_date)
+    daily_query = db.query(Transaction.user_id, day, func.count(Transaction.id)).group_by(Transaction.user_id, day)
+    totals_query = db.query(Transaction.user_id, func.sum(Transaction.transaction_amount), func.count(Transaction.id)).group_by(Transaction.user_id)
+    stats_delete = db.query(UserAnalytics)
+    daily_delete = db.query(UserDailyCount)
+
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        daily_query = daily_query.filter(Transaction.user_id.in_(user_ids))
+        totals_query = totals_query.filter(Transaction.user_id.in_(user_ids))
+        stats_delete = stats_delete.filter(UserAnalytics.user_id.in_(user_ids))
+        daily_delete = daily_delete.filter(UserDailyCount.user_id.in_(user_ids))
+
+    stats_delete.delete(synchronize_session=False)
+    daily_delete.delete(synchronize_session=False)
+
+    daily_counts = defaultdict(int)
+    totals = defaultdict(lambda: [0.0, 0])
+    for user_id, transaction_day, transaction_count in daily_query:
+        if isinstance(transaction_day, str):
+            transaction_day = date.fromisoformat(transaction_day)
+        daily_counts[(user_id, transaction_day)] += transaction_count
+    for user_id, total_value, transaction_count in totals_query:
+        totals[user_id][0] += total_value or 0.0
+        totals[user_id][1] += transaction_count
+
+    # Archived transactions still count towards the aggregates
+    if has_archives():
+        wanted = set(user_ids) if user_ids is not None else None
+        for _, user_id, _, transaction_date, amount, _ in iter_archived_rows():
+            if wanted is not None and user_id not in wanted:
+                continue
+            daily_counts[(user_id, _transaction_day(transaction_date))] += 1
+            totals[user_id][0] += amount
+            totals[user_id][1] += 1
+
+    top_days = {}
+    daily_rows = []
+    for (user_id, transaction_day), transaction_count in daily_counts.items():
+        daily_rows.append({"user_id": user_id, "day": transaction_day, "transaction_count": transaction_count})
+        best = top_days.get(user_id)
+        if best is None or (transaction_count, -transaction_day.toordinal()) > (best[1], -best[0].toordinal()):
+            top_days[user_id] = (transaction_day, transaction_count)
+
+    stats_rows = []
+    for user_id, (total_value, transaction_count) in totals.items():
+        top_day, top_day_count = top_days.get(user_id, (None, 0))
+        stats_rows.append({
+            "user_id": user_id,
+            "total_value": total_value,
+            "transaction_count": transaction_count,
+            "top_day": top_day,
+            "top_day_count": top_day_count,
+        })
+
+    if daily_rows:
+        db.bulk_insert_mappings(UserDailyCount, daily_rows)
+    if stats_rows:
+        db.bulk_insert_mappings(UserAnalytics, stats_rows)
+    db.flush()
+
+
+BUCKETS = ("day", "week", "month")
+
+
+def _bucket_expression(dialect_name: str, bucket: str):
+    column = Transaction.transaction_date
+    if dialect_name == "postgresql":
+        return func.date_trunc(bucket, column)
+    # SQLite has no date_trunc; weeks start on Monday like Postgres
+    if bucket == "week":
+        return func.date(column, "weekday 0", "-6 days")
+    if bucket == "month":
+        return func.strftime("%Y-%m-01", column)
+    return func.date(column)
+
+
+def _python_bucket_start(value: datetime, bucket: str) -> str:
+    day = value.date()
+    if bucket == "week":
+        day -= timedelta(days=day.weekday())
+    elif bucket == "month":
+        day = day.replace(day=1)
+    return day.isoformat()
+
+
+def _bucket_start(value) -> str:
+    if isinstance(value, str):
+        return value[:10]
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return value.isoformat()
+
+
+def get_user_analytics_buckets(db: Session, user_id: int, bucket: str = "day", start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Aggregate a user's transactions into day, week or month buckets in SQL.
+
+    Only one row per bucket leaves the database. The query is served by the
+    (user_id, transaction_date) index.
+
+    Parameters:
+    db (Session): The database session.
+    user_id (int): The ID of the user.
+    bucket (str): 'day', 'week' or 'month'. Default is 'day'.
+    start (datetime): Only include transactions at or after this time.
+    end (datetime): Only include transactions before this time.
+
+    Archived months (see app.archive) are read from the archive files and
+    merged in.
+
+    Returns:
+    List[dict]: Per-bucket sums, counts and credit/debit splits, oldest first.
+    """
+    bucket_start = _bucket_expression(db.get_bind().dialect.name, bucket).label("bucket_start")
+    is_credit = Transaction.transaction_type == "credit"
+    amount = Transaction.transaction_amount
+
+    query = (
+        select(
+            bucket_start,
+            func.sum(amount),
+            func.count(Transaction.id),
+            func.sum(case((is_credit, amount), else_=0)),
+            func.sum(case((is_credit, 0), else_=amount)),
+            func.sum(case((is_credit, 1), else_=0)),
+        )
+        .where(Transaction.user_id == user_id)
+        .group_by(bucket_start)
+        .order_by(bucket_start)
+    )
+    if start is not None:
+        query = query.where(Transaction.transaction_date >= start)
+    if end is not None:
+        query = query.where(Transaction.transaction_date < end)
+
+    buckets = [
+        {
+            "start": _bucket_start(row_start),
+            "total_amount": total_amount,
+            "transaction_count": transaction_count,
+            "credit_amount": credit_amount,
+            "debit_amount": debit_amount,
+            "credit_count": credit_count,
+            "debit_count": transaction_count - credit_count,
+        }
+        for row_start, total_amount, transaction_count, credit_amount, debit_amount, credit_count in db.execute(query)
+    ]
+    if has_archives():
+        buckets = _merge_archived_buckets(buckets, user_id, bucket, start, end)
+    return buckets
+
+
+def _merge_archived_buckets(buckets, user_id: int, bucket: str, start: Optional[datetime], end: Optional[datetime]):
+    # Archived months are aggregated in Python and merged into the SQL buckets
+    by_start = {entry["start"]: entry for entry in buckets}
+    for _, _, _, transaction_date, amount, transaction_type in iter_archived_rows(user_id, start, end):
+        if transaction_date is None:
+            continue
+        key = _python_bucket_start(transaction_date, bucket)
+        entry = by_start.get(key)
+        if entry is None:
+            entry = by_start[key] = {
+                "start": key, "total_amount": 0.0, "transaction_count": 0, "credit_amount": 0.0,
+                "debit_amount": 0.0, "credit_count": 0, "debit_count": 0,
+            }
+        entry["total_amount"] += amount
+        entry["transaction_count"] += 1
+        side = "credit" if transaction_type == "credit" else "debit"
+        entry[f"{side}_amount"] += amount
+        entry[f"{side}_count"] += 1
+    return [by_start[key] for key in sorted(by_start)]
@@ -0,0 +1,157 @@
+from fastapi import HTTPException, BackgroundTasks
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import Transaction
+from app.schemas.transaction_schemas import TransactionCreate, encrypt_name
+from app.crud.analytics_crud import apply_transaction_delta, get_user_analytics_summary
+from app.crud.idempotency_crud import claim_idempotency_key
+from app.crud.transaction_crud import (
+    TRANSACTION_COLUMNS,
+    transactions_page_query,
+    paginate,
+)
+from app.cache import ainvalidate_user
+from app.jobs import aschedule_transaction_jobs
+from app.outbox import CREATED, DELETED, UPDATED, add_outbox_events
+
+# Async versions of the functions in transaction_crud, used when ASYNC_MODE is
+# enabled. The analytics helpers are shared with the sync path through
+# AsyncSession.run_sync, which still runs their queries on the async driver.
+
+
+async def get_transactions(db: AsyncSession, skip: int = 0, limit: int = 10, user_id: int = None):
+    """
+    Retrieve a list of transactions from the database.
+
+    Parameters:
+    db (AsyncSession): The async database session dependency.
+    skip (int): The number of records to skip for pagination. Default is 0.
+    limit (int): The maximum number of records to return. Default is 10.
+    user_id (int): The ID of the user whose transactions to retrieve.
+
+    Returns:
+    List[Transaction]: A list of transaction records.
+    """
+    query = select(Transaction)
+
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+
+    return (await db.scalars(query.offset(skip).limit(limit))).all()
+
+
+async def get_transaction_rows_page(db: AsyncSession, user_id: int, limit: int = 100, cursor: str = None):
+    """
+    Async variant of app.crud.transaction_crud.get_transaction_rows_page.
+    """
+    rows = (await db.execute(transactions_page_query(user_id, limit, cursor, TRANSACTION_COLUMNS))).all()
+    return paginate(rows, limit)
+
+
+async def get_transaction(db: AsyncSession, transaction_id: int):
+    """
+    Retrieve a single transaction from the database by ID.
+
+    Parameters:
+    db (AsyncSession): The async database session dependency.
+    transaction_id (int): The ID of the transaction to retrieve.
+
+    Returns:
+    Transaction: The transaction record with the given ID, or None.
+    """
+    return await db.get(Transaction, transaction_id)
+
+
+async def get_user_analytics(db: AsyncSession, user_id: int):
+    """
+    Read a user's analytics from the running aggregates.
+
+    Parameters:
+    db (AsyncSession): The async database session dependency.
+    user_id (int): The ID of the user.
+
+    Returns:
+    dict: The user's analytics, or None if the user has no transactions.
+    """
+    return await db.run_sync(get_user_analytics_summary, user_id)
+
+
+async def create_transaction(db: AsyncSession, transaction: dict, background_tasks: BackgroundTasks, idempotency_key: str = None, request_hash: str = None):
+    """
+    Create a new transaction in the database.
+
+    Parameters:
+    db (AsyncSession): The async database session.
+    transaction (dict): The transaction data, including the encrypted full_name.
+    background_tasks (BackgroundTasks): The background tasks dependency.
+    idempotency_key (str): Record this Idempotency-Key with the transaction, atomically.
+    request_hash (str): The fingerprint of the request body, stored with the key.
+
+    Returns:
+    Transaction: The created transaction record.
+    """
+    db_transaction = Transaction(**transaction)
+    db.add(db_transaction)
+    await db.flush()
+    if db_transaction.transaction_date is None:
+        await db.refresh(db_transaction)
+    if idempotency_key is not None:
+        await db.run_sync(claim_idempotency_key, idempotency_key, request_hash, db_transaction.id)
+
+    await db.run_sync(apply_transaction_delta, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date)
+    await db.run_sync(add_outbox_events, CREATED, [db_transaction])
+    await db.commit()
+    await ainvalidate_user(db_transaction.user_id, [db_transaction.id])
+
+    await aschedule_transaction_jobs(background_tasks, [(db_transaction.id, db_transaction.user_id)])
+
+    return db_transaction
+
+
+async def update_transaction(db: AsyncSession, transaction_id: int, transaction: TransactionCreate):
+    """
+    Update an existing transaction in the database.
+
+    Parameters:
+    db (AsyncSession): The async database session dependency.
+    transaction_id (int): The ID of the transaction to update.
+    transaction (TransactionCreate): The updated transaction data.
+    Returns:
+    Transaction: The updated transaction record.
+    """
+    db_transaction = await db.get(Transaction, transaction_id)
+    if db_transaction is None:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    await db.run_sync(apply_transaction_delta, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date, -1)
+    db_transaction.full_name = encrypt_name(transaction.full_name)
+    db_transaction.transaction_date = transaction.transaction_date
+    db_transaction.transaction_amount = transaction.transaction_amount
+    db_transaction.transaction_type = transaction.transaction_type
+    await db.run_sync(apply_transaction_delta, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date)
+    await db.run_sync(add_outbox_events, UPDATED, [db_transaction])
+    await db.commit()
+    await ainvalidate_user(db_transaction.user_id, [transaction_id])
+    return db_transaction
+
+
+async def delete_transaction(db: AsyncSession, transaction_id: int):
+    """
+    Delete a transaction from the database by ID.
+
+    Parameters:
+    db (AsyncSession): The async database session dependency.
+    transaction_id (int): The ID of the transaction to delete.
+    Returns:
+    Transaction: The deleted transaction record.
+    """
+    db_transaction = await db.get(Transaction, transaction_id)
+    if db_transaction is None:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    await db.run_sync(apply_transaction_delta, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date, -1)
+    await db.run_sync(add_outbox_events, DELETED, [db_transaction])
+    await db.delete(db_transaction)
+    await db.commit()
+    await ainvalidate_user(db_transaction.user_id, [transaction_id])
+    return db_transaction
@@ -0,0 +1,77 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from app.models.models import IdempotencyKey, Transaction
+from app.settings import current_settings
+
+
+def request_fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _expiry_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=current_settings().idempotency_key_ttl)
+
+
+def check_request_hash(stored_hash: str, request_hash: str):
+    if stored_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+
+def claim_idempotency_key(db: Session, key: str, request_hash: str, transaction_id: int):
+    """
+    Record `key` for a transaction that was just flushed, in the same database
+    transaction. If another request committed the same key first, the flush
+    raises IntegrityError; on Postgres a concurrent request holding the key
+    makes this wait until that request commits or rolls back.
+
+    Parameters:
+    db (Session): The database session.
+    key (str): The Idempotency-Key header.
+    request_hash (str): The fingerprint of the request body.
+    transaction_id (int): The ID of the created transaction.
+    """
+    # An expired key may be reused
+    db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.created_at < _expiry_cutoff()))
+    db.add(IdempotencyKey(key=key, request_hash=request_hash, transaction_id=transaction_id, created_at=datetime.now(timezone.utc)))
+    db.flush()
+
+
+def get_idempotent_transaction(db: Session, key: str, request_hash: str) -> Optional[Transaction]:
+    """
+    Return the transaction created by an earlier request with `key`, or None
+    if the key is unknown or expired.
+
+    Raises:
+    HTTPException: 422 if the key was used for a different request body, or
+    409 if the transaction it created has since been deleted.
+    """
+    record = db.get(IdempotencyKey, key)
+    if record is None:
+        return None
+    created_at = record.created_at if record.created_at.tzinfo else record.created_at.replace(tzinfo=timezone.utc)
+    if created_at < _expiry_cutoff():
+        return None
+    check_request_hash(record.request_hash, request_hash)
+    transaction = db.get(Transaction, record.transaction_id)
+    if transaction is None:
+        raise HTTPException(status_code=409, detail="The transaction created with this Idempotency-Key no longer exists")
+    return transaction
+
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    """
+    Delete expired keys. Expired keys are ignored and replaced anyway, so this
+    only keeps the table small.
+
+    Returns:
+    int: The number of keys deleted.
+    """
+    deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _expiry_cutoff())).rowcount
+    db.commit()
+    return deleted
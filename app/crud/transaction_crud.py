@@ -1,7 +1,23 @@
+import base64
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
 from fastapi import HTTPException, BackgroundTasks
+from sqlalchemy import insert, select, text, tuple_
 from sqlalchemy.orm import Session
 from app.models.models import Transaction
-from app.schemas.transaction_schemas import TransactionCreate, TransactionResponse
+from app.schemas.transaction_schemas import TransactionCreate, TransactionResponse, encode_transaction_rows, encrypt_name, encrypt_payload
+from app.archive import iter_archived_rows
+from app.crud.analytics_crud import apply_transaction_delta
+from app.crud.idempotency_crud import claim_idempotency_key
+from app.cache import invalidate_user, invalidate_users
+from app.jobs import schedule_transaction_jobs
+from app.outbox import CREATED, DELETED, UPDATED, add_outbox_events
+from app.metrics import timed_task
 from fastapi import BackgroundTasks
 
 # background tasks
@@ -17,6 +33,17 @@ def recalculate_credit_score(transaction_id: int):
     # Logic to recalculate credit score
     print("Recalculating credit score for transaction ID: ", transaction_id)
 
+# Only the whole batch is timed: the steps run inside it, so timing them too
+# would count their time twice in background_task_duration_seconds
+@timed_task
+def process_transaction_batch(transaction_ids_by_user: Dict[int, List[int]]):
+    # Background work for a batch of jobs, with one credit score recalculation per user
+    for user_id, transaction_ids in transaction_ids_by_user.items():
+        for transaction_id in transaction_ids:
+            update_user_statistics(transaction_id)
+            send_notification(transaction_id)
+        recalculate_credit_score(transaction_ids[-1])
+
 def get_transactions(db: Session, skip: int = 0, limit: int = 10, user_id: int = None):
     """
     Retrieve a list of transactions from the database.
@@ -34,11 +61,128 @@ def get_transactions(db: Session, skip: int = 0, limit: int = 10, user_id: int =
 
     if user_id is not None:
         query = query.filter(Transaction.user_id == user_id)
-        return query.all()
 
     return query.offset(skip).limit(limit).all()
 
 
+def encode_cursor(transaction: Transaction) -> str:
+    """
+    Build an opaque continuation token pointing just past `transaction`.
+    """
+    position = [transaction.transaction_date.isoformat(), transaction.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        transaction_date, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(transaction_date), int(transaction_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Plain column tuples for the read paths that don't need ORM objects
+TRANSACTION_COLUMNS = (
+    Transaction.id,
+    Transaction.user_id,
+    Transaction.full_name,
+    Transaction.transaction_date,
+    Transaction.transaction_amount,
+    Transaction.transaction_type,
+)
+
+# The page size of GET /transactions/ when no limit is given, which is the page cache warm-up fills
+DEFAULT_PAGE_LIMIT = 100
+
+
+def transactions_page_query(user_id: int, limit: int, cursor: Optional[str] = None, columns=None):
+    """
+    Build the keyset pagination query for a user's transactions, newest first.
+
+    Pages are ordered by (transaction_date, id) and each page starts strictly
+    after the cursor, so the cost of a page doesn't grow with its depth.
+    One extra row is selected to tell whether another page follows.
+    Selects Transaction objects, or only `columns` when given.
+    """
+    query = (
+        (select(*columns) if columns is not None else select(Transaction))
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.transaction_date.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(Transaction.transaction_date, Transaction.id) < tuple_(cursor_date, cursor_id),
+            # Redundant with the row comparison, but lets Postgres prune newer partitions
+            Transaction.transaction_date <= cursor_date,
+        )
+    return query
+
+
+def paginate(transactions: List[Transaction], limit: int) -> Tuple[List[Transaction], Optional[str]]:
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        return transactions, encode_cursor(transactions[-1])
+    return transactions, None
+
+
+def get_transaction_rows_page(db: Session, user_id: int, limit: int = 100, cursor: Optional[str] = None):
+    """
+    Retrieve one page of a user's transactions using keyset pagination, as
+    plain TRANSACTION_COLUMNS rows for responses that are serialized straight
+    from the rows.
+
+    Parameters:
+    db (Session): The database session dependency.
+    user_id (int): The ID of the user whose transactions to retrieve.
+    limit (int): The maximum number of records to return. Default is 100.
+    cursor (str): The continuation token returned with the previous page.
+
+    Returns:
+    Tuple[List[Row], str]: The rows and the token for the next page, or None
+    if this is the last page.
+    """
+    rows = db.execute(transactions_page_query(user_id, limit, cursor, TRANSACTION_COLUMNS)).all()
+    return paginate(rows, limit)
+
+
+def first_page_entry(rows, next_cursor: Optional[str], limit: int) -> dict:
+    """
+    The cached form of a user's first page of transactions (TRANSACTIONS):
+    the encoded rows, encrypted, with the limit they were fetched with.
+    """
+    return {"limit": limit, "next_cursor": next_cursor, "body": encrypt_payload(encode_transaction_rows(rows))}
+
+
+def iter_user_transaction_rows(db: Session, user_id: int, batch_size: int = 1000):
+    """
+    Stream a user's transactions as plain column tuples, oldest first.
+
+    Rows are fetched `batch_size` at a time through a server-side cursor where
+    the driver supports one, so memory stays flat however long the history is.
+
+    Parameters:
+    db (Session): The database session.
+    user_id (int): The ID of the user whose transactions to export.
+    batch_size (int): The number of rows fetched per round trip. Default is 1000.
+
+    Archived transactions (see app.archive) come first, as they are older than
+    everything still in the database.
+
+    Yields:
+    Row: (id, user_id, full_name, transaction_date, transaction_amount, transaction_type)
+    """
+    yield from iter_archived_rows(user_id)
+    query = (
+        select(*TRANSACTION_COLUMNS)
+        .where(Transaction.user_id == user_id)
+        .order_by(Transaction.transaction_date, Transaction.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield from db.execute(query)
+
+
 def get_transaction(db: Session, transaction_id: int):
     """
     Retrieve a single transaction from the database by ID.
@@ -50,10 +194,11 @@ def get_transaction(db: Session, transaction_id: int):
     Returns:
     TransactionResponse: The transaction record with the given ID.
     """
+    # Not pruned on a partitioned table, see app.partitions
     return db.query(Transaction).filter(Transaction.id == transaction_id).first()
 
 
-def create_transaction(db: Session, transaction: dict, background_tasks: BackgroundTasks):
+def create_transaction(db: Session, transaction: dict, background_tasks: BackgroundTasks, idempotency_key: Optional[str] = None, request_hash: Optional[str] = None):
     """
     Create a new transaction in the database.
 
@@ -61,19 +206,32 @@ def create_transaction(db: Session, transaction: dict, background_tasks: Backgro
     db (Session): The database session.
     transaction (dict): The transaction data, including the encrypted full_name.
     background_tasks (BackgroundTasks): The background tasks dependency.
+    idempotency_key (str): Record this Idempotency-Key with the transaction, atomically.
+    request_hash (str): The fingerprint of the request body, stored with the key.
 
     Returns:
     dict: The created transaction data.
+
+    Raises:
+    IntegrityError: If another request already created a transaction with `idempotency_key`.
     """
     db_transaction = Transaction(**transaction)
     db.add(db_transaction)
+    db.flush()
+    if db_transaction.transaction_date is None:
+        db.refresh(db_transaction)
+    if idempotency_key is not None:
+        claim_idempotency_key(db, idempotency_key, request_hash, db_transaction.id)
+
+    # Keep the user's running analytics in the same database transaction
+    apply_transaction_delta(db, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date)
+    add_outbox_events(db, CREATED, [db_transaction])
     db.commit()
     db.refresh(db_transaction)
+    invalidate_user(db_transaction.user_id, [db_transaction.id])
 
-    # Run background tasks after the transaction is created
-    background_tasks.add_task(update_user_statistics, db_transaction.id)
-    background_tasks.add_task(send_notification, db_transaction.id)
-    background_tasks.add_task(recalculate_credit_score, db_transaction.id)
+    # Queue the post-create work for app.worker instead of running it in the web worker
+    schedule_transaction_jobs(background_tasks, [(db_transaction.id, db_transaction.user_id)])
 
     return db_transaction.__dict__
 
@@ -91,12 +249,16 @@ def update_transaction(db: Session, transaction_id: int, transaction: Transactio
     """
     db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
     if db_transaction:
-        db_transaction.full_name = transaction.full_name
+        apply_transaction_delta(db, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date, sign=-1)
+        db_transaction.full_name = encrypt_name(transaction.full_name)
         db_transaction.transaction_date = transaction.transaction_date
         db_transaction.transaction_amount = transaction.transaction_amount
         db_transaction.transaction_type = transaction.transaction_type
+        apply_transaction_delta(db, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date)
+        add_outbox_events(db, UPDATED, [db_transaction])
         db.commit()
         db.refresh(db_transaction)
+        invalidate_user(db_transaction.user_id, [transaction_id])
         return db_transaction
     else:
         raise HTTPException(status_code=404, detail="Transaction not found")
@@ -114,8 +276,99 @@ def delete_transaction(db: Session, transaction_id: int):
     """
     db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
     if db_transaction:
+        apply_transaction_delta(db, db_transaction.user_id, db_transaction.transaction_amount, db_transaction.transaction_date, sign=-1)
+        user_id = db_transaction.user_id
+        add_outbox_events(db, DELETED, [db_transaction])
         db.delete(db_transaction)
         db.commit()
+        invalidate_user(user_id, [transaction_id])
         return db_transaction
     else:
-        raise HTTPException(status_code=404, detail="Transaction not found")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+
+BULK_COLUMNS = ("user_id", "full_name", "transaction_date", "transaction_amount", "transaction_type")
+
+
+def _copy_transactions(db: Session, rows: List[dict]) -> List[int]:
+    # Reserve ids from the sequence up front so COPY can report them per row
+    ids = list(db.execute(
+        text("SELECT nextval(pg_get_serial_sequence('transactions', 'id')) FROM generate_series(1, :n)"),
+        {"n": len(rows)},
+    ).scalars())
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for transaction_id, row in zip(ids, rows):
+        writer.writerow([transaction_id] + [row[column] for column in BULK_COLUMNS])
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY transactions (id, {', '.join(BULK_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+    return ids
+
+
+def use_copy(db: Session) -> bool:
+    """
+    Whether bulk inserts can use COPY, i.e. the session is bound to Postgres
+    through psycopg2.
+    """
+    bind = db.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+def bulk_create_transactions(db: Session, transactions: List[dict], background_tasks: BackgroundTasks, copy: bool = False) -> List[int]:
+    """
+    Insert a batch of transactions in a single database transaction.
+
+    Rows are written with one multi-row INSERT ... RETURNING, or with COPY on
+    Postgres when `copy` is set. The running analytics are updated once per
+    user and day rather than once per row, and the jobs for the whole batch
+    are queued in one pipeline.
+
+    Parameters:
+    db (Session): The database session.
+    transactions (List[dict]): The transaction data, with full_name already encrypted.
+    background_tasks (BackgroundTasks): The background tasks dependency.
+    copy (bool): Use COPY instead of INSERT. Requires Postgres with psycopg2.
+
+    Returns:
+    List[int]: The IDs of the created transactions, in input order.
+    """
+    if not transactions:
+        return []
+
+    try:
+        if copy:
+            ids = _copy_transactions(db, transactions)
+        else:
+            ids = list(db.execute(
+                insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True),
+                transactions,
+            ).scalars())
+
+        deltas = defaultdict(lambda: [0.0, 0])
+        for row in transactions:
+            delta = deltas[(row["user_id"], row["transaction_date"].date())]
+            delta[0] += row["transaction_amount"]
+            delta[1] += 1
+        # In key order, so concurrent batches lock the analytics rows in the same order and can't deadlock
+        for (user_id, day), (amount, count) in sorted(deltas.items()):
+            apply_transaction_delta(db, user_id, amount, day, count=count)
+        add_outbox_events(db, CREATED, ({"id": transaction_id, **row} for transaction_id, row in zip(ids, transactions)))
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    invalidate_users({row["user_id"] for row in transactions})
+    schedule_transaction_jobs(background_tasks, [(transaction_id, row["user_id"]) for transaction_id, row in zip(ids, transactions)])
+
+    return ids
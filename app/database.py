@@ -1,23 +1,198 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-import os
-from dotenv import load_dotenv
+import itertools
+import logging
+import threading
+import time
+from typing import List, Optional
 
-load_dotenv()
-print("Environment variables loaded.")
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
+from app.cache import arecently_written, recently_written
+from app.metrics import db_statement_duration, record_timing
+from app.settings import Settings, settings
 
-# Create an engine
-DATABASE_URL = os.getenv('DATABASE_URL')
+logger = logging.getLogger(__name__)
 
-if DATABASE_URL is None:
-    print("DATABASE_URL not found in environment.")
-else:
-    print(DATABASE_URL)
-    
-engine = create_engine(DATABASE_URL, echo=True)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class PoolMetrics:
+    """
+    Connection pool counters for one engine, used to size pools per worker.
+
+    wait_seconds covers the time spent in the pool to obtain a connection,
+    including opening a new one when the pool has room to grow.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # The latest wait, for load shedding
+        self.last_wait_seconds = 0.0
+        self.last_wait_at = 0.0
+        self._lock = threading.Lock()
+        self.pool = None
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += not timed_out
+            self.timeouts += timed_out
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            self.last_wait_seconds = seconds
+            self.last_wait_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        data = {
+            "engine": self.name,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+        if isinstance(self.pool, QueuePool):
+            data.update({
+                "size": self.pool.size(),
+                "checked_out": self.pool.checkedout(),
+                "checked_in": self.pool.checkedin(),
+                "overflow": self.pool.overflow(),
+            })
+        return data
+
+
+pool_metrics = {}
+
+
+def _instrumented(pool_class, metrics: PoolMetrics):
+    # Pool events only fire once a connection has been obtained, so time the wait around _do_get
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.record_wait(time.perf_counter() - start, timed_out=True)
+                raise
+            metrics.record_wait(time.perf_counter() - start)
+            return connection
+
+    return InstrumentedPool
+
+
+def engine_options(url: str, config: Settings, name: str, is_async: bool = False) -> dict:
+    """
+    Build create_engine/create_async_engine keyword arguments from the settings.
+
+    Parameters:
+    url (str): The database URL the engine is created for.
+    config (Settings): The application settings.
+    name (str): The name the engine's pool metrics are reported under.
+    is_async (bool): Whether the options are for an async engine.
+
+    Returns:
+    dict: The engine keyword arguments.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    options = {
+        "echo": config.db_echo,
+        "pool_pre_ping": config.db_pool_pre_ping,
+        "pool_recycle": config.db_pool_recycle,
+    }
+
+    # In-memory SQLite keeps its single-connection pool
+    if not (backend == "sqlite" and url.database in (None, "", ":memory:")):
+        metrics = pool_metrics.setdefault(name, PoolMetrics(name))
+        options.update({
+            "poolclass": _instrumented(AsyncAdaptedQueuePool if is_async else QueuePool, metrics),
+            "pool_size": config.db_pool_size,
+            "max_overflow": config.db_max_overflow,
+            "pool_timeout": config.db_pool_timeout,
+        })
+
+    if backend == "postgresql" and config.db_statement_timeout_ms:
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(config.db_statement_timeout_ms)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={config.db_statement_timeout_ms}"}
+
+    return options
+
+
+def instrument_engine(engine, name: str):
+    """
+    Time every SQL statement executed on `engine` (an Engine, or the
+    sync_engine of an AsyncEngine) for /metrics and Server-Timing.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_statement_duration.observe(elapsed, name)
+        record_timing("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+
+def build_engine(url: str, config: Settings = settings, name: str = "primary"):
+    engine = create_engine(url, **engine_options(url, config, name))
+    if name in pool_metrics:
+        pool_metrics[name].pool = engine.pool
+    instrument_engine(engine, name)
+    return engine
+
+
+def get_pool_metrics():
+    """
+    Return the pool counters and current pool state of every engine.
+    """
+    return [metrics.snapshot() for metrics in pool_metrics.values()]
+
+
+# The engines are built from these settings on first use, so importing the
+# app builds no pools. configure() points them at the settings the app is
+# created with.
+_config = settings
+_engine = None
+_replicas = None
+_engines_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Return the primary engine, building it on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engines_lock:
+            if _engine is None:
+                logger.info("Using database %s", make_url(_config.database_url).render_as_string(hide_password=True))
+                _engine = build_engine(_config.database_url, _config)
+    return _engine
+
+
+class PrimarySession(Session):
+    # Sessions created without a bind run on the primary engine, looked up on
+    # their first statement, so they follow configure()
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+SessionLocal = sessionmaker(class_=PrimarySession, autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
@@ -26,4 +201,235 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+class ReplicaSet:
+    """
+    Round-robin over the read replicas that passed their last health check.
+
+    A background thread runs `SELECT 1` on every replica each
+    `check_interval` seconds, so routing a request never waits on a probe.
+    Replicas are assumed healthy until their first check.
+    """
+
+    def __init__(self, engines: List, check_interval: float):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.healthy = [True] * len(engines)
+        self._counter = itertools.count()
+        self._checker = None
+
+    def check(self):
+        for index, replica in enumerate(self.engines):
+            try:
+                with replica.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                healthy = True
+            except Exception as exc:
+                healthy = False
+                if self.healthy[index]:
+                    logger.warning("Read replica %s failed its health check: %s", index, exc)
+            if healthy and not self.healthy[index]:
+                logger.info("Read replica %s is healthy again", index)
+            self.healthy[index] = healthy
+
+    def choose(self) -> Optional[int]:
+        """
+        Return the index of the next healthy replica, or None if there is none.
+        """
+        healthy = [index for index, ok in enumerate(self.healthy) if ok]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def start_health_checks(self):
+        if self._checker is None and self.engines:
+            self._checker = threading.Thread(target=self._run_health_checks, name="replica-health", daemon=True)
+            self._checker.start()
+
+    def _run_health_checks(self):
+        while True:
+            self.check()
+            time.sleep(self.check_interval)
+
+
+def build_replicas(config: Settings) -> ReplicaSet:
+    return ReplicaSet(
+        [build_engine(url, config, name=f"replica{index}") for index, url in enumerate(config.database_replica_urls)],
+        config.db_replica_check_interval,
+    )
+
+
+def get_replicas() -> ReplicaSet:
+    """
+    Return the read replicas, building their engines on first use. Their
+    health checks are started by the app's lifespan, see app.main.
+    """
+    global _replicas
+    if _replicas is None:
+        with _engines_lock:
+            if _replicas is None:
+                _replicas = build_replicas(_config)
+    return _replicas
+
+
+def __getattr__(name: str):
+    # `engine`, `replicas` and `DATABASE_URL` are read through the getters, so
+    # `from app.database import engine` builds the engine only when it runs
+    if name == "engine":
+        return get_engine()
+    if name == "replicas":
+        return get_replicas()
+    if name == "DATABASE_URL":
+        return _config.database_url
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _read_target(request: Request):
+    # The user and transaction a GET request reads, for read-your-writes
+    params = {**request.query_params, **request.path_params}
+    user_id = params.get("user_id")
+    transaction_id = params.get("transaction_id")
+    return (
+        int(user_id) if str(user_id).isdigit() else None,
+        int(transaction_id) if str(transaction_id).isdigit() else None,
+    )
+
+
+def get_read_db(request: Request):
+    """
+    Session for read-only endpoints: on a healthy read replica, round-robin,
+    or on the primary when there are no healthy replicas or the user or
+    transaction being read was written in the last READ_YOUR_WRITES_SECONDS.
+    """
+    replicas = get_replicas()
+    index = replicas.choose()
+    if index is not None and recently_written(*_read_target(request)):
+        index = None
+    db = SessionLocal(bind=replicas.engines[index]) if index is not None else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_engine():
+    """
+    The engine of the next healthy read replica, or the primary, for bulk
+    reads that don't need read-your-writes.
+    """
+    replicas = get_replicas()
+    index = replicas.choose()
+    return replicas.engines[index] if index is not None else get_engine()
+
+
+# Async engine, used when ASYNC_MODE is enabled. It is created on first use so
+# that sync deployments don't need the asyncpg/aiosqlite drivers installed.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+async_engine = None
+AsyncSessionLocal = None
+
+
+def get_async_database_url(url: str = None) -> str:
+    url = make_url(url or _config.database_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = get_async_database_url()
+        async_engine = create_async_engine(url, **engine_options(url, _config, "primary_async", is_async=True))
+        if "primary_async" in pool_metrics:
+            pool_metrics["primary_async"].pool = async_engine.pool
+        instrument_engine(async_engine.sync_engine, "primary_async")
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async_replica_engines = []
+
+
+def get_async_replica_engine(index: int):
+    # Created on first use, like the primary async engine
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    while len(async_replica_engines) <= index:
+        name = f"replica{len(async_replica_engines)}_async"
+        url = get_async_database_url(_config.database_replica_urls[len(async_replica_engines)])
+        replica = create_async_engine(url, **engine_options(url, _config, name, is_async=True))
+        if name in pool_metrics:
+            pool_metrics[name].pool = replica.pool
+        instrument_engine(replica.sync_engine, name)
+        async_replica_engines.append(replica)
+    return async_replica_engines[index]
+
+
+async def get_async_read_db(request: Request):
+    """
+    Async variant of get_read_db. Replica health is shared with the sync engines.
+    """
+    get_async_engine()
+    index = get_replicas().choose()
+    if index is not None and await arecently_written(*_read_target(request)):
+        index = None
+    bind = get_async_replica_engine(index) if index is not None else async_engine
+    async with AsyncSessionLocal(bind=bind) as db:
+        yield db
+
+
+# The settings the engines are built from
+ENGINE_SETTINGS = (
+    "database_url", "database_replica_urls", "db_replica_check_interval", "db_echo", "db_pool_size",
+    "db_max_overflow", "db_pool_timeout", "db_pool_recycle", "db_pool_pre_ping", "db_statement_timeout_ms",
+)
+
+
+async def configure(config: Settings):
+    """
+    Build the engines from config's databases from now on. Engines already
+    built for other settings are disposed and rebuilt on first use; sessions
+    from SessionLocal look the primary engine up when they first run a
+    statement, so they follow.
+
+    Parameters:
+    config (Settings): The application settings.
+    """
+    global _config, _engine, _replicas, async_engine, AsyncSessionLocal
+    if all(getattr(config, name) == getattr(_config, name) for name in ENGINE_SETTINGS):
+        return
+    await dispose_engines()
+    _config = config
+    _engine = _replicas = None
+    async_engine = AsyncSessionLocal = None
+    async_replica_engines.clear()
+
+
+async def dispose_engines():
+    """
+    Close the pooled connections of every engine, at shutdown.
+    """
+    if _engine is not None:
+        _engine.dispose()
+    for replica in _replicas.engines if _replicas is not None else ():
+        replica.dispose()
+    for async_replica in async_replica_engines:
+        await async_replica.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
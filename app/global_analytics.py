@@ -0,0 +1,234 @@
+"""
+Platform-wide analytics over an in-memory columnar snapshot of transactions.
+
+The reports behind /analytics/global (daily volume, credit/debit ratio, top
+users by spend) aggregate every user's transactions, which the per-user
+running aggregates can't answer and a row-by-row ORM scan is far too slow
+for. Instead each worker keeps the transactions as NumPy columns (user_id,
+amount, date, is_credit), loaded from the database in chunks, and answers the
+reports with vectorized group-bys.
+
+The snapshot is topped up with the rows whose id is above the highest id seen,
+at most every GLOBAL_ANALYTICS_REFRESH_SECONDS. Updates and deletes, and rows
+committed out of id order, are only picked up by the full reload every
+GLOBAL_ANALYTICS_RELOAD_SECONDS, so the reports are approximate in between.
+Full reloads include archived months (see app.archive).
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from app.archive import iter_archived_rows
+from app.models.models import Transaction
+from app.settings import current_settings
+
+SNAPSHOT_COLUMNS = (
+    Transaction.id,
+    Transaction.user_id,
+    Transaction.transaction_date,
+    Transaction.transaction_amount,
+    Transaction.transaction_type,
+)
+
+NAT = np.iinfo(np.int64).min
+
+
+def _epoch_seconds(value: Optional[datetime]) -> int:
+    # Naive datetimes (SQLite) are stored as UTC
+    if value is None:
+        return NAT
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _as_datetime64(value: datetime) -> np.datetime64:
+    return np.datetime64(_epoch_seconds(value), "s")
+
+
+class TransactionColumns:
+    """
+    One snapshot of the transactions as parallel NumPy arrays. Snapshots are
+    never modified; a refresh builds a new one.
+    """
+
+    def __init__(self, user_ids: np.ndarray, amounts: np.ndarray, dates: np.ndarray, is_credit: np.ndarray, max_id: int):
+        self.user_ids = user_ids
+        self.amounts = amounts
+        self.dates = dates
+        self.is_credit = is_credit
+        self.max_id = max_id
+
+    @classmethod
+    def empty(cls) -> "TransactionColumns":
+        return cls(np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, "datetime64[s]"), np.empty(0, np.bool_), 0)
+
+    @classmethod
+    def from_rows(cls, rows: List[tuple]) -> "TransactionColumns":
+        """
+        Build columns from (id, user_id, transaction_date, transaction_amount, transaction_type) rows.
+        """
+        count = len(rows)
+        return cls(
+            np.fromiter((row[1] for row in rows), np.int64, count),
+            np.fromiter((row[3] for row in rows), np.float64, count),
+            np.fromiter((_epoch_seconds(row[2]) for row in rows), np.int64, count).astype("datetime64[s]"),
+            np.fromiter((row[4] == "credit" for row in rows), np.bool_, count),
+            max((row[0] for row in rows), default=0),
+        )
+
+    @classmethod
+    def concatenate(cls, parts: List["TransactionColumns"]) -> "TransactionColumns":
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            np.concatenate([part.user_ids for part in parts]),
+            np.concatenate([part.amounts for part in parts]),
+            np.concatenate([part.dates for part in parts]),
+            np.concatenate([part.is_credit for part in parts]),
+            max(part.max_id for part in parts),
+        )
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def _range_mask(self, start: Optional[datetime], end: Optional[datetime]) -> np.ndarray:
+        mask = np.ones(len(self), np.bool_)
+        if start is not None:
+            mask &= self.dates >= _as_datetime64(start)
+        if end is not None:
+            mask &= self.dates < _as_datetime64(end)
+        return mask
+
+    def daily_volume(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict]:
+        """
+        Transaction count and credit/debit amounts per UTC day, oldest first.
+        """
+        mask = self._range_mask(start, end) & ~np.isnat(self.dates)
+        days, inverse = np.unique(self.dates[mask].astype("datetime64[D]"), return_inverse=True)
+        amounts = self.amounts[mask]
+        is_credit = self.is_credit[mask]
+        counts = np.bincount(inverse, minlength=len(days))
+        credit = np.bincount(inverse, weights=np.where(is_credit, amounts, 0.0), minlength=len(days))
+        debit = np.bincount(inverse, weights=np.where(is_credit, 0.0, amounts), minlength=len(days))
+        return [
+            {"date": day, "transaction_count": count, "credit_amount": credit_amount, "debit_amount": debit_amount}
+            for day, count, credit_amount, debit_amount in zip(
+                np.datetime_as_string(days).tolist(), counts.tolist(), credit.tolist(), debit.tolist()
+            )
+        ]
+
+    def credit_debit_ratio(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict:
+        """
+        Credit and debit totals and counts, and the ratio of the credit to the
+        debit amount (None without debits).
+        """
+        mask = self._range_mask(start, end)
+        credit_mask = mask & self.is_credit
+        debit_mask = mask & ~self.is_credit
+        credit_amount = float(self.amounts[credit_mask].sum())
+        debit_amount = float(self.amounts[debit_mask].sum())
+        return {
+            "credit_amount": credit_amount,
+            "debit_amount": debit_amount,
+            "credit_count": int(credit_mask.sum()),
+            "debit_count": int(debit_mask.sum()),
+            "ratio": credit_amount / debit_amount if debit_amount else None,
+        }
+
+    def top_users(self, limit: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict]:
+        """
+        The `limit` users with the highest debit amount, highest first.
+        """
+        mask = self._range_mask(start, end) & ~self.is_credit
+        user_ids, inverse = np.unique(self.user_ids[mask], return_inverse=True)
+        spend = np.bincount(inverse, weights=self.amounts[mask], minlength=len(user_ids))
+        counts = np.bincount(inverse, minlength=len(user_ids))
+        top = np.arange(len(user_ids))
+        if len(top) > limit:
+            top = np.argpartition(-spend, limit - 1)[:limit]
+        # Highest spend first, ties by user id
+        top = top[np.lexsort((user_ids[top], -spend[top]))]
+        return [
+            {"user_id": user_id, "debit_amount": amount, "transaction_count": count}
+            for user_id, amount, count in zip(user_ids[top].tolist(), spend[top].tolist(), counts[top].tolist())
+        ]
+
+
+class GlobalAnalytics:
+    """
+    Holds the current snapshot and refreshes it. Only one refresh runs at a
+    time; while it runs, other requests are served the previous snapshot.
+    """
+
+    def __init__(self):
+        self.columns = TransactionColumns.empty()
+        self.loaded = False
+        self.refreshed_at = 0.0
+        self.reloaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, engine: Engine, full: bool = False) -> int:
+        """
+        Load the transactions with an id above the highest one seen, or all of
+        them (and the archived ones) if `full`.
+
+        Parameters:
+        engine (Engine): The engine to read from.
+        full (bool): Replace the snapshot instead of extending it.
+
+        Returns:
+        int: The number of rows loaded.
+        """
+        with self._lock:
+            return self._refresh(engine, full)
+
+    def _refresh(self, engine: Engine, full: bool) -> int:
+        started = time.monotonic()
+        base = TransactionColumns.empty() if full else self.columns
+        parts = [base]
+        if full:
+            archived = [(row[0], row[1], row[3], row[4], row[5]) for row in iter_archived_rows()]
+            if archived:
+                parts.append(TransactionColumns.from_rows(archived))
+        with engine.connect() as connection:
+            result = connection.execution_options(yield_per=current_settings().global_analytics_chunk_size).execute(
+                select(*SNAPSHOT_COLUMNS).where(Transaction.id > base.max_id).order_by(Transaction.id)
+            )
+            for rows in result.partitions():
+                parts.append(TransactionColumns.from_rows(rows))
+
+        self.columns = TransactionColumns.concatenate(parts)
+        self.loaded = True
+        self.refreshed_at = started
+        if full:
+            self.reloaded_at = started
+        return len(self.columns) - (0 if full else len(base))
+
+    def snapshot(self, engine: Engine) -> TransactionColumns:
+        """
+        Return the current snapshot, refreshing it first if it is due.
+        """
+        config = current_settings()
+        now = time.monotonic()
+        full = not self.loaded or now - self.reloaded_at >= config.global_analytics_reload_seconds
+        if not full and now - self.refreshed_at < config.global_analytics_refresh_seconds:
+            return self.columns
+        # Only the first load makes requests wait for another request's refresh
+        if self._lock.acquire(blocking=not self.loaded):
+            try:
+                now = time.monotonic()
+                full = not self.loaded or now - self.reloaded_at >= config.global_analytics_reload_seconds
+                if full or now - self.refreshed_at >= config.global_analytics_refresh_seconds:
+                    self._refresh(engine, full)
+            finally:
+                self._lock.release()
+        return self.columns
+
+
+global_analytics = GlobalAnalytics()
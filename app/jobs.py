@@ -0,0 +1,102 @@
+import logging
+from typing import Iterable, Tuple
+
+import redis
+from fastapi import BackgroundTasks
+
+from app.cache import mark_redis_down, redis_available
+from app.redis_client import redis_client, async_redis_client
+from app.settings import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+# Redis stream the web workers append transaction jobs to, consumed by app.worker
+# (see Settings.job_stream); configure() applies the settings of the app being served
+JOB_STREAM = settings.job_stream
+JOB_GROUP = settings.job_group
+DEAD_LETTER_STREAM = f"{JOB_STREAM}:dead"
+JOB_STREAM_MAXLEN = settings.job_stream_maxlen
+
+
+def configure(config: Settings):
+    global JOB_STREAM, JOB_GROUP, DEAD_LETTER_STREAM, JOB_STREAM_MAXLEN
+    JOB_STREAM, JOB_GROUP, JOB_STREAM_MAXLEN = config.job_stream, config.job_group, config.job_stream_maxlen
+    DEAD_LETTER_STREAM = f"{JOB_STREAM}:dead"
+
+
+def _job_fields(transaction_id: int, user_id: int) -> dict:
+    # Attempts are counted by the consumer group, see app.worker
+    return {"transaction_id": transaction_id, "user_id": user_id}
+
+
+def enqueue_transaction_jobs(jobs: Iterable[Tuple[int, int]]) -> bool:
+    """
+    Append post-create jobs for transactions to the job stream in one pipeline.
+
+    Parameters:
+    jobs (Iterable[Tuple[int, int]]): (transaction_id, user_id) pairs.
+
+    Returns:
+    bool: Whether the jobs were queued. False when Redis is unavailable.
+    """
+    if not redis_available():
+        return False
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for transaction_id, user_id in jobs:
+            pipe.xadd(JOB_STREAM, _job_fields(transaction_id, user_id), maxlen=JOB_STREAM_MAXLEN, approximate=True)
+        pipe.execute()
+        return True
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return False
+
+
+async def aenqueue_transaction_jobs(jobs: Iterable[Tuple[int, int]]) -> bool:
+    if not redis_available():
+        return False
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        for transaction_id, user_id in jobs:
+            pipe.xadd(JOB_STREAM, _job_fields(transaction_id, user_id), maxlen=JOB_STREAM_MAXLEN, approximate=True)
+        await pipe.execute()
+        return True
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return False
+
+
+def run_jobs_in_background(background_tasks: BackgroundTasks, jobs: Iterable[Tuple[int, int]]):
+    """
+    Fallback when the job stream is unavailable: run the jobs in-process after
+    the response is sent, as a single background task.
+    """
+    # Imported here because transaction_crud imports this module
+    from app.crud.transaction_crud import process_transaction_batch
+
+    transaction_ids_by_user = {}
+    for transaction_id, user_id in jobs:
+        transaction_ids_by_user.setdefault(user_id, []).append(transaction_id)
+    logger.debug("Job stream unavailable, running %s jobs in-process", sum(map(len, transaction_ids_by_user.values())))
+    background_tasks.add_task(process_transaction_batch, transaction_ids_by_user)
+
+
+def schedule_transaction_jobs(background_tasks: BackgroundTasks, jobs: Iterable[Tuple[int, int]]):
+    """
+    Queue the post-create jobs (user statistics, notification, credit score)
+    for transactions on the durable job stream, falling back to
+    BackgroundTasks if Redis can't be reached.
+
+    Parameters:
+    background_tasks (BackgroundTasks): The background tasks dependency, used for the fallback.
+    jobs (Iterable[Tuple[int, int]]): (transaction_id, user_id) pairs.
+    """
+    jobs = list(jobs)
+    if not enqueue_transaction_jobs(jobs):
+        run_jobs_in_background(background_tasks, jobs)
+
+
+async def aschedule_transaction_jobs(background_tasks: BackgroundTasks, jobs: Iterable[Tuple[int, int]]):
+    jobs = list(jobs)
+    if not await aenqueue_transaction_jobs(jobs):
+        run_jobs_in_background(background_tasks, jobs)
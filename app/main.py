@@ -1,24 +1,188 @@
+import time
+from contextlib import asynccontextmanager
 from typing import Union
-from fastapi import FastAPI
-from app.models import models
-from app.database import engine, Base
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from app import cache, database, jobs, redis_client
+from app.cache import start_invalidation_listener
+from app.database import dispose_engines, get_pool_metrics
+from app.metrics import (
+    db_statements_per_request, http_request_duration, pool_metric_lines, render_metrics, request_timings,
+    server_timing_header,
+)
+from app.responses import ORJSONResponse
+from app.schemas.transaction_schemas import configure_encryption
+from app.settings import Settings, settings, use_settings
 from app.routers import transaction_routes, analytics_routes
 
-app = FastAPI()
+router = APIRouter()
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine)
 
-
-# Add the transaction routes to the FastAPI app
-app.include_router(transaction_routes.router)
-app.include_router(analytics_routes.router, prefix="/transactions"  )
-
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"fido": "transactions"}
 
 
-@app.get("/items/{item_id}")
+@router.get("/metrics/pool")
+def read_pool_metrics():
+    """
+    Connection pool metrics per engine: checkouts, time spent waiting for a
+    connection, checkout timeouts and the current pool occupancy.
+    """
+    return get_pool_metrics()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """
+    Request, SQL, cache, crypto, background task and pool metrics in the
+    Prometheus text format.
+    """
+    body = render_metrics(pool_metric_lines(get_pool_metrics()))
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@router.get("/items/{item_id}")
 def read_item(item_id: int, q: Union[str, None] = None):
-    return {"item_id": item_id, "q": q}
\ No newline at end of file
+    return {"item_id": item_id, "q": q}
+
+
+async def configure(config: Settings):
+    """
+    Make config the settings that requests and background tasks read, and
+    that the engines, Redis clients and cipher are built from on first use.
+    """
+    use_settings(config)
+    await database.configure(config)
+    await redis_client.configure(config)
+    configure_encryption(config)
+    cache.configure(config)
+    jobs.configure(config)
+
+
+def lifespan(config: Settings):
+    @asynccontextmanager
+    async def run(app: FastAPI):
+        await configure(config)
+
+        # Background threads start with the server rather than on import, so
+        # tests and CLI tools that import the app don't pay for them
+        database.get_replicas().start_health_checks()
+
+        # Keep this worker's in-process cache tier in sync with writes made by other workers,
+        # and resend invalidations that failed while Redis was unavailable
+        start_invalidation_listener()
+
+        # Keep creating the transactions partitions for the months ahead
+        if config.db_partition_transactions:
+            from app.partitions import start_partition_maintenance
+            start_partition_maintenance(config)
+
+        # Precompute the busiest users' cache entries in the background
+        if config.cache_warmup_on_startup:
+            from app.warmup import start_cache_warmup
+            start_cache_warmup(config)
+
+        # Move change events from the outbox to the event stream
+        stop_publisher = None
+        if config.outbox_publish_in_app:
+            from app.outbox import start_outbox_publisher
+            stop_publisher = start_outbox_publisher(config)
+
+        yield
+
+        if stop_publisher is not None:
+            stop_publisher.set()
+
+        await redis_client.close()
+        await dispose_engines()
+
+    return run
+
+
+def create_app(config: Settings = settings) -> FastAPI:
+    """
+    Build the application.
+
+    Creating the app builds no engines, Redis clients or cipher: the lifespan
+    makes config current, and they are built from it when first used.
+    Background threads start with the server, the optional routes and the
+    rate limiting middleware are only imported when config enables them, and
+    the schema is created by `python -m app.migrate` instead of on every
+    worker boot.
+
+    Parameters:
+    config (Settings): The settings of the app: its databases, Redis and
+    encryption keys, the routes (async_mode), the Server-Timing header and
+    the background tasks.
+
+    Returns:
+    FastAPI: The application.
+    """
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan(config))
+
+    # Literal /transactions/... paths go first so that they aren't captured by /transactions/{transaction_id}
+    if config.serve_export:
+        from app.routers import export_routes
+        app.include_router(export_routes.router)
+    if config.serve_change_feed:
+        from app.routers import stream_routes
+        app.include_router(stream_routes.router)
+
+    # In async mode the async routes are mounted first, so they handle the paths
+    # they define and everything else falls through to the sync routes. They
+    # are imported only then, so sync deployments don't load them.
+    if config.async_mode:
+        from app.routers import async_transaction_routes, async_analytics_routes
+
+        app.include_router(async_transaction_routes.router)
+        app.include_router(async_analytics_routes.router, prefix="/transactions")
+
+    # Add the transaction routes to the FastAPI app
+    app.include_router(transaction_routes.router)
+    app.include_router(analytics_routes.router, prefix="/transactions")
+    if config.serve_global_analytics:
+        from app.routers import global_analytics_routes
+        app.include_router(global_analytics_routes.router)
+    app.include_router(router)
+
+    if config.limits_requests:
+        from app.ratelimit import check_request_limits, in_flight
+
+        @app.middleware("http")
+        async def limit_requests(request: Request, call_next):
+            # Rate limits and load shedding (see app.ratelimit); rejected requests never reach the database
+            rejection = await check_request_limits(request)
+            if rejection is not None:
+                return rejection
+            with in_flight:
+                return await call_next(request)
+
+    # Registered last so it runs first, and also times rejected requests
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        timings = {}
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            request_timings.reset(token)
+        elapsed = time.perf_counter() - start
+
+        # Label by route template rather than the raw path to keep the label set small
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        http_request_duration.observe(elapsed, request.method, route_path, str(response.status_code))
+        db_statements_per_request.observe(timings.get("db", (0.0, 0))[1], route_path)
+
+        if config.server_timing:
+            response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+        return response
+
+    return app
+
+
+ASYNC_MODE = settings.async_mode
+
+app = create_app()
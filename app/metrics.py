@@ -0,0 +1,190 @@
+"""
+In-process performance metrics, exposed in Prometheus text format at /metrics.
+
+Each worker process keeps its own registry, so scrape every worker (or put
+them behind a per-pod endpoint) rather than a load balancer.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', repr(bound)),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', '+Inf'),))} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"),
+)
+db_statement_duration = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("engine",),
+)
+db_statements_per_request = Histogram(
+    "db_statements_per_request", "SQL statements executed per HTTP request", ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+cache_requests = Counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit, miss or error)", ("cache", "result"),
+)
+cache_duration = Histogram(
+    "cache_operation_duration_seconds", "Redis cache operation latency", ("cache", "operation"),
+)
+crypto_duration = Histogram(
+    "crypto_duration_seconds", "Time spent encrypting or decrypting names", ("operation",),
+)
+background_task_duration = Histogram(
+    "background_task_duration_seconds", "Background task duration", ("task",),
+)
+requests_rejected = Counter(
+    "http_requests_rejected_total", "Requests rejected by rate limiting or load shedding", ("reason",),
+)
+
+REGISTRY = [
+    http_request_duration,
+    db_statement_duration,
+    db_statements_per_request,
+    cache_requests,
+    cache_duration,
+    crypto_duration,
+    background_task_duration,
+    requests_rejected,
+]
+
+
+# Per-request accumulators, e.g. {"db": [seconds, count]}, used for Server-Timing
+request_timings: ContextVar[Optional[dict]] = ContextVar("request_timings", default=None)
+
+
+def record_timing(component: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(component, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str, component: Optional[str] = None):
+    """
+    Observe the duration of the block on `histogram`, and add it to the
+    current request's `component` timing when given.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, *labels)
+        if component is not None:
+            record_timing(component, elapsed)
+
+
+def timed_task(function):
+    """
+    Record a background task's duration under its function name.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with timed(background_task_duration, function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def server_timing_header(timings: dict, total: float) -> str:
+    parts = [f"app;dur={total * 1000:.2f}"]
+    for component, (seconds, count) in timings.items():
+        parts.append(f'{component};dur={seconds * 1000:.2f};desc="{count} calls"')
+    return ", ".join(parts)
+
+
+def render_metrics(extra_lines=()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+def pool_metric_lines(pool_metrics):
+    """
+    Render the connection pool snapshots from app.database.get_pool_metrics.
+    """
+    fields = {
+        "checkouts": ("db_pool_checkouts_total", "counter", "Connections obtained from the pool"),
+        "timeouts": ("db_pool_timeouts_total", "counter", "Pool checkouts that timed out"),
+        "wait_seconds_total": ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection"),
+        "wait_seconds_max": ("db_pool_wait_seconds_max", "gauge", "Longest wait for a pooled connection"),
+        "size": ("db_pool_size", "gauge", "Configured pool size"),
+        "checked_out": ("db_pool_checked_out", "gauge", "Connections currently in use"),
+        "overflow": ("db_pool_overflow", "gauge", "Connections currently open beyond the pool size"),
+    }
+    for key, (name, kind, documentation) in fields.items():
+        yield f"# HELP {name} {documentation}"
+        yield f"# TYPE {name} {kind}"
+        for snapshot in pool_metrics:
+            if key in snapshot:
+                yield f'{name}{{engine="{snapshot["engine"]}"}} {snapshot[key]}'
@@ -0,0 +1,30 @@
+"""
+Create the database schema.
+
+    python -m app.migrate
+
+Run once per deploy, before starting the web workers; the app no longer
+creates tables on startup, so workers boot without touching the schema.
+Creates the partitioned transactions table first when DB_PARTITION_TRANSACTIONS
+is set on Postgres (see app.partitions), then any missing tables and indexes.
+Existing tables are left as they are.
+"""
+from sqlalchemy.engine import Engine
+
+from app.database import Base
+from app.partitions import prepare_partitions
+
+
+def create_schema(engine: Engine):
+    # Registers the tables on Base.metadata
+    from app.models import models  # noqa: F401
+
+    prepare_partitions(engine)
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    create_schema(engine)
+    print("Schema is up to date")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, CheckConstraint
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, CheckConstraint, Index, Text
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -15,4 +15,62 @@ class Transaction(Base):
 
     __table_args__ = (
         CheckConstraint("transaction_type IN ('credit', 'debit')", name='check_transaction_type'),
-    )
\ No newline at end of file
+        # Serves per-user date range scans: bucketed analytics, pagination and export
+        Index('ix_transactions_user_id_transaction_date', 'user_id', 'transaction_date'),
+    )
+
+
+class UserAnalytics(Base):
+    """
+    Running per-user aggregates, maintained by the transaction CRUD functions
+    in the same database transaction as the row they describe.
+    """
+    __tablename__ = 'user_analytics'
+
+    user_id = Column(Integer, primary_key=True)
+    total_value = Column(Float, nullable=False, default=0.0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+    top_day = Column(Date, nullable=True)
+    top_day_count = Column(Integer, nullable=False, default=0)
+
+
+class UserDailyCount(Base):
+    """
+    Per-day transaction count histogram for a user. Only consulted when the
+    current top day loses a transaction, never on the read path.
+    """
+    __tablename__ = 'user_daily_counts'
+
+    user_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """
+    The Idempotency-Key of a POST /transactions/ request and the transaction
+    it created, inserted in the same database transaction as that row.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(255), primary_key=True)
+    # SHA-256 of the request body, to reject a key reused for a different request
+    request_hash = Column(String(64), nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class OutboxEvent(Base):
+    """
+    A change to a transaction, inserted in the same database transaction as
+    the change and moved to the Redis event stream by app.outbox.
+    """
+    __tablename__ = 'transaction_outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_type = Column(String, nullable=False)  # 'created', 'updated' or 'deleted'
+    transaction_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    # The transaction as JSON, with the name still encrypted
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
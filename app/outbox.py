@@ -0,0 +1,142 @@
+"""
+Transactional outbox for the transaction change feed.
+
+create, update and delete (and bulk creates) insert a row into
+transaction_outbox in the same database transaction as the change, so an
+event exists exactly when the change was committed. The publisher moves the
+rows, oldest first, to the OUTBOX_STREAM Redis stream and then deletes them:
+
+    python -m app.outbox
+
+or, with OUTBOX_PUBLISH_IN_APP, a thread in every web worker. Delivery is
+at least once: a publisher that dies between XADD and its commit publishes
+those rows again, so consumers should skip outbox_ids they have seen.
+GET /transactions/stream serves the stream as server-sent events.
+"""
+import argparse
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+
+import redis
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from app.cache import mark_redis_down, redis_available
+from app.database import SessionLocal
+from app.models.models import OutboxEvent
+from app.redis_client import redis_client
+from app.schemas.transaction_schemas import serialize_transaction
+from app.settings import Settings, current_settings
+
+logger = logging.getLogger(__name__)
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+def add_outbox_events(db: Session, event_type: str, transactions: Iterable):
+    """
+    Record changes to transactions in the outbox. Not committed, so they
+    land in the caller's database transaction.
+
+    Parameters:
+    db (Session): The database session.
+    event_type (str): CREATED, UPDATED or DELETED.
+    transactions (Iterable): The changed transactions, as ORM objects or dicts with an id.
+    """
+    rows = []
+    for transaction in transactions:
+        payload = serialize_transaction(transaction)
+        rows.append({
+            "event_type": event_type,
+            "transaction_id": payload["id"],
+            "user_id": payload["user_id"],
+            "payload": json.dumps(payload),
+        })
+    if rows:
+        db.execute(insert(OutboxEvent), rows)
+
+
+def publish_pending(db: Session, batch_size: int = None) -> int:
+    """
+    Append the oldest outbox rows to the event stream in one pipeline and
+    delete them. Concurrent publishers wait on each other's row locks.
+
+    Returns:
+    int: The number of events published. 0 when Redis is unavailable.
+    """
+    if not redis_available():
+        return 0
+    config = current_settings()
+    events = list(db.scalars(
+        select(OutboxEvent).order_by(OutboxEvent.id).limit(batch_size or config.outbox_batch_size).with_for_update()
+    ))
+    if not events:
+        db.rollback()
+        return 0
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(config.outbox_stream, {
+                "outbox_id": event.id,
+                "event": event.event_type,
+                "transaction_id": event.transaction_id,
+                "user_id": event.user_id,
+                "payload": event.payload,
+            }, maxlen=config.outbox_stream_maxlen, approximate=True)
+        pipe.execute()
+    except redis.RedisError as exc:
+        db.rollback()
+        mark_redis_down(exc)
+        return 0
+    db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([event.id for event in events])))
+    db.commit()
+    return len(events)
+
+
+def run_publisher(poll_interval: float = None, stop: threading.Event = None):
+    """
+    Publish outbox rows until `stop` is set, polling every `poll_interval`
+    seconds while there is nothing to publish.
+    """
+    poll_interval = current_settings().outbox_poll_interval if poll_interval is None else poll_interval
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            published = publish_pending(db)
+        except Exception:
+            logger.exception("Publishing the outbox failed")
+            published = 0
+        finally:
+            db.close()
+        if published < current_settings().outbox_batch_size:
+            stop.wait(poll_interval)
+
+
+def start_outbox_publisher(config: Settings) -> Optional[threading.Event]:
+    """
+    Publish the outbox from a background thread of this web worker, if
+    config's outbox_publish_in_app is set.
+
+    Returns:
+    threading.Event: Set it to stop the publisher. None if it wasn't started.
+    """
+    if not config.outbox_publish_in_app:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=run_publisher, args=(config.outbox_poll_interval, stop), name="outbox-publisher", daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move transaction change events from the outbox table to the Redis event stream.")
+    parser.add_argument("--poll-interval", type=float, default=None, help="Default is OUTBOX_POLL_INTERVAL")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Publishing the outbox to %s", current_settings().outbox_stream)
+    run_publisher(args.poll_interval)
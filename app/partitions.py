@@ -0,0 +1,257 @@
+"""
+Monthly range partitioning of the transactions table on Postgres.
+
+With DB_PARTITION_TRANSACTIONS enabled, the transactions table is created
+PARTITION BY RANGE (transaction_date) with one partition per month, so each
+month's rows and indexes stay small, queries with a date range only touch the
+matching partitions, and old months can be archived by dropping a partition
+(see app.archive) instead of deleting rows.
+
+Partitions must exist before rows for their month arrive; rows outside every
+partition land in transactions_default. `python -m app.migrate` creates them
+for the current month and DB_PARTITION_MONTHS_AHEAD months ahead, and each
+web worker then repeats that in a background thread every
+PARTITION_CHECK_INTERVAL seconds, so the months ahead keep being created
+between deploys. `python -m app.partitions ensure` does the same by hand
+(e.g. from cron, for processes that don't run the web app).
+
+Lookups of one transaction by id (GET, PUT and DELETE /transactions/{id})
+are not pruned: requests don't carry the transaction's date, and ids don't
+encode it. Postgres probes the (id, transaction_date) primary key index of
+every partition instead, one index lookup each, which stays cheap while
+app.archive bounds the number of partitions.
+
+An existing unpartitioned table is converted with `python -m app.partitions migrate`.
+"""
+import argparse
+import logging
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.settings import Settings, current_settings
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = "transactions_p"
+DEFAULT_PARTITION = "transactions_default"
+# Seconds between each web worker's checks for the upcoming partitions
+PARTITION_CHECK_INTERVAL = 6 * 3600
+# Advisory lock held while partitions are created, so workers don't race on the same month
+PARTITION_LOCK_KEY = 7215001
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+
+def _bound(month: date) -> str:
+    return f"{month.isoformat()} 00:00:00+00"
+
+
+def _create_table_statements(table: str) -> List[str]:
+    # The partition key has to be part of the primary key; the ORM still
+    # identifies rows by id alone
+    return [
+        f"""
+        CREATE TABLE {table} (
+            id SERIAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            full_name VARCHAR NOT NULL,
+            transaction_date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            transaction_amount FLOAT NOT NULL,
+            transaction_type VARCHAR NOT NULL,
+            CONSTRAINT check_transaction_type CHECK (transaction_type IN ('credit', 'debit')),
+            PRIMARY KEY (id, transaction_date)
+        ) PARTITION BY RANGE (transaction_date)
+        """,
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {table} DEFAULT",
+    ]
+
+
+def _create_indexes(connection: Connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_transactions_user_id_transaction_date ON transactions (user_id, transaction_date)"
+    ))
+
+
+def supports_partitioning(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def table_exists(connection: Connection) -> bool:
+    return connection.execute(text("SELECT to_regclass('transactions') IS NOT NULL")).scalar()
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('transactions'))"
+    )).scalar()
+
+
+def list_partitions(connection: Connection) -> List[Tuple[date, str]]:
+    """
+    Return the monthly partitions of the transactions table as (month, name), oldest first.
+    """
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('transactions')"
+    )).scalars()
+    partitions = []
+    for name in names:
+        if name.startswith(PARTITION_PREFIX):
+            year, month = name[len(PARTITION_PREFIX):].split("_")
+            partitions.append((date(int(year), int(month), 1), name))
+    return sorted(partitions)
+
+
+def ensure_partitions(connection: Connection, first_month: date, last_month: date, table: str = "transactions") -> List[str]:
+    """
+    Create the monthly partitions from `first_month` through `last_month` that don't exist yet.
+
+    Returns:
+    List[str]: The names of the partitions created.
+    """
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        name = partition_name(month)
+        if not connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name)"), {"name": name}).scalar():
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(add_months(month, 1))}')"
+            ))
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _current_month() -> date:
+    return month_start(datetime.now(timezone.utc).date())
+
+
+def prepare_partitions(engine: Engine, months_ahead: Optional[int] = None):
+    """
+    Create the partitioned transactions table if it doesn't exist yet, and the
+    partitions for the current month and `months_ahead` months after it.
+    Does nothing unless partitioning is enabled and the database is Postgres.
+    """
+    if not current_settings().db_partition_transactions or not supports_partitioning(engine):
+        return
+    months_ahead = current_settings().db_partition_months_ahead if months_ahead is None else months_ahead
+    with engine.begin() as connection:
+        if not table_exists(connection):
+            for statement in _create_table_statements("transactions"):
+                connection.execute(text(statement))
+            _create_indexes(connection)
+        if not is_partitioned(connection):
+            logger.warning("transactions is not partitioned; run `python -m app.partitions migrate` to convert it")
+            return
+        current = _current_month()
+        created = ensure_partitions(connection, current, add_months(current, months_ahead))
+        if created:
+            logger.info("Created partitions %s", ", ".join(created))
+
+
+def ensure_upcoming_partitions(engine: Engine, months_ahead: Optional[int] = None) -> List[str]:
+    """
+    Create the partitions for the current month and `months_ahead` months
+    after it that don't exist yet, if the transactions table is partitioned.
+
+    Returns:
+    List[str]: The names of the partitions created.
+    """
+    months_ahead = current_settings().db_partition_months_ahead if months_ahead is None else months_ahead
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            return []
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        current = _current_month()
+        return ensure_partitions(connection, current, add_months(current, months_ahead))
+
+
+def _run_maintenance(interval: float):
+    from app.database import get_engine
+
+    while True:
+        try:
+            created = ensure_upcoming_partitions(get_engine())
+            if created:
+                logger.info("Created partitions %s", ", ".join(created))
+        except Exception:
+            logger.exception("Creating the upcoming partitions failed")
+        time.sleep(interval)
+
+
+def start_partition_maintenance(config: Settings):
+    """
+    Create the upcoming partitions in a background thread now and every
+    PARTITION_CHECK_INTERVAL seconds, if config's db_partition_transactions
+    is set and the database is Postgres.
+    """
+    from app.database import get_engine
+
+    if config.db_partition_transactions and supports_partitioning(get_engine()):
+        threading.Thread(target=_run_maintenance, args=(PARTITION_CHECK_INTERVAL,), name="partition-maintenance", daemon=True).start()
+
+
+def migrate_to_partitioned(engine: Engine, months_ahead: Optional[int] = None):
+    """
+    Convert an existing unpartitioned transactions table in one database
+    transaction: copy the rows into a new partitioned table with a partition
+    per month that has data, then swap the tables. Writes are blocked meanwhile.
+    """
+    months_ahead = current_settings().db_partition_months_ahead if months_ahead is None else months_ahead
+    columns = "id, user_id, full_name, transaction_date, transaction_amount, transaction_type"
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            print("transactions is already partitioned")
+            return
+        connection.execute(text("LOCK TABLE transactions IN EXCLUSIVE MODE"))
+        for statement in _create_table_statements("transactions_partitioned"):
+            # The default partition is attached to the new table under its final name
+            connection.execute(text(statement))
+        oldest = connection.execute(text("SELECT min(transaction_date) FROM transactions")).scalar()
+        current = _current_month()
+        ensure_partitions(connection, month_start(oldest.date()) if oldest else current, add_months(current, months_ahead), table="transactions_partitioned")
+        copied = connection.execute(text(
+            f"INSERT INTO transactions_partitioned ({columns}) SELECT {columns} FROM transactions"
+        )).rowcount
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence('transactions_partitioned', 'id'), "
+            "(SELECT coalesce(max(id), 0) + 1 FROM transactions_partitioned), false)"
+        ))
+        connection.execute(text("DROP TABLE transactions"))
+        connection.execute(text("ALTER TABLE transactions_partitioned RENAME TO transactions"))
+        _create_indexes(connection)
+    print(f"Partitioned transactions, copied {copied} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the transactions table (Postgres).")
+    parser.add_argument("command", choices=("ensure", "migrate"))
+    parser.add_argument("--months-ahead", type=int, default=None, help="Partitions to create past the current month")
+    args = parser.parse_args()
+
+    from app.database import engine
+
+    if not supports_partitioning(engine):
+        parser.error("Partitioning requires Postgres")
+    if args.command == "migrate":
+        migrate_to_partitioned(engine, args.months_ahead)
+    else:
+        created = ensure_upcoming_partitions(engine, args.months_ahead)
+        print(f"Created {len(created)} partitions")
@@ -0,0 +1,177 @@
+"""
+Per-client and per-user rate limiting, and load shedding.
+
+Every request takes a token from its client's bucket (by address) and, when
+it names a user (the user_id query parameter or /transactions/analytics/{id}),
+from that user's bucket. The buckets live in Redis and are updated by one Lua
+script, so all workers share them and a request only consumes tokens if every
+bucket has one. Requests over the limit get 429 with Retry-After. When Redis
+is unavailable requests are let through, like the caches fall back to the
+database.
+
+Load shedding is per worker: while the worker has more than
+MAX_IN_FLIGHT_REQUESTS requests in progress, or a database connection
+checkout waited longer than LOAD_SHED_POOL_WAIT seconds in the last
+POOL_WAIT_WINDOW seconds, requests are rejected straight away with 503 and
+Retry-After instead of queueing for a connection until they time out.
+"""
+import math
+import re
+import time
+from typing import List, Optional, Tuple
+
+import redis
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.cache import mark_redis_down, redis_available
+from app.database import pool_metrics
+from app.metrics import requests_rejected
+from app.redis_client import async_redis_client
+from app.settings import current_settings
+
+# Probes and metrics are never limited
+EXEMPT_PATHS = frozenset({"/", "/metrics", "/metrics/pool"})
+USER_PATH = re.compile(r"^/transactions/analytics/(\d+)")
+# How long a slow connection checkout keeps the worker shedding load
+POOL_WAIT_WINDOW = 1.0
+
+# KEYS: bucket keys. ARGV: cost, then rate (tokens/s) and burst per key.
+# Takes `cost` tokens from every bucket, or from none of them. Returns
+# {1, "0"} when allowed, or {0, seconds until enough tokens are available}.
+_TOKEN_BUCKET = """
+local cost = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    tokens = math.min(burst, tokens + elapsed * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', levels[i] - cost, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {1, "0"}
+"""
+_take_tokens = async_redis_client.register_script(_TOKEN_BUCKET)
+
+
+class InFlight:
+    """
+    Requests in progress in this worker. Only used from the event loop.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.count += 1
+
+    def __exit__(self, *exc_info):
+        self.count -= 1
+
+
+in_flight = InFlight()
+
+
+def client_key(request: Request) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    return f"rate_limit:client:{request.client.host if request.client else 'unknown'}"
+
+
+def request_user_id(request: Request) -> Optional[int]:
+    user_id = request.query_params.get("user_id")
+    if user_id is None:
+        match = USER_PATH.match(request.url.path)
+        user_id = match.group(1) if match else None
+    return int(user_id) if user_id is not None and user_id.isdigit() else None
+
+
+def request_buckets(request: Request) -> List[Tuple[str, float, int]]:
+    """
+    The (key, rate, burst) token buckets a request draws from.
+    """
+    config = current_settings()
+    buckets = []
+    if config.rate_limit_client_rate:
+        buckets.append((client_key(request), config.rate_limit_client_rate, config.rate_limit_client_burst))
+    user_id = request_user_id(request)
+    if config.rate_limit_user_rate and user_id is not None:
+        buckets.append((f"rate_limit:user:{user_id}", config.rate_limit_user_rate, config.rate_limit_user_burst))
+    return buckets
+
+
+async def take_tokens(buckets: List[Tuple[str, float, int]], cost: int = 1) -> float:
+    """
+    Take `cost` tokens from every bucket, atomically.
+
+    Returns:
+    float: 0 if the request is allowed, otherwise the seconds until it would be.
+    """
+    if not buckets or not redis_available():
+        return 0.0
+    args = [cost]
+    for _, rate, burst in buckets:
+        args += [rate, burst]
+    try:
+        allowed, wait = await _take_tokens(keys=[key for key, _, _ in buckets], args=args)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return 0.0
+    return 0.0 if int(allowed) else float(wait)
+
+
+def overload_reason() -> Optional[str]:
+    """
+    Why this worker should shed load right now, or None.
+    """
+    config = current_settings()
+    if config.max_in_flight_requests is not None and in_flight.count >= config.max_in_flight_requests:
+        return "in_flight"
+    if config.load_shed_pool_wait is not None:
+        now = time.monotonic()
+        for metrics in pool_metrics.values():
+            if metrics.last_wait_seconds >= config.load_shed_pool_wait and now - metrics.last_wait_at < POOL_WAIT_WINDOW:
+                return "pool_wait"
+    return None
+
+
+def _rejection(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def check_request_limits(request: Request) -> Optional[JSONResponse]:
+    """
+    Return the 503 or 429 response for a request that must be rejected, or
+    None to let it through. Load is shed before any Redis round trip.
+    """
+    if request.url.path in EXEMPT_PATHS:
+        return None
+    reason = overload_reason()
+    if reason is not None:
+        requests_rejected.inc(reason)
+        return _rejection(503, "Server is overloaded, retry later", current_settings().load_shed_retry_after)
+    wait = await take_tokens(request_buckets(request))
+    if wait:
+        requests_rejected.inc("rate_limited")
+        return _rejection(429, "Too many requests", wait)
+    return None
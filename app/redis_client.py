@@ -1,7 +1,135 @@
+import threading
+
 import redis
-import os
+import redis.asyncio
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+
+from app.settings import Settings, settings
+
+
+def _pool_options(config: Settings) -> dict:
+    return {
+        "decode_responses": True,
+        "socket_connect_timeout": config.redis_connect_timeout,
+        "socket_timeout": config.redis_socket_timeout,
+    }
+
+
+def build_pool(config: Settings, socket_timeout: bool = True) -> redis.ConnectionPool:
+    # Redis only backs caches, so fail fast instead of retrying when it is
+    # unreachable and let callers fall back to the database
+    options = _pool_options(config)
+    if not socket_timeout:
+        options["socket_timeout"] = None
+    return redis.ConnectionPool.from_url(config.redis_url, retry=Retry(NoBackoff(), 0), **options)
+
+
+def build_async_pool(config: Settings, socket_timeout: bool = True) -> redis.asyncio.ConnectionPool:
+    options = _pool_options(config)
+    if not socket_timeout:
+        options["socket_timeout"] = None
+    return redis.asyncio.ConnectionPool.from_url(config.redis_url, retry=AsyncRetry(NoBackoff(), 0), **options)
+
+
+def build_client(config: Settings, socket_timeout: bool = True) -> redis.StrictRedis:
+    """
+    Build a Redis client for config's Redis, with the fail-fast settings.
+    Clients for blocking reads, which may wait longer than the socket
+    timeout, are built with socket_timeout=False.
+    """
+    return redis.StrictRedis(connection_pool=build_pool(config, socket_timeout))
+
+
+class LazyClient:
+    """
+    A Redis client that is built from the configured settings on first use,
+    so importing the app builds no pools, and rebuilt on the next use after
+    configure() points it at another Redis. Attributes are read from the
+    client.
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._build(_config)
+        return self._client
+
+    def reset(self):
+        """
+        Drop the client, so the next use builds a new one, and return it.
+        """
+        client, self._client = self._client, None
+        return client
 
-REDIS_URL = os.getenv("REDIS_URL")
+    def register_script(self, script: str) -> "LuaScript":
+        return LuaScript(self, script)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+
+class LuaScript:
+    """
+    A Lua script for a LazyClient, registered on the current client when it
+    is first called (registering reads the client's encoding).
+    """
+
+    def __init__(self, lazy_client: LazyClient, script: str):
+        self.lazy_client = lazy_client
+        self.script = script
+        self._registered = None
+
+    def __call__(self, keys=None, args=None, client=None):
+        client_now = self.lazy_client.client
+        if self._registered is None or self._registered.registered_client is not client_now:
+            self._registered = client_now.register_script(self.script)
+        return self._registered(keys=keys, args=args, client=client)
+
+
+_config = settings
 
 # Create a Redis client
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
\ No newline at end of file
+redis_client = LazyClient(build_client)
+
+# Async Redis client for the ASYNC_MODE request path, with the same fail-fast settings
+async_redis_client = LazyClient(lambda config: redis.asyncio.StrictRedis(connection_pool=build_async_pool(config)))
+
+# Client for the change feed's blocking XREADs, which may wait longer than the socket timeout
+stream_redis_client = LazyClient(lambda config: redis.asyncio.StrictRedis(connection_pool=build_async_pool(config, socket_timeout=False)))
+
+
+async def configure(config: Settings):
+    """
+    Build the shared clients for config's Redis from now on. Clients already
+    built for another Redis are closed and rebuilt on first use.
+
+    Parameters:
+    config (Settings): The application settings.
+    """
+    global _config
+    if _pool_options(config) == _pool_options(_config) and config.redis_url == _config.redis_url:
+        return
+    await close()
+    _config = config
+
+
+async def close():
+    """
+    Close the connections of every client that was built, at shutdown.
+    """
+    client = redis_client.reset()
+    if client is not None:
+        client.connection_pool.disconnect()
+    for lazy_client in (async_redis_client, stream_redis_client):
+        client = lazy_client.reset()
+        if client is not None:
+            await client.aclose(close_connection_pool=True)
@@ -0,0 +1,116 @@
+"""
+Re-encrypt stored names with the current encryption key.
+
+Rotating keys:
+1. Prepend a new key to ENCRYPTION_KEYS and roll it out to every worker. New
+   rows are encrypted with it, and rows written with the older keys can still
+   be read.
+2. Run `python -m app.reencrypt` to rewrite the older rows in batches.
+3. Drop the retired key from ENCRYPTION_KEYS.
+"""
+import argparse
+import logging
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from app.cache import invalidate_users
+from app.database import SessionLocal
+from app.models.models import Transaction
+from app.schemas import transaction_schemas
+
+logger = logging.getLogger(__name__)
+
+
+def reencrypt_batch(db: Session, after_id: int, batch_size: int, force: bool = False):
+    """
+    Re-encrypt one batch of rows with the current key. Rows that none of the
+    keys can decrypt are logged and skipped. A row is only rewritten if its
+    name is still the one that was read, so a concurrent update isn't lost.
+
+    Parameters:
+    db (Session): The database session.
+    after_id (int): Only rows with a greater ID are read.
+    batch_size (int): The maximum number of rows to read.
+    force (bool): Re-encrypt rows that already use the current key too.
+
+    Returns:
+    Tuple[int, int, int]: The last ID read (None when there are no rows
+    left), the number of rows rewritten and the number that couldn't be
+    decrypted.
+    """
+    rows = db.execute(
+        select(Transaction.id, Transaction.user_id, Transaction.full_name)
+        .where(Transaction.id > after_id)
+        .order_by(Transaction.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return None, 0, 0
+
+    # Read from the module, so the cipher and key follow configure_encryption
+    cipher_suite = transaction_schemas.get_cipher()
+    current = Fernet(transaction_schemas.key)
+    changes = []
+    user_ids = set()
+    failed = 0
+    for transaction_id, user_id, full_name in rows:
+        token = full_name.encode()
+        if not force:
+            try:
+                current.decrypt(token)
+                continue
+            except InvalidToken:
+                pass
+        try:
+            full_name = cipher_suite.rotate(token).decode()
+        except InvalidToken:
+            # Written with a key that was dropped, or corrupted
+            logger.warning("Transaction %s can't be decrypted with any key, skipping it", transaction_id)
+            failed += 1
+            continue
+        changes.append({"row_id": transaction_id, "old_full_name": token.decode(), "new_full_name": full_name})
+        user_ids.add(user_id)
+
+    rewritten = 0
+    if changes:
+        table = Transaction.__table__
+        result = db.connection().execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"), table.c.full_name == bindparam("old_full_name"))
+            .values(full_name=bindparam("new_full_name")),
+            changes,
+        )
+        db.commit()
+        rewritten = result.rowcount if result.supports_sane_multi_rowcount() else len(changes)
+        # Cached lists and transactions hold the old ciphertexts
+        invalidate_users(user_ids, [change["row_id"] for change in changes])
+
+    return rows[-1].id, rewritten, failed
+
+
+def run(batch_size: int = 1000, force: bool = False):
+    db = SessionLocal()
+    try:
+        after_id, total, total_failed = 0, 0, 0
+        while True:
+            after_id, rewritten, failed = reencrypt_batch(db, after_id, batch_size, force=force)
+            if after_id is None:
+                break
+            total += rewritten
+            total_failed += failed
+            print(f"Re-encrypted {total} rows (up to id {after_id})")
+    finally:
+        db.close()
+    print(f"Done, re-encrypted {total} rows")
+    if total_failed:
+        print(f"{total_failed} rows couldn't be decrypted with any key and were left as they are, see the log")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--force", action="store_true", help="re-encrypt rows that already use the current key")
+    args = parser.parse_args()
+    run(batch_size=args.batch_size, force=args.force)
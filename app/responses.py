@@ -0,0 +1,16 @@
+import orjson
+from starlette.responses import JSONResponse, Response
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson, used as the app's default response class.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def json_bytes_response(body: bytes) -> Response:
+    # For bodies that are already encoded, e.g. served from the cache
+    return Response(content=body, media_type="application/json")
@@ -1,70 +1,100 @@
-import json
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from typing import Any, List, Dict
-from datetime import date
+from typing import Any, List, Dict, Optional
+from datetime import date, datetime
 
-from app.redis_client import redis_client
-from app.database import get_db
-from app.crud.transaction_crud import get_transactions
+from app.cache import ANALYTICS, get_or_fill_versioned
+from app.conditional import ConditionalRead
+from app.database import get_read_db
+from app.crud.analytics_crud import get_user_analytics_buckets, get_user_analytics_summary
 
 router = APIRouter()
 
-def calculate_user_analytics(user_id: int, transactions):
-    # Calculate average transaction value
-    total_value = sum(transaction.transaction_amount for transaction in transactions)
-    average_value = total_value / len(transactions) if transactions else 0
-    
-    # Calculate the day with the highest number of transactions
-    transaction_count_by_day = {}
-    for transaction in transactions:
-        day = transaction.transaction_date.date()
-        if day not in transaction_count_by_day:
-            transaction_count_by_day[day] = 0
-        transaction_count_by_day[day] += 1
-    
-    highest_day = max(transaction_count_by_day, key=transaction_count_by_day.get) if transaction_count_by_day else None
-    
-    # Convert the highest_day to a string
-    highest_day_str = highest_day.isoformat() if highest_day else None
-    
-    return {
-        "average_transaction_value": average_value,
-        "day_with_most_transactions": highest_day_str,
-        "total_transaction_count": len(transactions)
-    }
+
+class AnalyticsRange:
+    """
+    Query parameters selecting time-bucketed analytics. With none of them set,
+    the endpoint returns the lifetime summary.
+    """
+
+    def __init__(
+        self,
+        from_: Optional[datetime] = Query(None, alias="from", description="Include transactions at or after this time"),
+        to: Optional[datetime] = Query(None, description="Include transactions before this time"),
+        bucket: Optional[str] = Query(None, pattern="^(day|week|month)$"),
+    ):
+        if from_ is not None and to is not None and from_ >= to:
+            raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+        self.start = from_
+        self.end = to
+        self.bucket = bucket
+
+    @property
+    def requested(self) -> bool:
+        return self.bucket is not None or self.start is not None or self.end is not None
+
+    def response(self, user_id: int, buckets: List[dict]) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "bucket": self.bucket or "day",
+            "from": self.start,
+            "to": self.end,
+            "buckets": buckets,
+        }
+
 
 @router.get("/analytics/{user_id}", response_model=Dict[str, Any])
-def get_user_analytics(user_id: int, db: Session = Depends(get_db)):
+def get_user_analytics(
+    user_id: int,
+    request: Request,
+    response: Response,
+    time_range: AnalyticsRange = Depends(),
+    db: Session = Depends(get_read_db),
+):
     """
     Retrieve user analytics based on transaction data.
 
-    This function fetches transaction data for a given user, calculates analytics,
-    and caches the result in Redis for future requests.
+    This function reads the user's running aggregates, which the transaction
+    CRUD functions keep up to date, and caches the result in Redis for future
+    requests. The cache entry is invalidated by every write to the user's
+    transactions. The user's transaction history is never scanned. On a miss,
+    only one request per user recomputes the value (see get_or_fill_user_cached).
     
     Analytics are worked together as one object to improve performance.
 
+    With `from`, `to` or `bucket` (day, week or month) set, the endpoint instead
+    returns per-bucket sums, counts and credit/debit splits for that range,
+    grouped by the database rather than in Python.
+
+    Both carry an ETag and Last-Modified that change with every write to the
+    user's transactions, so a client can revalidate with If-None-Match and
+    get a 304 without a database query (see app.conditional).
+
     Parameters:
     user_id (int): The ID of the user for whom analytics are being retrieved.
+    time_range (AnalyticsRange): The optional from/to/bucket query parameters.
     db (Session): The database session used to query transaction data.
 
     Returns:
     Dict[str, Any]: A dictionary containing the user's analytics, including
     average transaction value, the day with the most transactions, and the total
-    transaction count.
+    transaction count, or the requested buckets.
     """
-    cache_key = f"user_analytics:{user_id}"
-    cached_result = redis_client.get(cache_key)
+    conditional = ConditionalRead(request, "user", user_id)
+    not_modified = conditional.check()
+    if not_modified is not None:
+        return not_modified
 
-    if cached_result:
-        return json.loads(cached_result)
+    if time_range.requested:
+        version = conditional.current()
+        buckets = get_user_analytics_buckets(db, user_id, time_range.bucket or "day", time_range.start, time_range.end)
+        conditional.label(response, version)
+        return time_range.response(user_id, buckets)
 
-    transactions = get_transactions(db, user_id=user_id)
-    if not transactions:
+    # Concurrent misses for the same user share a single recompute
+    analytics, version = get_or_fill_versioned(user_id, ANALYTICS, lambda: get_user_analytics_summary(db, user_id))
+    if analytics is None:
         raise HTTPException(status_code=404, detail="No transactions found for the user")
 
-    analytics = calculate_user_analytics(user_id, transactions)
-
-    redis_client.setex(cache_key, 3600, json.dumps(analytics))
-
+    conditional.label(response, version)
     return analytics
\ No newline at end of file
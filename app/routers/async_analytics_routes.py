@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict
+
+from app.cache import ANALYTICS, aget_or_fill_versioned
+from app.conditional import ConditionalRead
+from app.database import get_async_read_db
+from app.crud.analytics_crud import get_user_analytics_buckets
+from app.crud.async_transaction_crud import get_user_analytics as get_user_analytics_crud
+from app.routers.analytics_routes import AnalyticsRange
+
+# Async version of analytics_routes, mounted ahead of it when ASYNC_MODE is enabled
+router = APIRouter()
+
+
+@router.get("/analytics/{user_id}", response_model=Dict[str, Any])
+async def get_user_analytics(
+    user_id: int,
+    request: Request,
+    response: Response,
+    time_range: AnalyticsRange = Depends(),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Retrieve user analytics based on transaction data.
+
+    Reads the user's running aggregates and caches the result in Redis until
+    the user's next write. With `from`, `to` or `bucket` set, returns buckets
+    aggregated in SQL instead. Conditional requests are answered with 304
+    from Redis (see app.conditional).
+
+    Parameters:
+    user_id (int): The ID of the user for whom analytics are being retrieved.
+    time_range (AnalyticsRange): The optional from/to/bucket query parameters.
+    db (AsyncSession): The async database session used to read the aggregates.
+
+    Returns:
+    Dict[str, Any]: A dictionary containing the user's analytics.
+    """
+    conditional = ConditionalRead(request, "user", user_id)
+    not_modified = await conditional.acheck()
+    if not_modified is not None:
+        return not_modified
+
+    if time_range.requested:
+        version = await conditional.acurrent()
+        buckets = await db.run_sync(get_user_analytics_buckets, user_id, time_range.bucket or "day", time_range.start, time_range.end)
+        await conditional.alabel(response, version)
+        return time_range.response(user_id, buckets)
+
+    analytics, version = await aget_or_fill_versioned(user_id, ANALYTICS, lambda: get_user_analytics_crud(db, user_id))
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="No transactions found for the user")
+
+    await conditional.alabel(response, version)
+    return analytics
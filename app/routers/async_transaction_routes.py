@@ -0,0 +1,217 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from app.database import get_async_db, get_async_read_db
+from app.cache import (
+    TRANSACTIONS,
+    aget_idempotent_response,
+    aget_or_fill_transaction_versioned,
+    aget_or_fill_versioned,
+    aset_idempotent_response,
+)
+from app.conditional import ConditionalRead
+from app.schemas.transaction_schemas import (
+    TransactionCreate,
+    TransactionResponse,
+    build_transaction_responses,
+    decrypt_payload,
+    encode_transaction_rows,
+    serialize_transaction,
+)
+from app.crud.idempotency_crud import check_request_hash, get_idempotent_transaction, request_fingerprint
+from app.routers.transaction_routes import transactions_page_response
+from app.crud.transaction_crud import DEFAULT_PAGE_LIMIT, first_page_entry
+from app.crud.async_transaction_crud import (
+    get_transaction_rows_page,
+    get_transaction,
+    create_transaction as create_transaction_crud,
+    update_transaction as update_transaction_crud,
+    delete_transaction as delete_transaction_crud
+)
+
+# Async versions of the routes in transaction_routes, mounted ahead of them when
+# ASYNC_MODE is enabled so that they handle the same paths.
+router = APIRouter()
+
+
+@router.get("/transactions/", response_model=List[TransactionResponse])
+async def read_transactions(
+    request: Request,
+    user_id: int,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Retrieve a page of transactions from the database for a specific user,
+    newest first, using keyset pagination on (transaction_date, id).
+    Rows are encoded straight to JSON, and the encoded first page is cached
+    until the user's next write. Conditional requests are answered with 304
+    from Redis (see app.conditional).
+
+    Parameters:
+    user_id (int): The ID of the user whose transactions to retrieve.
+    limit (int): The maximum number of records to return. Default is 100.
+    cursor (str): The continuation token from the previous page.
+    db (AsyncSession): The async database session dependency.
+
+    Returns:
+    List[TransactionResponse]: A list of transaction records for the given user.
+    """
+    conditional = ConditionalRead(request, "user", user_id)
+    not_modified = await conditional.acheck()
+    if not_modified is not None:
+        return not_modified
+
+    async def load_first_page():
+        rows, next_cursor = await get_transaction_rows_page(db, user_id=user_id, limit=limit)
+        return first_page_entry(rows, next_cursor, limit)
+
+    # Only the first page at the default limit is cached, filled by one request at a time
+    if cursor is None and limit == DEFAULT_PAGE_LIMIT:
+        page, version = await aget_or_fill_versioned(user_id, TRANSACTIONS, load_first_page)
+        body = decrypt_payload(page["body"]) if page["limit"] == limit else None
+        if body is not None:
+            response = transactions_page_response(request, body, page["next_cursor"])
+            await conditional.alabel(response, version)
+            return response
+
+    version = await conditional.acurrent()
+    rows, next_cursor = await get_transaction_rows_page(db, user_id=user_id, limit=limit, cursor=cursor)
+    response = transactions_page_response(request, encode_transaction_rows(rows), next_cursor)
+    await conditional.alabel(response, version)
+    return response
+
+
+@router.get("/transactions/{transaction_id}", response_model=TransactionResponse)
+async def read_transaction(transaction_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db)):
+    """
+    Retrieve a single transaction from the database by ID.
+
+    Parameters:
+    transaction_id (int): The ID of the transaction to retrieve.
+    db (AsyncSession): The async database session dependency.
+
+    Returns:
+    TransactionResponse: The transaction record with the given ID.
+    """
+    conditional = ConditionalRead(request, "transaction", transaction_id)
+    not_modified = await conditional.acheck()
+    if not_modified is not None:
+        return not_modified
+
+    async def load_transaction():
+        transaction = await get_transaction(db, transaction_id=transaction_id)
+        return serialize_transaction(transaction) if transaction is not None else None
+
+    transaction, version = await aget_or_fill_transaction_versioned(transaction_id, load_transaction)
+    if transaction is None:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    await conditional.alabel(response, version)
+    return build_transaction_responses([transaction])[0]
+
+
+async def _idempotent_replay(db: AsyncSession, response: Response, idempotency_key: str, request_hash: str) -> Optional[dict]:
+    # The response of an earlier request with the same Idempotency-Key, from Redis or the database
+    cached = await aget_idempotent_response(idempotency_key)
+    if cached is not None:
+        check_request_hash(cached["request_hash"], request_hash)
+        replay = cached["response"]
+    else:
+        transaction = await db.run_sync(get_idempotent_transaction, idempotency_key, request_hash)
+        if transaction is None:
+            return None
+        replay = serialize_transaction(transaction)
+        await aset_idempotent_response(idempotency_key, request_hash, replay)
+    response.headers["Idempotent-Replayed"] = "true"
+    return replay
+
+
+@router.post("/transactions/", response_model=TransactionResponse)
+async def create_transaction(
+    transaction: TransactionCreate,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Create a new transaction in the database.
+
+    With an Idempotency-Key header, retrying the request returns the
+    transaction created the first time instead of creating another one.
+
+    Parameters:
+    transaction (TransactionCreate): The transaction data to create.
+    db (AsyncSession): The async database session dependency.
+    background_tasks (BackgroundTasks): The background tasks dependency.
+    idempotency_key (str): Optional Idempotency-Key header.
+
+    Returns:
+    TransactionResponse: The created transaction record.
+    """
+    request_hash = None
+    if idempotency_key is not None:
+        request_hash = request_fingerprint(transaction.model_dump_json(exclude_unset=True))
+        replay = await _idempotent_replay(db, response, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+
+    # model_dump encrypts the full_name
+    transaction_data = transaction.model_dump()
+
+    try:
+        created = await create_transaction_crud(
+            db,
+            transaction=transaction_data,
+            background_tasks=background_tasks,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash,
+        )
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # A concurrent request with the same key committed first
+        await db.rollback()
+        replay = await _idempotent_replay(db, response, idempotency_key, request_hash)
+        if replay is None:
+            raise
+        return replay
+
+    if idempotency_key is not None:
+        await aset_idempotent_response(idempotency_key, request_hash, serialize_transaction(created))
+    return created
+
+
+@router.put("/transactions/{transaction_id}", response_model=TransactionResponse)
+async def update_transaction(transaction_id: int, transaction: TransactionCreate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Update an existing transaction in the database.
+
+    Parameters:
+    transaction_id (int): The ID of the transaction to update.
+    transaction (TransactionCreate): The updated transaction data.
+    db (AsyncSession): The async database session dependency.
+
+    Returns:
+    TransactionResponse: The updated transaction record.
+    """
+    return build_transaction_responses([await update_transaction_crud(db, transaction_id=transaction_id, transaction=transaction)])[0]
+
+
+@router.delete("/transactions/{transaction_id}", response_model=TransactionResponse)
+async def delete_transaction(transaction_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Delete a transaction from the database by ID.
+
+    Parameters:
+    transaction_id (int): The ID of the transaction to delete.
+    db (AsyncSession): The async database session dependency.
+
+    Returns:
+    TransactionResponse: The deleted transaction record.
+    """
+    return await delete_transaction_crud(db, transaction_id=transaction_id)
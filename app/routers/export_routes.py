@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.database import SessionLocal
+from app.crud.transaction_crud import TRANSACTION_COLUMNS, iter_user_transaction_rows
+from app.schemas.transaction_schemas import decrypt_names
+
+# Mounted ahead of the other transaction routers so that /transactions/export
+# isn't captured by /transactions/{transaction_id}
+router = APIRouter()
+
+EXPORT_FIELDS = [column.key for column in TRANSACTION_COLUMNS]
+FULL_NAME_INDEX = EXPORT_FIELDS.index("full_name")
+DECRYPT_BATCH_SIZE = 500
+
+
+def _decrypted_rows(rows):
+    # Decrypt names a batch at a time so memory stays bounded
+    batch = []
+    for row in rows:
+        batch.append(list(row))
+        if len(batch) >= DECRYPT_BATCH_SIZE:
+            yield from _decrypt_batch(batch)
+            batch = []
+    yield from _decrypt_batch(batch)
+
+
+def _decrypt_batch(batch):
+    names = decrypt_names([row[FULL_NAME_INDEX] for row in batch])
+    for row, name in zip(batch, names):
+        row[FULL_NAME_INDEX] = name
+        yield row
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record["transaction_date"] = record["transaction_date"].isoformat() if record["transaction_date"] else None
+        yield json.dumps(record) + "\n"
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _export(user_id: int, export_format: str):
+    # The response outlives the request's dependencies, so the stream owns its session
+    db = SessionLocal()
+    try:
+        rows = _decrypted_rows(iter_user_transaction_rows(db, user_id))
+        lines = _csv_lines(rows) if export_format == "csv" else _ndjson_lines(rows)
+        yield from lines
+    finally:
+        db.close()
+
+
+@router.get("/transactions/export")
+def export_transactions(user_id: int, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """
+    Stream a user's whole transaction history as NDJSON or CSV, oldest first.
+
+    Rows are read and their names decrypted in batches, and written to the
+    response as they arrive, so memory use is constant regardless of how long
+    the history is.
+
+    Parameters:
+    user_id (int): The ID of the user whose transactions to export.
+    format (str): 'ndjson' (default) or 'csv'.
+
+    Returns:
+    StreamingResponse: The exported transactions.
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export(user_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions-{user_id}.{format}"'},
+    )
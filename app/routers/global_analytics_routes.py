@@ -0,0 +1,84 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Any, Dict, Optional
+from datetime import datetime
+
+from app.database import get_read_engine
+
+router = APIRouter(prefix="/analytics/global")
+
+
+class ReportRange:
+    """
+    Optional from/to query parameters limiting a platform-wide report.
+    """
+
+    def __init__(
+        self,
+        from_: Optional[datetime] = Query(None, alias="from", description="Include transactions at or after this time"),
+        to: Optional[datetime] = Query(None, description="Include transactions before this time"),
+    ):
+        if from_ is not None and to is not None and from_ >= to:
+            raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+        self.start = from_
+        self.end = to
+
+    def response(self, **report) -> Dict[str, Any]:
+        return {"from": self.start, "to": self.end, **report}
+
+
+def get_snapshot():
+    # NumPy is only imported once a report is requested, to keep worker startup lean
+    from app.global_analytics import global_analytics
+
+    # Loaded from a read replica when there is one
+    return global_analytics.snapshot(get_read_engine())
+
+
+@router.get("/daily-volume", response_model=Dict[str, Any])
+def get_daily_volume(time_range: ReportRange = Depends(), columns=Depends(get_snapshot)):
+    """
+    Transaction count and credit/debit amounts per UTC day across all users.
+
+    Parameters:
+    time_range (ReportRange): The optional from/to query parameters.
+    columns (TransactionColumns): The in-memory transactions snapshot.
+
+    Returns:
+    Dict[str, Any]: The range and a list of days, oldest first.
+    """
+    return time_range.response(days=columns.daily_volume(time_range.start, time_range.end))
+
+
+@router.get("/credit-debit-ratio", response_model=Dict[str, Any])
+def get_credit_debit_ratio(time_range: ReportRange = Depends(), columns=Depends(get_snapshot)):
+    """
+    Credit and debit totals across all users, and the credit to debit amount ratio.
+
+    Parameters:
+    time_range (ReportRange): The optional from/to query parameters.
+    columns (TransactionColumns): The in-memory transactions snapshot.
+
+    Returns:
+    Dict[str, Any]: The range, the amounts and counts per type, and the ratio.
+    """
+    return time_range.response(**columns.credit_debit_ratio(time_range.start, time_range.end))
+
+
+@router.get("/top-users", response_model=Dict[str, Any])
+def get_top_users(
+    limit: int = Query(10, ge=1, le=1000),
+    time_range: ReportRange = Depends(),
+    columns=Depends(get_snapshot),
+):
+    """
+    The users with the highest spend (debit amount).
+
+    Parameters:
+    limit (int): The number of users to return.
+    time_range (ReportRange): The optional from/to query parameters.
+    columns (TransactionColumns): The in-memory transactions snapshot.
+
+    Returns:
+    Dict[str, Any]: The range and the top users, highest spend first.
+    """
+    return time_range.response(limit=limit, users=columns.top_users(limit, time_range.start, time_range.end))
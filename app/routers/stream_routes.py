@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+from typing import Optional, Tuple
+
+import redis
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.cache import mark_redis_down, redis_available
+from app.redis_client import async_redis_client, stream_redis_client
+from app.settings import current_settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Seconds between comment lines that keep idle connections (and proxies) open
+KEEPALIVE_SECONDS = 15
+CATCH_UP_PAGE = 500
+# Events a slow consumer may fall behind before it is disconnected (it resumes with Last-Event-ID)
+SUBSCRIBER_QUEUE_SIZE = 10_000
+READ_BLOCK_MS = 5000
+
+
+def stream_id(value: str) -> Tuple[int, int]:
+    milliseconds, _, sequence = value.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def format_event(message_id: str, fields: dict) -> str:
+    """
+    Format a stream entry as a server-sent event. The event id is the stream
+    offset to resume from, and the transaction's name stays encrypted.
+    """
+    data = '{"outbox_id":%d,"transaction_id":%d,"user_id":%d,"transaction":%s}' % (
+        int(fields["outbox_id"]), int(fields["transaction_id"]), int(fields["user_id"]), fields["payload"],
+    )
+    return f"id: {message_id}\nevent: {fields['event']}\ndata: {data}\n\n"
+
+
+class EventFanout:
+    """
+    A single XREAD loop per worker, fanned out to the queues of all open
+    streams, so open streams don't each hold a Redis connection. It starts
+    with the first subscriber and stops when the last one leaves.
+    """
+
+    def __init__(self, stream: Optional[str] = None):
+        # Default: the outbox stream of the app being served, read when the loop starts
+        self.stream = stream
+        self._configured_stream = stream
+        self.subscribers = set()
+        self.last_id = "0-0"
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        async with self._lock:
+            if self._task is None or self._task.done():
+                self.stream = self._configured_stream or current_settings().outbox_stream
+                # Follow from the current end; subscribers catch up on older events themselves
+                latest = await async_redis_client.xrevrange(self.stream, count=1)
+                self.last_id = latest[0][0] if latest else "0-0"
+                self.subscribers.add(queue)
+                self._task = asyncio.create_task(self._run())
+            else:
+                self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                response = await stream_redis_client.xread({self.stream: self.last_id}, count=CATCH_UP_PAGE, block=READ_BLOCK_MS)
+            except redis.RedisError as exc:
+                logger.warning("Reading %s failed: %s", self.stream, exc)
+                await asyncio.sleep(1)
+                continue
+            for _, messages in response or []:
+                for message_id, fields in messages:
+                    self.last_id = message_id
+                    for queue in list(self.subscribers):
+                        try:
+                            queue.put_nowait((message_id, fields))
+                        except asyncio.QueueFull:
+                            self.subscribers.discard(queue)
+
+
+fanout = EventFanout()
+
+
+async def _check_offset(offset: str):
+    # 410 when events after the offset were trimmed from the stream (needs Redis 7)
+    try:
+        info = await async_redis_client.xinfo_stream(current_settings().outbox_stream)
+    except redis.ResponseError:
+        return
+    deleted = info.get("max-deleted-entry-id")
+    if deleted and stream_id(deleted) > stream_id(offset):
+        raise HTTPException(status_code=410, detail="Events after this offset are no longer available")
+
+
+async def _events(queue: asyncio.Queue, offset: Optional[str], user_id: Optional[int]):
+    try:
+        last_id = offset
+        if offset is not None:
+            # Catch up from the offset, then continue with the live events
+            while True:
+                messages = await async_redis_client.xrange(current_settings().outbox_stream, min=f"({last_id}", count=CATCH_UP_PAGE)
+                for message_id, fields in messages:
+                    last_id = message_id
+                    if user_id is None or int(fields["user_id"]) == user_id:
+                        yield format_event(message_id, fields)
+                if len(messages) < CATCH_UP_PAGE:
+                    break
+
+        while True:
+            if queue.empty() and queue not in fanout.subscribers:
+                # Dropped for falling behind
+                break
+            try:
+                message_id, fields = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            # Live events already sent during the catch-up
+            if last_id is not None and stream_id(message_id) <= stream_id(last_id):
+                continue
+            last_id = message_id
+            if user_id is None or int(fields["user_id"]) == user_id:
+                yield format_event(message_id, fields)
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+    finally:
+        fanout.unsubscribe(queue)
+
+
+@router.get("/transactions/stream")
+async def stream_transactions(
+    user_id: Optional[int] = None,
+    last_event_id: Optional[str] = Query(None, pattern=r"^\d+-\d+$", description="Resume after this event id"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID", pattern=r"^\d+-\d+$"),
+):
+    """
+    Follow transaction creates, updates and deletes as server-sent events,
+    instead of polling GET /transactions/.
+
+    Each event's id is its offset in the change stream. A client that
+    reconnects with the Last-Event-ID header (browsers' EventSource does this
+    by itself) or the last_event_id parameter first receives the events it
+    missed. Without an offset, the stream starts with the next change.
+
+    Parameters:
+    user_id (int): Only send the changes to this user's transactions.
+    last_event_id (str): Resume after this event id.
+    last_event_id_header (str): The Last-Event-ID header; takes precedence over last_event_id.
+
+    Returns:
+    StreamingResponse: A text/event-stream of 'created', 'updated' and
+    'deleted' events. 410 if the offset is older than the retained events.
+    """
+    offset = last_event_id_header or last_event_id
+    if not redis_available():
+        raise HTTPException(status_code=503, detail="The change stream is unavailable")
+    try:
+        if offset is not None:
+            await _check_offset(offset)
+        queue = await fanout.subscribe()
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        raise HTTPException(status_code=503, detail="The change stream is unavailable")
+
+    return StreamingResponse(
+        _events(queue, offset, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
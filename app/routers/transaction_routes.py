@@ -1,63 +1,133 @@
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+import json
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from app.database import get_db
-from app.schemas.transaction_schemas import TransactionCreate, TransactionResponse
+from app.cache import (
+    TRANSACTIONS,
+    get_idempotent_response,
+    get_or_fill_transaction_versioned,
+    get_or_fill_versioned,
+    set_idempotent_response,
+)
+from app.conditional import ConditionalRead
+from app.database import get_db, get_read_db
+from app.responses import json_bytes_response
+from app.schemas.transaction_schemas import (
+    BulkTransactionResponse,
+    BulkTransactionResult,
+    TransactionCreate,
+    TransactionResponse,
+    build_transaction_responses,
+    decrypt_payload,
+    encode_transaction_rows,
+    encrypt_names,
+    serialize_transaction,
+)
+from app.crud.idempotency_crud import check_request_hash, get_idempotent_transaction, request_fingerprint
 from app.crud.transaction_crud import (
-    get_transactions,
+    DEFAULT_PAGE_LIMIT,
+    first_page_entry,
+    get_transaction_rows_page,
     get_transaction,
+    bulk_create_transactions,
+    use_copy,
     create_transaction as create_transaction_crud,
     update_transaction as update_transaction_crud, 
     delete_transaction as delete_transaction_crud
 )
+
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
-@router.get("/transactions/", response_model=List[TransactionResponse])
-def read_transactions(user_id: int, db: Session = Depends(get_db)):
-    """
-    Retrieve a list of transactions from the database for a specific user.
+def set_next_cursor(request: Request, response: Response, next_cursor: Optional[str]):
+    # The body stays a plain list; the continuation token travels in headers
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
 
-    Parameters:
-    user_id (int): The ID of the user whose transactions to retrieve.
-    db (Session): The database session dependency.
 
-    Returns:
-    List[TransactionResponse]: A list of transaction records for the given user.
-    """
-    return get_transactions(db, user_id=user_id)
+def transactions_page_response(request: Request, body: bytes, next_cursor: Optional[str]) -> Response:
+    response = json_bytes_response(body)
+    set_next_cursor(request, response, next_cursor)
+    return response
+
 
-from app.redis_client import redis_client
-import json
 @router.get("/transactions/", response_model=List[TransactionResponse])
-def read_transactions_by_user_id(user_id: int, db: Session = Depends(get_db)):
+def read_transactions(
+    request: Request,
+    user_id: int,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
     """
-    Retrieve a list of transactions from the database for a specific user.
-    Transactions are cached for 1 hour to improve performance.
+    Retrieve a page of transactions from the database for a specific user,
+    newest first.
+
+    Pages are fetched with keyset pagination on (transaction_date, id). When
+    more transactions follow, the token for the next page is returned in the
+    X-Next-Cursor header and as a rel="next" Link header.
+
+    Rows are selected as plain column tuples and encoded straight to JSON.
+    The encoded first page at the default limit is cached (encrypted) until
+    the user's next write, so a cache hit is returned without building or
+    parsing any objects.
+
+    Responses carry an ETag and Last-Modified that change with every write
+    to the user's transactions; a matching If-None-Match or If-Modified-Since
+    gets a 304 without a database query (see app.conditional).
+
     Parameters:
     user_id (int): The ID of the user whose transactions to retrieve.
+    limit (int): The maximum number of records to return. Default is 100.
+    cursor (str): The continuation token from the previous page.
     db (Session): The database session dependency.
 
     Returns:
-    List[TransactionResponse]: A list of transaction records for the given user.
+    List[TransactionResponse]: A list of transaction records for the given user,
+    with names decrypted in one batch.
     """
-    cache_key = f"user_transactions:{user_id}"
-    cached_transactions = redis_client.get(cache_key)
+    conditional = ConditionalRead(request, "user", user_id)
+    not_modified = conditional.check()
+    if not_modified is not None:
+        return not_modified
 
-    if cached_transactions:
-        return json.loads(cached_transactions)
+    def load_first_page():
+        rows, next_cursor = get_transaction_rows_page(db, user_id=user_id, limit=limit)
+        return first_page_entry(rows, next_cursor, limit)
 
-    transactions = get_transactions(db, user_id=user_id)
-    redis_client.setex(cache_key, 3600, json.dumps([transaction.__dict__ for transaction in transactions]))
+    # Only the default limit is cached, so other limits don't replace its entry
+    if cursor is None and limit == DEFAULT_PAGE_LIMIT:
+        page, version = get_or_fill_versioned(user_id, TRANSACTIONS, load_first_page)
+        body = decrypt_payload(page["body"]) if page["limit"] == limit else None
+        if body is not None:
+            response = transactions_page_response(request, body, page["next_cursor"])
+            conditional.label(response, version)
+            return response
 
-    return transactions
+    # Read before the rows, so the validators are never newer than the body
+    version = conditional.current()
+    rows, next_cursor = get_transaction_rows_page(db, user_id=user_id, limit=limit, cursor=cursor)
+    response = transactions_page_response(request, encode_transaction_rows(rows), next_cursor)
+    conditional.label(response, version)
+    return response
 
 @router.get("/transactions/{transaction_id}", response_model=TransactionResponse)
-def read_transaction(transaction_id: int, db: Session = Depends(get_db)):
+def read_transaction(transaction_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """
     Retrieve a single transaction from the database by ID.
 
+    Responses carry an ETag that changes when the transaction is updated or
+    deleted; a matching If-None-Match gets a 304 without a database query.
+
     Parameters:
     transaction_id (int): The ID of the transaction to retrieve.
     db (Session): The database session dependency.
@@ -65,47 +135,219 @@ def read_transaction(transaction_id: int, db: Session = Depends(get_db)):
     Returns:
     TransactionResponse: The transaction record with the given ID.
     """
-    transaction = get_transaction(db, transaction_id=transaction_id)
+    conditional = ConditionalRead(request, "transaction", transaction_id)
+    not_modified = conditional.check()
+    if not_modified is not None:
+        return not_modified
+
+    def load_transaction():
+        transaction = get_transaction(db, transaction_id=transaction_id)
+        return serialize_transaction(transaction) if transaction is not None else None
+
+    # Served from the in-process tier or Redis until the transaction changes
+    transaction, version = get_or_fill_transaction_versioned(transaction_id, load_transaction)
     if transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    # Manually map the Transaction object to TransactionResponse
-    transaction_response = TransactionResponse(
-        id=transaction.id,
-        user_id=transaction.user_id,
-        full_name=transaction.full_name,  # Pass the encrypted name directly
-        transaction_date=transaction.transaction_date,
-        transaction_amount=transaction.transaction_amount,
-        transaction_type=transaction.transaction_type
-    )
-    
-    # Decrypt the full_name before returning
-    transaction_response.full_name = transaction_response.decrypt_full_name()
-    
-    return transaction_response
+
+    conditional.label(response, version)
+    return build_transaction_responses([transaction])[0]
+
+def _idempotent_replay(db: Session, response: Response, idempotency_key: str, request_hash: str) -> Optional[dict]:
+    # The response of an earlier request with the same Idempotency-Key, from Redis or the database
+    cached = get_idempotent_response(idempotency_key)
+    if cached is not None:
+        check_request_hash(cached["request_hash"], request_hash)
+        replay = cached["response"]
+    else:
+        transaction = get_idempotent_transaction(db, idempotency_key, request_hash)
+        if transaction is None:
+            return None
+        replay = serialize_transaction(transaction)
+        set_idempotent_response(idempotency_key, request_hash, replay)
+    response.headers["Idempotent-Replayed"] = "true"
+    return replay
+
 
 @router.post("/transactions/", response_model=TransactionResponse)
-def create_transaction(transaction: TransactionCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def create_transaction(
+    transaction: TransactionCreate,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: Session = Depends(get_db),
+):
     """
     Create a new transaction in the database.
 
+    With an Idempotency-Key header, retrying the request returns the
+    transaction created the first time instead of creating another one.
+
     Parameters:
     transaction (TransactionCreate): The transaction data to create.
     db (Session): The database session dependency.
     background_tasks (BackgroundTasks): The background tasks dependency.
+    idempotency_key (str): Optional Idempotency-Key header.
 
     Returns:
     TransactionResponse: The created transaction record.
     """
+    request_hash = None
+    if idempotency_key is not None:
+        request_hash = request_fingerprint(transaction.model_dump_json(exclude_unset=True))
+        replay = _idempotent_replay(db, response, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+
     # Encrypt the full_name before creating the transaction
     transaction_data = transaction.model_dump()
     transaction_data['full_name'] = transaction.encrypt_full_name()
 
     # Create the transaction using the encrypted data
-    created_transaction = create_transaction_crud(db, transaction=transaction_data, background_tasks=background_tasks)
+    try:
+        created_transaction = create_transaction_crud(
+            db,
+            transaction=transaction_data,
+            background_tasks=background_tasks,
+            idempotency_key=idempotency_key,
+            request_hash=request_hash,
+        )
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # A concurrent request with the same key committed first
+        db.rollback()
+        replay = _idempotent_replay(db, response, idempotency_key, request_hash)
+        if replay is None:
+            raise
+        return replay
 
     # Return the created transaction
-    return TransactionResponse(**created_transaction)
+    created = TransactionResponse(**created_transaction)
+    if idempotency_key is not None:
+        set_idempotent_response(idempotency_key, request_hash, serialize_transaction(created))
+    return created
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+async def _iter_bulk_items(request: Request):
+    # Yields (item, error) pairs from a JSON array body or an NDJSON stream
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_CONTENT_TYPES:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_ndjson_line(line)
+        if buffer.strip():
+            yield _parse_ndjson_line(buffer)
+        return
+
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    for item in body:
+        yield item, None
+
+
+def _parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line), None
+    except ValueError as exc:
+        return None, [{"msg": f"Invalid JSON: {exc}"}]
+
+
+def _write_bulk_batch(db: Session, batch: List[TransactionCreate], background_tasks: BackgroundTasks, copy: bool) -> List[int]:
+    encrypted_names = encrypt_names([transaction.full_name for transaction in batch])
+    rows = [
+        {
+            "user_id": transaction.user_id,
+            "full_name": encrypted_name,
+            "transaction_date": transaction.transaction_date,
+            "transaction_amount": transaction.transaction_amount,
+            "transaction_type": transaction.transaction_type.value,
+        }
+        for transaction, encrypted_name in zip(batch, encrypted_names)
+    ]
+    return bulk_create_transactions(db, rows, background_tasks=background_tasks, copy=copy)
+
+
+@router.post("/transactions/bulk", response_model=BulkTransactionResponse)
+async def create_transactions_bulk(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    batch_size: int = Query(1000, ge=1, le=10000),
+    method: str = Query("auto", pattern="^(auto|insert|copy)$"),
+    db: Session = Depends(get_db),
+):
+    """
+    Create many transactions in one request.
+
+    Accepts a JSON array, or an NDJSON stream (Content-Type: application/x-ndjson)
+    which is read incrementally. Every row is validated with TransactionCreate;
+    valid rows are encrypted and inserted in batches of `batch_size`, each batch
+    in its own database transaction, with one background task per batch.
+
+    Parameters:
+    request (Request): The incoming request, read as JSON or NDJSON.
+    background_tasks (BackgroundTasks): The background tasks dependency.
+    batch_size (int): The number of rows per insert batch. Default is 1000.
+    method (str): 'insert', 'copy' (Postgres only) or 'auto', which uses COPY when available.
+    db (Session): The database session dependency.
+
+    Returns:
+    BulkTransactionResponse: A result per input row, in input order.
+    """
+    copy = use_copy(db) if method == "auto" else method == "copy"
+    if copy and not use_copy(db):
+        raise HTTPException(status_code=400, detail="COPY is only supported on Postgres with psycopg2")
+
+    results = []
+    batch, batch_indexes = [], []
+
+    async def flush():
+        try:
+            ids = await run_in_threadpool(_write_bulk_batch, db, batch, background_tasks, copy)
+        except Exception:
+            # Database errors can include SQL and parameters, so they are only logged
+            logger.exception("Bulk insert of rows %s-%s failed", batch_indexes[0], batch_indexes[-1])
+            for index in batch_indexes:
+                results.append(BulkTransactionResult(index=index, status="failed", errors=[{"msg": "The batch could not be saved"}]))
+        else:
+            for index, transaction_id in zip(batch_indexes, ids):
+                results.append(BulkTransactionResult(index=index, status="created", id=transaction_id))
+        batch.clear()
+        batch_indexes.clear()
+
+    async for index, (item, errors) in _aenumerate(_iter_bulk_items(request)):
+        if errors is None:
+            try:
+                batch.append(TransactionCreate.model_validate(item))
+                batch_indexes.append(index)
+            except ValidationError as exc:
+                errors = exc.errors(include_url=False, include_context=False, include_input=False)
+        if errors is not None:
+            results.append(BulkTransactionResult(index=index, status="invalid", errors=errors))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    results.sort(key=lambda result: result.index)
+    created = sum(1 for result in results if result.status == "created")
+    return BulkTransactionResponse(created=created, failed=len(results) - created, results=results)
+
+
+async def _aenumerate(iterator):
+    index = 0
+    async for item in iterator:
+        yield index, item
+        index += 1
 
 @router.put("/transactions/{transaction_id}", response_model=TransactionResponse)
 def update_transaction(transaction_id: int, transaction: TransactionCreate, db: Session = Depends(get_db)):
@@ -120,7 +362,7 @@ def update_transaction(transaction_id: int, transaction: TransactionCreate, db:
     Returns:
     TransactionResponse: The updated transaction record.
     """
-    return update_transaction_crud(db, transaction_id=transaction_id, transaction=transaction)
+    return build_transaction_responses([update_transaction_crud(db, transaction_id=transaction_id, transaction=transaction)])[0]
 
 @router.delete("/transactions/{transaction_id}", response_model=TransactionResponse)
 def delete_transaction(transaction_id: int, db: Session = Depends(get_db)):
@@ -1,27 +1,158 @@
+import hashlib
+import json
+import logging
+import threading
 from pydantic import BaseModel, Field
 from datetime import datetime
-from cryptography.fernet import Fernet
+from typing import Any, List, Optional
+from cryptography.fernet import Fernet, MultiFernet
 from cryptography.fernet import InvalidToken
 from enum import Enum
 
-key = Fernet.generate_key()
-cipher_suite = Fernet(key)
+import orjson
+
+from app.lru import LRUCache
+from app.metrics import crypto_duration, timed
+from app.settings import Settings, settings
+
+logger = logging.getLogger(__name__)
+
+
+def load_encryption_keys(config: Optional[Settings] = None) -> List[bytes]:
+    """
+    Load the Fernet keys from the settings' encryption_keys (ENCRYPTION_KEYS,
+    a comma-separated list with the current key first followed by retired
+    keys that are still accepted for decryption).
+
+    Without any, a random key is generated. Rows written with it can't be
+    decrypted by any other process, so this is only suitable for local runs
+    with a single worker.
+    """
+    configured = (config or Settings()).encryption_keys
+    keys = [key.encode() for key in configured]
+    if not keys:
+        logger.warning("ENCRYPTION_KEYS is not set, using a random per-process key")
+        keys = [Fernet.generate_key()]
+    return keys
+
+
+# The keys and cipher are loaded from these settings on first use, so
+# importing the app doesn't generate a random key it may never use.
+_config = settings
+_keys = None
+_cipher = None
+_cipher_lock = threading.Lock()
+
+
+def get_cipher() -> MultiFernet:
+    """
+    Return the cipher, which encrypts with the first key and decrypts with any
+    of them, so keys can be rotated without downtime; see app/reencrypt.py.
+    """
+    global _keys, _cipher
+    if _cipher is None:
+        # Locked, so that workers' threads can't each generate a random key
+        with _cipher_lock:
+            if _cipher is None:
+                _keys = load_encryption_keys(_config)
+                _cipher = MultiFernet([Fernet(encryption_key) for encryption_key in _keys])
+    return _cipher
+
+
+def __getattr__(name: str):
+    # `keys`, `key` (the current key) and `cipher_suite` are loaded on first use, see get_cipher
+    if name == "cipher_suite":
+        return get_cipher()
+    if name in ("keys", "key"):
+        get_cipher()
+        return list(_keys) if name == "keys" else _keys[0]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def configure_encryption(config: Settings):
+    """
+    Use config's encryption keys from now on, if they differ from the ones
+    the cipher was built with, and config's name cache size.
+    """
+    global _config, _keys, _cipher
+    name_cache.resize(config.name_cache_size, config.name_cache_ttl)
+    if config.encryption_keys == _config.encryption_keys:
+        return
+    with _cipher_lock:
+        _config = config
+        _keys = _cipher = None
+    # Names decrypted with the previous keys may not decrypt with these
+    name_cache.clear()
 
 def encrypt_name(name: str) -> str:
-    encrypted_name = cipher_suite.encrypt(name.encode())
+    with timed(crypto_duration, "encrypt", component="crypto"):
+        encrypted_name = get_cipher().encrypt(name.encode())
     return encrypted_name.decode()
 
+def encrypt_names(names: List[str]) -> List[str]:
+    # Encrypt a batch of names with a single bound method lookup
+    encrypt = get_cipher().encrypt
+    with timed(crypto_duration, "encrypt", component="crypto"):
+        return [encrypt(name.encode()).decode() for name in names]
+
 def decrypt_name(encrypted_name: str) -> str:
-    decrypted_name = cipher_suite.decrypt(encrypted_name.encode())
+    decrypted_name = get_cipher().decrypt(encrypted_name.encode())
     return decrypted_name.decode()
 
+# Optional cache of decrypted names, keyed by a digest of the ciphertext so
+# that tokens are not kept as keys. Disabled unless NAME_CACHE_SIZE is set;
+# configure_encryption resizes it to the settings of the app being served.
+name_cache = LRUCache(maxsize=settings.name_cache_size, ttl=settings.name_cache_ttl)
+
+def purge_name_cache():
+    name_cache.clear()
+
+def decrypt_names(encrypted_names: List[str]) -> List[str]:
+    """
+    Decrypt a batch of names, e.g. for a list response.
+
+    Each distinct ciphertext is decrypted once per batch, and decrypted names
+    are served from and added to the name cache when it is enabled. Names no
+    key can decrypt are logged and returned as stored.
+
+    Parameters:
+    encrypted_names (List[str]): The encrypted names.
+
+    Returns:
+    List[str]: The decrypted names, in the same order.
+    """
+    with timed(crypto_duration, "decrypt", component="crypto"):
+        return _decrypt_names(encrypted_names)
+
+def _decrypt_names(encrypted_names: List[str]) -> List[str]:
+    decrypt = get_cipher().decrypt
+    decrypted = {}
+    for encrypted_name in encrypted_names:
+        if encrypted_name in decrypted:
+            continue
+        digest = hashlib.sha256(encrypted_name.encode()).digest() if name_cache.enabled else None
+        name = name_cache.get(digest) if digest else None
+        if name is None:
+            try:
+                name = decrypt(encrypted_name.encode()).decode()
+            except InvalidToken:
+                # One bad row (e.g. written with a dropped key, or before
+                # names were encrypted) shouldn't fail the whole response
+                logger.warning("Could not decrypt a name, returning it as stored")
+                name = encrypted_name
+            else:
+                if digest:
+                    name_cache.set(digest, name)
+        decrypted[encrypted_name] = name
+    return [decrypted[encrypted_name] for encrypted_name in encrypted_names]
+
 class TransactionType(str, Enum):
     credit = 'credit'
     debit = 'debit'
 class TransactionCreate(BaseModel):
     user_id: int
     full_name: str
-    transaction_date: datetime = datetime.now()
+    transaction_date: datetime = Field(default_factory=datetime.now)
     transaction_amount: float = Field(..., gt=0)
     transaction_type: TransactionType
     
@@ -46,10 +177,7 @@ class TransactionResponse(BaseModel):
     transaction_type: str
 
     def decrypt_full_name(self) -> str:
-        try:
-            return decrypt_name(self.full_name)
-        except InvalidToken:
-            raise ValueError("Decryption failed. Invalid token or corrupted data.")
+        return decrypt_names([self.full_name])[0]
 
     class Config:
         orm_mode = True
@@ -58,4 +186,86 @@ class TransactionResponse(BaseModel):
         data = super().model_dump()
         # Decrypt full_name before returning the response
         data['full_name'] = self.decrypt_full_name()
-        return data
\ No newline at end of file
+        return data
+
+
+RESPONSE_FIELDS = ("id", "user_id", "transaction_date", "transaction_amount", "transaction_type")
+
+
+def serialize_transaction(transaction) -> dict:
+    """
+    JSON-compatible dict of a transaction for the caches. The name stays
+    encrypted; build_transaction_responses decrypts it on the way out.
+    """
+    return json.loads(TransactionResponse.model_validate(transaction, from_attributes=True).model_dump_json())
+
+
+def build_transaction_responses(transactions) -> List[TransactionResponse]:
+    """
+    Build responses with decrypted names for a list of transactions, which
+    may be ORM objects or dicts, decrypting all the names in one batch.
+    """
+    def field(transaction, name):
+        return transaction[name] if isinstance(transaction, dict) else getattr(transaction, name)
+
+    names = decrypt_names([field(transaction, "full_name") for transaction in transactions])
+    return [
+        TransactionResponse(full_name=name, **{key: field(transaction, key) for key in RESPONSE_FIELDS})
+        for transaction, name in zip(transactions, names)
+    ]
+
+
+def encode_transaction_rows(rows) -> bytes:
+    """
+    Serialize TRANSACTION_COLUMNS rows straight to a JSON list body, skipping
+    ORM objects and per-item validation. Names are decrypted in one batch.
+    """
+    names = decrypt_names([row.full_name for row in rows])
+    return orjson.dumps(
+        [
+            {
+                "id": row.id,
+                "user_id": row.user_id,
+                "full_name": name,
+                "transaction_date": row.transaction_date,
+                "transaction_amount": row.transaction_amount,
+                "transaction_type": row.transaction_type,
+            }
+            for row, name in zip(rows, names)
+        ],
+        # Matches the Pydantic rendering of UTC datetimes
+        option=orjson.OPT_UTC_Z,
+    )
+
+
+def encrypt_payload(payload: bytes) -> str:
+    # Cached response bodies contain decrypted names, so they are stored encrypted
+    with timed(crypto_duration, "encrypt", component="crypto"):
+        return get_cipher().encrypt(payload).decode()
+
+
+def decrypt_payload(token: str) -> Optional[bytes]:
+    """
+    Decrypt a cached response body, or return None if none of the keys can
+    (e.g. it was cached by a worker with a random key, or before its key was
+    dropped), so that callers treat it as a cache miss.
+    """
+    with timed(crypto_duration, "decrypt", component="crypto"):
+        try:
+            return get_cipher().decrypt(token.encode())
+        except InvalidToken:
+            logger.warning("Could not decrypt a cached response, reading it from the database")
+            return None
+
+
+class BulkTransactionResult(BaseModel):
+    index: int
+    status: str  # 'created', 'invalid' or 'failed'
+    id: Optional[int] = None
+    errors: Optional[List[Any]] = None
+
+
+class BulkTransactionResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkTransactionResult]
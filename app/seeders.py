@@ -1,27 +1,73 @@
+"""
+Seed the database.
+
+    python -m app.seeders
+
+inserts a few sample transactions into an empty database. With
+--transactions it generates a synthetic dataset of any size instead, e.g.
+10M rows for benchmarking:
+
+    python -m app.seeders --users 100000 --transactions 10000000 --distribution zipf \\
+        --start 2023-01-01 --end 2025-01-01 --credit-ratio 0.4 --workers 8
+
+Transactions are spread over user IDs 1..users either evenly or with a Zipf
+distribution (user 1 has the most), so a few heavy users dominate like they
+do in production. Dates are uniform over the range and amounts log-normal.
+
+Rows are generated and their names encrypted in worker processes, one chunk
+at a time, while this process writes the previous chunk with COPY on
+Postgres (psycopg2) or multi-row INSERTs otherwise. Each chunk is committed
+on its own, and the running analytics are rebuilt once at the end. Like
+other bulk loads, seeding doesn't go through the CRUD functions, so it
+writes no outbox events and doesn't invalidate cached entries.
+"""
+import argparse
+import csv
+import io
+import multiprocessing
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from cryptography.fernet import Fernet
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, inspect
-from app.models.models import Transaction, Base
-from app.database import SessionLocal
-import datetime
+
+from app.crud.analytics_crud import rebuild_user_analytics
+from app.crud.transaction_crud import BULK_COLUMNS, use_copy
+from app.database import SessionLocal, engine
+from app.migrate import create_schema
+from app.models.models import Transaction
+from app.partitions import ensure_partitions, is_partitioned, supports_partitioning
+from app.schemas import transaction_schemas
+from app.schemas.transaction_schemas import encrypt_name
+
+CHUNK_SIZE = 20_000
+DISTRIBUTIONS = ("zipf", "uniform")
+
+FIRST_NAMES = ("John", "Jane", "Alice", "Bob", "Carol", "David", "Eve", "Frank", "Grace", "Heidi", "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy")
+LAST_NAMES = ("Doe", "Smith", "Johnson", "Brown", "Garcia", "Miller", "Davis", "Wilson", "Moore", "Taylor", "Anderson", "Thomas", "Jackson", "White", "Harris", "Martin")
 
 # Sample data to be seeded
 initial_data = [
     {
         "user_id": 1,
         "full_name": "John Doe",
-        "transaction_date": datetime.datetime.now(),
+        "transaction_date": datetime.now(),
         "transaction_amount": 100.0,
         "transaction_type": "credit"    },
     {
         "user_id": 2,
         "full_name": "Jane Smith",
-        "transaction_date": datetime.datetime.now(),
+        "transaction_date": datetime.now(),
         "transaction_amount": 250.5,
         "transaction_type": "debit"    },
     {
         "user_id": 3,
         "full_name": "Alice Johnson",
-        "transaction_date": datetime.datetime.now(),
+        "transaction_date": datetime.now(),
         "transaction_amount": 300.75,
         "transaction_type": "credit"    }
 ]
@@ -30,28 +76,233 @@ initial_data = [
 def seed_data(db: Session):
     if not db.query(Transaction).first():  # Check if any data exists
         for data in initial_data:
-            transaction = Transaction(**data)
+            # Names are stored encrypted, like the API stores them
+            transaction = Transaction(**{**data, "full_name": encrypt_name(data["full_name"])})
             db.add(transaction)
+        db.flush()
+        # Seeded rows bypass the CRUD functions, so rebuild the running analytics
+        rebuild_user_analytics(db)
         db.commit()
         print("Database seeded with initial data")
     else:
         print("Database already contains data, skipping seeding")
 
-# Function to create the table if it doesn't exist
-def create_table_if_not_exists(engine):
-    inspector = inspect(engine)
-    if 'transactions' not in inspector.get_table_names():
-        Base.metadata.create_all(bind=engine)
-        print("Table 'transactions' created")
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    start: datetime
+    end: datetime
+    credit_ratio: float = 0.5
+    seed: int = 42
+
+
+def user_counts(users: int, transactions: int, distribution: str = "zipf", zipf_s: float = 1.1) -> np.ndarray:
+    """
+    Split `transactions` over `users` users.
+
+    Parameters:
+    users (int): The number of users.
+    transactions (int): The total number of transactions.
+    distribution (str): 'uniform' for the same number per user, or 'zipf'
+    for counts proportional to 1 / rank ** zipf_s, where user 1 has rank 1.
+    zipf_s (float): The Zipf exponent; larger values are more skewed.
+
+    Returns:
+    np.ndarray: The number of transactions of each user; index 0 is user 1.
+    """
+    if distribution == "uniform":
+        weights = np.ones(users)
+    elif distribution == "zipf":
+        weights = 1.0 / np.arange(1, users + 1) ** zipf_s
+    else:
+        raise ValueError(f"Unknown distribution {distribution!r}, expected one of {DISTRIBUTIONS}")
+    counts = np.floor(weights / weights.sum() * transactions).astype(np.int64)
+    # The rounding remainder goes to the heaviest users, one each
+    counts[:transactions - int(counts.sum())] += 1
+    return counts
+
+
+def iter_chunks(counts: np.ndarray, chunk_size: int = CHUNK_SIZE) -> Iterator[List[Tuple[int, int]]]:
+    """
+    Group the per-user counts into chunks of at most `chunk_size` rows, as
+    (user_id, count) pieces. Heavy users are split over several chunks.
+    """
+    chunk, size = [], 0
+    for user_id, count in enumerate(counts.tolist(), start=1):
+        while count:
+            piece = min(count, chunk_size - size)
+            chunk.append((user_id, piece))
+            size += piece
+            count -= piece
+            if size == chunk_size:
+                yield chunk
+                chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def full_name(user_id: int) -> str:
+    return f"{FIRST_NAMES[user_id % len(FIRST_NAMES)]} {LAST_NAMES[user_id // len(FIRST_NAMES) % len(LAST_NAMES)]} {user_id}"
+
+
+_cipher = None
+
+
+def _init_worker(encryption_key: bytes):
+    # Encrypt with the parent's key: a worker that isn't forked would
+    # otherwise load its own, random one when ENCRYPTION_KEYS is unset
+    global _cipher
+    _cipher = Fernet(encryption_key)
+
+
+def generate_rows(task: Tuple[int, List[Tuple[int, int]], DatasetSpec]) -> List[tuple]:
+    """
+    Generate the rows of one chunk, with every name encrypted separately like
+    rows created through the API. Seeded by the chunk index, so a dataset is
+    reproducible whatever the number of workers.
+
+    Returns:
+    List[tuple]: The rows, with values in BULK_COLUMNS order.
+    """
+    index, pieces, spec = task
+    rng = np.random.default_rng([spec.seed, index])
+    user_ids = np.repeat([user_id for user_id, _ in pieces], [count for _, count in pieces])
+    size = len(user_ids)
+
+    span = max(int((spec.end - spec.start).total_seconds()), 1)
+    offsets = rng.integers(0, span, size)
+    amounts = np.maximum(np.round(rng.lognormal(3.5, 1.2, size), 2), 0.01)
+    credits = rng.random(size) < spec.credit_ratio
+
+    encrypt = _cipher.encrypt
+    names = {user_id: full_name(user_id).encode() for user_id, _ in pieces}
+    start = spec.start
+    return [
+        (user_id, encrypt(names[user_id]).decode(), start + timedelta(seconds=offset), amount, "credit" if credit else "debit")
+        for user_id, offset, amount, credit in zip(user_ids.tolist(), offsets.tolist(), amounts.tolist(), credits.tolist())
+    ]
+
+
+def write_rows(db: Session, rows: List[tuple], copy: bool):
+    """
+    Insert generated rows with COPY, or with multi-row INSERTs, and commit.
+    """
+    if copy:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY transactions ({', '.join(BULK_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+    else:
+        db.execute(insert(Transaction), [dict(zip(BULK_COLUMNS, row)) for row in rows])
+    db.commit()
+
+
+def generate(
+    users: int,
+    transactions: int,
+    distribution: str = "zipf",
+    zipf_s: float = 1.1,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    credit_ratio: float = 0.5,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    seed: int = 42,
+) -> int:
+    """
+    Insert a synthetic dataset and rebuild the running analytics.
+
+    Parameters:
+    users (int): The number of users, with IDs 1..users.
+    transactions (int): The total number of transactions.
+    distribution (str): How transactions are spread over users, 'zipf' or 'uniform'.
+    zipf_s (float): The Zipf exponent.
+    start (datetime): The earliest transaction date. Default is a year before `end`.
+    end (datetime): The latest transaction date. Default is now.
+    credit_ratio (float): The share of credit transactions.
+    workers (int): The processes generating rows. Default is the CPU count; 1 generates them in this process.
+    chunk_size (int): The rows generated, inserted and committed at a time.
+    seed (int): The random seed.
+
+    Returns:
+    int: The number of rows inserted.
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=365)
+    if start >= end:
+        raise ValueError("start must be before end")
+    spec = DatasetSpec(start, end, credit_ratio, seed)
+    counts = user_counts(users, transactions, distribution, zipf_s)
+
+    create_schema(engine)
+    if supports_partitioning(engine):
+        with engine.begin() as connection:
+            if is_partitioned(connection):
+                ensure_partitions(connection, start.date(), end.date())
+
+    workers = workers or multiprocessing.cpu_count()
+    tasks = ((index, pieces, spec) for index, pieces in enumerate(iter_chunks(counts, chunk_size)))
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(transaction_schemas.key,))
+        chunks = pool.imap(generate_rows, tasks)
+    else:
+        _init_worker(transaction_schemas.key)
+        chunks = map(generate_rows, tasks)
+
+    db = SessionLocal()
+    began = time.perf_counter()
+    try:
+        copy = use_copy(db)
+        inserted = 0
+        for rows in chunks:
+            write_rows(db, rows, copy)
+            inserted += len(rows)
+            print(f"Inserted {inserted}/{transactions} rows ({inserted / (time.perf_counter() - began):.0f} rows/s)")
+        # Seeded rows bypass the CRUD functions, so rebuild the running analytics
+        rebuild_user_analytics(db)
+        db.commit()
+        return inserted
+    finally:
+        db.close()
+        if pool is not None:
+            pool.terminate()
+
+
 # Function to run the seeder on startup
 def run():
-    engine = create_engine('sqlite:///./test.db')  # Adjust the database URL as needed
-    create_table_if_not_exists(engine)
+    create_schema(engine)
     db = SessionLocal()
     try:
         seed_data(db)
     finally:
         db.close()
 
+
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=None, help="Generate this many transactions. Without it, only the sample rows are seeded")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="zipf")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent; larger is more skewed")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None, help="ISO date; default is a year before --end")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None, help="ISO date; default is now")
+    parser.add_argument("--credit-ratio", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None, help="Default is the CPU count")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.transactions is None:
+        run()
+    else:
+        began = time.perf_counter()
+        inserted = generate(
+            args.users, args.transactions, args.distribution, args.zipf_s, args.start, args.end,
+            args.credit_ratio, args.workers, args.chunk_size, args.seed,
+        )
+        print(f"Done, inserted {inserted} transactions in {time.perf_counter() - began:.1f}s")
@@ -0,0 +1,169 @@
+import os
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_list(name: str) -> Tuple[str, ...]:
+    value = os.getenv(name, "")
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Application settings, read from the environment (and .env).
+
+    The sync and async engines are both configured from the same settings, so
+    pools can be sized per worker in one place: each worker process opens at
+    most db_pool_size + db_max_overflow connections per engine.
+    """
+    database_url: str = field(default_factory=lambda: os.getenv("DATABASE_URL", "sqlite:///./test.db"))
+    # Comma-separated read replica URLs, used by the GET endpoints through get_read_db
+    database_replica_urls: Tuple[str, ...] = field(default_factory=lambda: env_list("DATABASE_REPLICA_URLS"))
+    # Seconds between replica health checks
+    db_replica_check_interval: float = field(default_factory=lambda: env_float("DB_REPLICA_CHECK_INTERVAL", 5.0))
+    # Seconds a user's reads stay on the primary after they write, to cover replication lag
+    read_your_writes_seconds: float = field(default_factory=lambda: env_float("READ_YOUR_WRITES_SECONDS", 5.0))
+    # Logging every statement is expensive under load, so it is opt-in
+    db_echo: bool = field(default_factory=lambda: env_bool("DB_ECHO"))
+    db_pool_size: int = field(default_factory=lambda: env_int("DB_POOL_SIZE", 5))
+    db_max_overflow: int = field(default_factory=lambda: env_int("DB_MAX_OVERFLOW", 10))
+    # Seconds to wait for a free connection before giving up
+    db_pool_timeout: float = field(default_factory=lambda: env_float("DB_POOL_TIMEOUT", 30.0))
+    # Seconds after which connections are replaced, to stay under server/proxy idle limits
+    db_pool_recycle: int = field(default_factory=lambda: env_int("DB_POOL_RECYCLE", 1800))
+    db_pool_pre_ping: bool = field(default_factory=lambda: env_bool("DB_POOL_PRE_PING", True))
+    # Server-side statement timeout in milliseconds (Postgres only), None to disable
+    db_statement_timeout_ms: Optional[int] = field(default_factory=lambda: env_int("DB_STATEMENT_TIMEOUT_MS", 30000))
+    # Redis only backs caches, so the clients fail fast (in seconds) instead of retrying
+    redis_url: str = field(default_factory=lambda: os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    redis_connect_timeout: float = field(default_factory=lambda: env_float("REDIS_CONNECT_TIMEOUT", 0.5))
+    redis_socket_timeout: float = field(default_factory=lambda: env_float("REDIS_SOCKET_TIMEOUT", 1.0))
+    # Fernet keys for the stored names, current key first, then retired keys
+    # still accepted for decryption (see app.reencrypt). ENCRYPTION_KEY is
+    # accepted for a single key.
+    encryption_keys: Tuple[str, ...] = field(default_factory=lambda: env_list("ENCRYPTION_KEYS") or env_list("ENCRYPTION_KEY"))
+    # Serve the transaction and analytics routes with the async engine and Redis client
+    async_mode: bool = field(default_factory=lambda: env_bool("ASYNC_MODE"))
+    # Add a Server-Timing header (db, cache and crypto time) to every response
+    server_timing: bool = field(default_factory=lambda: env_bool("SERVER_TIMING"))
+    # Redis cache entries (app.cache) are invalidated on every write, so they can live long
+    cache_ttl: int = field(default_factory=lambda: env_int("CACHE_TTL", 86400))
+    # Seconds to skip Redis after a connection failure before trying again
+    redis_retry_after: float = field(default_factory=lambda: env_float("REDIS_RETRY_AFTER", 5.0))
+    # Cross-worker fill lease: how long one worker may recompute a value before
+    # others stop waiting for it, and how often waiting workers poll for the result
+    cache_lease_seconds: float = field(default_factory=lambda: env_float("CACHE_LEASE_SECONDS", 5.0))
+    cache_lease_poll: float = field(default_factory=lambda: env_float("CACHE_LEASE_POLL", 0.05))
+    # Serve the previous value while another request recomputes the current one
+    cache_stale_while_revalidate: bool = field(default_factory=lambda: env_bool("CACHE_STALE_WHILE_REVALIDATE", True))
+    # In-process cache tier in front of Redis, and the pub/sub channel that keeps it in sync
+    local_cache_size: int = field(default_factory=lambda: env_int("LOCAL_CACHE_SIZE", 10_000))
+    local_cache_ttl: float = field(default_factory=lambda: env_float("LOCAL_CACHE_TTL", 5.0))
+    cache_invalidation_channel: str = field(default_factory=lambda: os.getenv("CACHE_INVALIDATION_CHANNEL", "cache_invalidation"))
+    # Decrypted names cached per worker, disabled with a size of 0
+    name_cache_size: int = field(default_factory=lambda: env_int("NAME_CACHE_SIZE", 0))
+    name_cache_ttl: float = field(default_factory=lambda: env_float("NAME_CACHE_TTL", 300.0))
+    # Redis stream the web workers append post-create jobs to, consumed by app.worker,
+    # with an approximate cap on its length so acknowledged jobs don't pile up
+    job_stream: str = field(default_factory=lambda: os.getenv("JOB_STREAM", "transaction_jobs"))
+    job_group: str = field(default_factory=lambda: os.getenv("JOB_GROUP", "transaction_workers"))
+    job_stream_maxlen: int = field(default_factory=lambda: env_int("JOB_STREAM_MAXLEN", 1_000_000))
+    # Seconds an Idempotency-Key is remembered for POST /transactions/
+    idempotency_key_ttl: int = field(default_factory=lambda: env_int("IDEMPOTENCY_KEY_TTL", 86400))
+    # Monthly range partitioning of the transactions table (Postgres only), see app.partitions
+    db_partition_transactions: bool = field(default_factory=lambda: env_bool("DB_PARTITION_TRANSACTIONS"))
+    db_partition_months_ahead: int = field(default_factory=lambda: env_int("DB_PARTITION_MONTHS_AHEAD", 3))
+    # Months of transactions kept in the database; older months are moved to
+    # compressed files in archive_dir by app.archive. None disables archival.
+    archive_after_months: Optional[int] = field(default_factory=lambda: env_int("ARCHIVE_AFTER_MONTHS", None))
+    archive_dir: str = field(default_factory=lambda: os.getenv("ARCHIVE_DIR", "./archive"))
+    # 'csv' (gzip-compressed) or 'parquet' (requires pyarrow)
+    archive_format: str = field(default_factory=lambda: os.getenv("ARCHIVE_FORMAT", "csv"))
+    # Token buckets per client address and per user_id (app.ratelimit), in
+    # requests per second with a burst size. A rate of None disables the bucket.
+    rate_limit_client_rate: Optional[float] = field(default_factory=lambda: env_float("RATE_LIMIT_CLIENT_RATE", None))
+    rate_limit_client_burst: int = field(default_factory=lambda: env_int("RATE_LIMIT_CLIENT_BURST", 50))
+    rate_limit_user_rate: Optional[float] = field(default_factory=lambda: env_float("RATE_LIMIT_USER_RATE", None))
+    rate_limit_user_burst: int = field(default_factory=lambda: env_int("RATE_LIMIT_USER_BURST", 20))
+    # Load shedding: reject requests with 503 while this worker has more than
+    # max_in_flight requests, or a connection checkout recently waited longer
+    # than load_shed_pool_wait seconds. None disables each check.
+    max_in_flight_requests: Optional[int] = field(default_factory=lambda: env_int("MAX_IN_FLIGHT_REQUESTS", None))
+    load_shed_pool_wait: Optional[float] = field(default_factory=lambda: env_float("LOAD_SHED_POOL_WAIT", None))
+    load_shed_retry_after: int = field(default_factory=lambda: env_int("LOAD_SHED_RETRY_AFTER", 1))
+    # Change feed (app.outbox): outbox rows are moved to this Redis stream by
+    # `python -m app.outbox`, or by a thread in each web worker when
+    # outbox_publish_in_app is set, and served at GET /transactions/stream
+    outbox_stream: str = field(default_factory=lambda: os.getenv("OUTBOX_STREAM", "transaction_events"))
+    outbox_stream_maxlen: int = field(default_factory=lambda: env_int("OUTBOX_STREAM_MAXLEN", 1_000_000))
+    outbox_publish_in_app: bool = field(default_factory=lambda: env_bool("OUTBOX_PUBLISH_IN_APP"))
+    outbox_poll_interval: float = field(default_factory=lambda: env_float("OUTBOX_POLL_INTERVAL", 0.2))
+    outbox_batch_size: int = field(default_factory=lambda: env_int("OUTBOX_BATCH_SIZE", 500))
+    # Cache warm-up (app.warmup): precompute the most active users' analytics
+    # and first transaction page into Redis, once in the background at startup
+    # and then every interval seconds (None: startup only).
+    cache_warmup_on_startup: bool = field(default_factory=lambda: env_bool("CACHE_WARMUP_ON_STARTUP"))
+    cache_warmup_interval: Optional[float] = field(default_factory=lambda: env_float("CACHE_WARMUP_INTERVAL", None))
+    cache_warmup_users: int = field(default_factory=lambda: env_int("CACHE_WARMUP_USERS", 1000))
+    cache_warmup_concurrency: int = field(default_factory=lambda: env_int("CACHE_WARMUP_CONCURRENCY", 4))
+    # In-memory columnar snapshot behind /analytics/global, see app.global_analytics.
+    # It is topped up with new rows at most every refresh_seconds and fully
+    # reloaded (picking up updates and deletes) every reload_seconds.
+    global_analytics_refresh_seconds: float = field(default_factory=lambda: env_float("GLOBAL_ANALYTICS_REFRESH_SECONDS", 30.0))
+    global_analytics_reload_seconds: float = field(default_factory=lambda: env_float("GLOBAL_ANALYTICS_RELOAD_SECONDS", 3600.0))
+    global_analytics_chunk_size: int = field(default_factory=lambda: env_int("GLOBAL_ANALYTICS_CHUNK_SIZE", 50000))
+    # Optional routes, served by default: GET /transactions/export, the change
+    # feed at GET /transactions/stream and /analytics/global. The modules of
+    # disabled routes aren't imported.
+    serve_export: bool = field(default_factory=lambda: env_bool("SERVE_EXPORT", True))
+    serve_change_feed: bool = field(default_factory=lambda: env_bool("SERVE_CHANGE_FEED", True))
+    serve_global_analytics: bool = field(default_factory=lambda: env_bool("SERVE_GLOBAL_ANALYTICS", True))
+
+    @property
+    def limits_requests(self) -> bool:
+        """
+        Whether any rate limit or load shedding check is enabled, see app.ratelimit.
+        """
+        return bool(self.rate_limit_client_rate or self.rate_limit_user_rate) or (
+            self.max_in_flight_requests is not None or self.load_shed_pool_wait is not None
+        )
+
+
+settings = Settings()
+
+# The settings of the app being served, set from create_app's settings by the
+# app's lifespan (see app.main.configure). Code that runs per request or in
+# background tasks reads them through current_settings(), so an app created
+# with other settings doesn't fall back to the environment's.
+_current = settings
+
+
+def current_settings() -> Settings:
+    return _current
+
+
+def use_settings(config: Settings):
+    global _current
+    _current = config
@@ -0,0 +1,148 @@
+"""
+Cache warm-up for the most active users.
+
+After a deploy or a Redis flush every cache entry is cold, and the first
+requests for the busiest users all miss at once. `python -m app.warmup`
+(e.g. from cron) precomputes the analytics and the first transactions page
+of the CACHE_WARMUP_USERS users with the most transactions, skipping entries
+that are still current. Users are processed in batches by a bounded thread
+pool, and each batch is written to Redis with one pipelined round trip.
+
+With CACHE_WARMUP_ON_STARTUP the app runs it in a background thread at
+startup, and again every CACHE_WARMUP_INTERVAL seconds if set. A Redis lease
+makes only one worker warm the cache per run.
+"""
+import argparse
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.cache import ANALYTICS, TRANSACTIONS, find_cold_entries, mark_redis_down, redis_available, set_user_cached_many
+from app.crud.analytics_crud import get_user_analytics_summary
+from app.crud.transaction_crud import DEFAULT_PAGE_LIMIT, first_page_entry, get_transaction_rows_page
+from app.database import SessionLocal
+from app.models.models import UserAnalytics
+from app.redis_client import redis_client
+from app.settings import Settings, current_settings
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+WARMUP_LEASE_KEY = "cache_warmup_lease"
+
+
+def most_active_users(db: Session, limit: int) -> List[int]:
+    """
+    The IDs of the `limit` users with the most transactions, from the running aggregates.
+    """
+    return list(db.scalars(
+        select(UserAnalytics.user_id)
+        .where(UserAnalytics.transaction_count > 0)
+        .order_by(UserAnalytics.transaction_count.desc())
+        .limit(limit)
+    ))
+
+
+def warm_users(user_ids: List[int]) -> int:
+    """
+    Fill the cold analytics and first-page entries of a batch of users.
+
+    The cache versions are read before the values are computed, so a write
+    that lands meanwhile leaves the new entries outdated rather than wrong.
+
+    Returns:
+    int: The number of entries written.
+    """
+    cold_analytics = find_cold_entries(ANALYTICS, user_ids)
+    cold_pages = find_cold_entries(TRANSACTIONS, user_ids)
+    analytics, pages = {}, {}
+    db = SessionLocal()
+    try:
+        for user_id, version in cold_analytics.items():
+            summary = get_user_analytics_summary(db, user_id)
+            if summary is not None:
+                analytics[user_id] = (version, summary)
+        for user_id, version in cold_pages.items():
+            rows, next_cursor = get_transaction_rows_page(db, user_id=user_id, limit=DEFAULT_PAGE_LIMIT)
+            pages[user_id] = (version, first_page_entry(rows, next_cursor, DEFAULT_PAGE_LIMIT))
+    finally:
+        db.close()
+    set_user_cached_many(ANALYTICS, analytics)
+    set_user_cached_many(TRANSACTIONS, pages)
+    return len(analytics) + len(pages)
+
+
+def warm_cache(users: Optional[int] = None, concurrency: Optional[int] = None) -> int:
+    """
+    Warm the cache for the most active users.
+
+    Parameters:
+    users (int): The number of users to warm. Default is CACHE_WARMUP_USERS.
+    concurrency (int): The number of batches processed at once. Default is CACHE_WARMUP_CONCURRENCY.
+
+    Returns:
+    int: The number of cache entries written.
+    """
+    if not redis_available():
+        return 0
+    users = current_settings().cache_warmup_users if users is None else users
+    concurrency = current_settings().cache_warmup_concurrency if concurrency is None else concurrency
+    db = SessionLocal()
+    try:
+        user_ids = most_active_users(db, users)
+    finally:
+        db.close()
+    batches = [user_ids[start:start + BATCH_SIZE] for start in range(0, len(user_ids), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="cache-warmup") as pool:
+        return sum(pool.map(warm_users, batches))
+
+
+def _claim_run(seconds: float) -> bool:
+    # One worker per run; the lease expires before the next scheduled run
+    try:
+        return bool(redis_client.set(WARMUP_LEASE_KEY, uuid.uuid4().hex, nx=True, px=max(1, int(seconds * 1000))))
+    except redis.RedisError as exc:
+        mark_redis_down(exc)
+        return False
+
+
+def _run_scheduled(interval: Optional[float]):
+    while True:
+        started = time.monotonic()
+        try:
+            if redis_available() and _claim_run(interval or 60):
+                written = warm_cache()
+                logger.info("Cache warm-up wrote %s entries in %.1fs", written, time.monotonic() - started)
+        except Exception:
+            logger.exception("Cache warm-up failed")
+        if interval is None:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def start_cache_warmup(config: Settings):
+    """
+    Warm the cache in a background thread, so startup doesn't wait for it,
+    if config's cache_warmup_on_startup is set, and then every
+    cache_warmup_interval seconds.
+    """
+    if config.cache_warmup_on_startup:
+        threading.Thread(target=_run_scheduled, args=(config.cache_warmup_interval,), name="cache-warmup", daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the most active users' analytics and first transactions page into Redis.")
+    parser.add_argument("--users", type=int, default=None, help="Default is CACHE_WARMUP_USERS")
+    parser.add_argument("--concurrency", type=int, default=None, help="Default is CACHE_WARMUP_CONCURRENCY")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    written = warm_cache(args.users, args.concurrency)
+    print(f"Wrote {written} cache entries in {time.monotonic() - started:.1f}s")
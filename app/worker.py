@@ -0,0 +1,165 @@
+"""
+Worker for the transaction job stream.
+
+    python -m app.worker [--consumer NAME] [--batch-size 500]
+
+Reads jobs queued by the web workers through a Redis consumer group. Each batch
+is grouped by user_id, so a burst of transactions from one user triggers a
+single credit score recalculation. Failed jobs are left pending and claimed
+again, like jobs left by a consumer that died, once idle for --claim-idle-ms.
+After --max-attempts deliveries they are moved to the dead letter stream.
+While Redis is unreachable the worker backs off and retries.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import redis
+
+from app.crud.transaction_crud import process_transaction_batch
+from app.jobs import DEAD_LETTER_STREAM, JOB_GROUP, JOB_STREAM, JOB_STREAM_MAXLEN
+from app.redis_client import build_client
+from app.settings import settings
+
+logger = logging.getLogger("app.worker")
+
+# Seconds to wait after a Redis error, doubling up to the maximum
+REDIS_BACKOFF_MIN = 0.5
+REDIS_BACKOFF_MAX = 30.0
+
+# The worker blocks on XREADGROUP, so it can't share the web client's short socket timeout
+redis_client = build_client(settings, socket_timeout=False)
+
+
+def ensure_group():
+    try:
+        redis_client.xgroup_create(JOB_STREAM, JOB_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as exc:
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+def delivery_counts(message_ids: Iterable[str]) -> Dict[str, int]:
+    # How many times each pending message was delivered, i.e. attempted
+    pipe = redis_client.pipeline(transaction=False)
+    for message_id in message_ids:
+        pipe.xpending_range(JOB_STREAM, JOB_GROUP, min=message_id, max=message_id, count=1)
+    return {entry["message_id"]: entry["times_delivered"] for entries in pipe.execute() for entry in entries}
+
+
+def dead_letter(messages: List[Tuple[str, dict, int]]):
+    pipe = redis_client.pipeline(transaction=False)
+    for _, fields, attempts in messages:
+        pipe.xadd(DEAD_LETTER_STREAM, {**fields, "attempts": attempts}, maxlen=JOB_STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def process_messages(messages, max_attempts: int):
+    """
+    Process a batch of stream messages, coalescing the jobs per user.
+
+    Jobs that fail are not acknowledged, so they stay pending and are
+    retried once claimed again, unless they were already attempted
+    max_attempts times: then they are moved to the dead letter stream.
+
+    Parameters:
+    messages (List[Tuple[str, dict]]): (message_id, fields) pairs from the stream.
+    max_attempts (int): Attempts before a job is moved to the dead letter stream.
+
+    Returns:
+    List[str]: The IDs of the messages that can be acknowledged.
+    """
+    by_user = defaultdict(list)
+    done = []
+    for message_id, fields in messages:
+        if not fields:
+            # Trimmed from the stream while pending
+            done.append(message_id)
+            continue
+        by_user[int(fields["user_id"])].append((message_id, fields))
+
+    for user_id, user_messages in by_user.items():
+        transaction_ids = sorted(int(fields["transaction_id"]) for _, fields in user_messages)
+        try:
+            process_transaction_batch({user_id: transaction_ids})
+        except Exception:
+            logger.exception("Jobs for user %s failed", user_id)
+            counts = delivery_counts(message_id for message_id, _ in user_messages)
+            # A message missing from the pending list would not be delivered again
+            exhausted = [
+                (message_id, fields, counts.get(message_id, max_attempts))
+                for message_id, fields in user_messages
+                if counts.get(message_id, max_attempts) >= max_attempts
+            ]
+            if exhausted:
+                dead_letter(exhausted)
+                done.extend(message_id for message_id, _, _ in exhausted)
+            continue
+        done.extend(message_id for message_id, _ in user_messages)
+    return done
+
+
+def run(consumer: str, batch_size: int = 500, block_ms: int = 5000, claim_idle_ms: int = 60000, max_attempts: int = 5):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Worker %s consuming %s", consumer, JOB_STREAM)
+
+    group_ready = False
+    backoff = 0.0
+    while not stopping:
+        try:
+            if not group_ready:
+                ensure_group()
+                group_ready = True
+
+            # Take over jobs that failed, or whose consumer died before acknowledging them
+            # (XAUTOCLAIM replies with 2 elements on Redis 6.2 and 3 on Redis 7)
+            messages = redis_client.xautoclaim(JOB_STREAM, JOB_GROUP, consumer, min_idle_time=claim_idle_ms, count=batch_size)[1]
+            if not messages:
+                response = redis_client.xreadgroup(JOB_GROUP, consumer, {JOB_STREAM: ">"}, count=batch_size, block=block_ms)
+                messages = response[0][1] if response else []
+            backoff = 0.0
+            if not messages:
+                continue
+
+            done = process_messages(messages, max_attempts)
+            if done:
+                redis_client.xack(JOB_STREAM, JOB_GROUP, *done)
+            logger.info("Processed %s jobs", len(done))
+        except redis.RedisError as exc:
+            # Unacknowledged jobs stay pending and are claimed again once Redis
+            # is back. The group is recreated in case Redis lost it.
+            backoff = min(max(backoff * 2, REDIS_BACKOFF_MIN), REDIS_BACKOFF_MAX)
+            logger.warning("Redis error, retrying in %.1fs: %s", backoff, exc)
+            group_ready = False
+            time.sleep(backoff)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consumer", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--block-ms", type=int, default=5000)
+    parser.add_argument("--claim-idle-ms", type=int, default=60000)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(
+        consumer=args.consumer,
+        batch_size=args.batch_size,
+        block_ms=args.block_ms,
+        claim_idle_ms=args.claim_idle_ms,
+        max_attempts=args.max_attempts,
+    )
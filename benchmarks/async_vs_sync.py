@@ -0,0 +1,70 @@
+"""
+Compare request throughput of the async request path (ASYNC_MODE) against the
+sync one. Both apps are driven in-process through httpx.AsyncClient, against
+the database in DATABASE_URL (a throwaway SQLite file by default).
+
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+from dataclasses import replace
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./benchmark.db")
+
+from fastapi import FastAPI
+
+from app.database import engine, get_async_engine
+from app.main import create_app
+from app.migrate import create_schema
+from app.settings import settings
+from benchmarks.common import drive
+
+
+def build_app(async_mode: bool) -> FastAPI:
+    return create_app(replace(settings, async_mode=async_mode))
+
+
+def request_mix(users: int):
+    """Yield (method, url, body) tuples: mostly reads with some writes."""
+    while True:
+        user_id = random.randint(1, users)
+        roll = random.random()
+        if roll < 0.4:
+            yield "GET", f"/transactions/analytics/{user_id}", None
+        elif roll < 0.8:
+            yield "GET", f"/transactions/?user_id={user_id}", None
+        else:
+            yield "POST", "/transactions/", {
+                "user_id": user_id,
+                "full_name": "Benchmark User",
+                "transaction_amount": round(random.uniform(1, 500), 2),
+                "transaction_type": random.choice(["credit", "debit"]),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    create_schema(engine)
+
+    async def both():
+        results = {}
+        for name, async_mode in (("sync", False), ("async", True)):
+            # Warm up connections and caches before measuring
+            await drive(build_app(async_mode), request_mix(args.users), min(100, args.requests), args.concurrency)
+            results[name] = await drive(build_app(async_mode), request_mix(args.users), args.requests, args.concurrency)
+        await get_async_engine().dispose()
+        return results
+
+    for name, result in asyncio.run(both()).items():
+        print(f"{name:>5}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional, Tuple
+
+import httpx
+from sqlalchemy import event
+
+# (method, url, json body or None)
+Request = Tuple[str, str, Optional[dict]]
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed: float, errors: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def drive(app, requests: Iterator[Request], total: int, concurrency: int, is_error: Callable[[httpx.Response], bool] = None) -> dict:
+    """
+    Send `total` requests from `requests` to an ASGI app in-process, with at
+    most `concurrency` in flight, and summarize throughput and latency.
+    """
+    is_error = is_error or (lambda response: response.status_code >= 500)
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        async def one():
+            nonlocal errors
+            method, url, body = next(requests)
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies.append(time.perf_counter() - start)
+                errors += is_error(response)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return summarize(latencies, elapsed, errors)
+
+
+class QueryCounter:
+    """
+    Count SQL statements executed on a set of engines.
+    """
+
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(getattr(engine, "sync_engine", engine), "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, name: str, config: dict, results: dict):
+    """
+    Write benchmark results as JSON, tagged with the commit they were measured on.
+    """
+    report = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {path}")
@@ -0,0 +1,36 @@
+"""
+Compare two benchmark result files, e.g. from before and after a change.
+
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ("req_per_sec", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for name, after_result in after["results"].items():
+        before_result = before["results"].get(name)
+        if before_result is None:
+            continue
+        print(name)
+        for metric in METRICS:
+            if metric not in after_result or metric not in before_result:
+                continue
+            old, new = before_result[metric], after_result[metric]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"  {metric:>20}: {old:>10} -> {new:>10} ({change})")
+
+
+if __name__ == "__main__":
+    main()
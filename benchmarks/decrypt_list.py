@@ -0,0 +1,72 @@
+"""
+Measure rows/sec of building list responses with decrypted names:
+
+- per_row:      one TransactionResponse and one decrypt call per row (the old path)
+- batched:      build_transaction_responses with the name cache disabled
+- cached_cold:  build_transaction_responses with an empty name cache
+- cached_warm:  the same rows again, served from the name cache
+
+    python -m benchmarks.decrypt_list --rows 20000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from app.schemas import transaction_schemas
+from app.schemas.transaction_schemas import TransactionResponse, build_transaction_responses, encrypt_names
+
+
+def make_rows(count: int):
+    names = encrypt_names([f"User {index % 500}" for index in range(count)])
+    return [
+        {
+            "id": index,
+            "user_id": 1,
+            "full_name": name,
+            "transaction_date": datetime(2024, 1, 1),
+            "transaction_amount": 10.0,
+            "transaction_type": "credit",
+        }
+        for index, name in enumerate(names)
+    ]
+
+
+def per_row(rows):
+    responses = []
+    for row in rows:
+        response = TransactionResponse(**row)
+        response.full_name = response.decrypt_full_name()
+        responses.append(response)
+    return responses
+
+
+def timed(function, rows):
+    start = time.perf_counter()
+    function(rows)
+    return round(len(rows) / (time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+
+    cache = transaction_schemas.name_cache
+    results = {}
+
+    cache.maxsize = 0
+    results["per_row"] = timed(per_row, rows)
+    results["batched"] = timed(build_transaction_responses, rows)
+
+    cache.maxsize = args.rows
+    cache.clear()
+    results["cached_cold"] = timed(build_transaction_responses, rows)
+    results["cached_warm"] = timed(build_transaction_responses, rows)
+
+    for name, rows_per_sec in results.items():
+        print(f"{name:>12}: {rows_per_sec} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Load test the transaction and analytics endpoints in-process.
+
+Seeds N users x M transactions (unless the database already holds that many),
+then drives the full app through httpx.AsyncClient one endpoint at a time and
+reports req/s, p50/p95/p99 latency and SQL statements per request. Results go
+to a JSON file that can be compared across commits with benchmarks.compare.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.load --users 1000 --per-user 200
+    python -m benchmarks.load --output before.json   # SQLite file by default
+"""
+import argparse
+import asyncio
+import os
+import random
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./benchmark.db")
+
+from sqlalchemy import func, select
+
+from app.database import SessionLocal, engine, get_async_engine
+from app.main import ASYNC_MODE, app
+from app.migrate import create_schema
+from app.models.models import Transaction
+from benchmarks.common import QueryCounter, drive, write_results
+from benchmarks.seed import is_seeded, seed
+
+
+def scenarios(users: int, max_id: int):
+    """Request generators per endpoint."""
+    def post_transaction():
+        while True:
+            yield "POST", "/transactions/", {
+                "user_id": random.randint(1, users),
+                "full_name": "Load Test",
+                "transaction_amount": round(random.uniform(1, 1000), 2),
+                "transaction_type": random.choice(("credit", "debit")),
+            }
+
+    def list_transactions():
+        while True:
+            yield "GET", f"/transactions/?user_id={random.randint(1, users)}", None
+
+    def get_transaction():
+        while True:
+            yield "GET", f"/transactions/{random.randint(1, max_id)}", None
+
+    def analytics():
+        while True:
+            yield "GET", f"/transactions/analytics/{random.randint(1, users)}", None
+
+    def analytics_buckets():
+        while True:
+            yield "GET", f"/transactions/analytics/{random.randint(1, users)}?bucket=month", None
+
+    return {
+        "POST /transactions/": post_transaction,
+        "GET /transactions/": list_transactions,
+        "GET /transactions/{id}": get_transaction,
+        "GET /transactions/analytics/{user_id}": analytics,
+        "GET /transactions/analytics/{user_id}?bucket=month": analytics_buckets,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--per-user", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--endpoint", action="append", help="only run these endpoints (repeatable)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    # The app no longer creates the schema on import
+    create_schema(engine)
+    if not is_seeded(args.users, args.per_user):
+        print(f"Seeding {args.users} users x {args.per_user} transactions...")
+        seed(args.users, args.per_user)
+
+    db = SessionLocal()
+    try:
+        max_id = db.scalar(select(func.max(Transaction.id)))
+    finally:
+        db.close()
+
+    counter = QueryCounter(*([engine, get_async_engine()] if ASYNC_MODE else [engine]))
+    selected = scenarios(args.users, max_id)
+    if args.endpoint:
+        selected = {name: selected[name] for name in args.endpoint}
+
+    async def run_all():
+        results = {}
+        for name, requests in selected.items():
+            # Warm up connections and caches, then measure
+            await drive(app, requests(), min(50, args.requests), args.concurrency)
+            counter.reset()
+            result = await drive(app, requests(), args.requests, args.concurrency)
+            result["queries_per_request"] = round(counter.count / args.requests, 2)
+            results[name] = result
+            print(f"{name}: " + ", ".join(f"{key}={value}" for key, value in result.items()))
+        return results
+
+    results = asyncio.run(run_all())
+    config = {
+        "users": args.users,
+        "per_user": args.per_user,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "database": engine.dialect.name,
+        "async_mode": ASYNC_MODE,
+    }
+    write_results(args.output, "load", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Seed a benchmark database with N users x M transactions.
+
+    python -m benchmarks.seed --users 1000 --per-user 100
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app.database import SessionLocal
+from app.models.models import Transaction
+from app.seeders import generate
+
+
+def seed(users: int, per_user: int, days: int = 365, seed: int = 42) -> int:
+    """
+    Insert `per_user` transactions for each of user IDs 1..`users`, spread over
+    the last `days` days, then rebuild the running analytics. For skewed or
+    larger datasets use `python -m app.seeders` directly.
+
+    Returns:
+    int: The number of rows inserted.
+    """
+    end = datetime.now()
+    return generate(users, users * per_user, distribution="uniform", start=end - timedelta(days=days), end=end, seed=seed)
+
+
+def is_seeded(users: int, per_user: int) -> bool:
+    db = SessionLocal()
+    try:
+        return (db.query(func.count(Transaction.id)).scalar() or 0) >= users * per_user
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--per-user", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+    print(f"Inserted {seed(args.users, args.per_user, args.days)} transactions")
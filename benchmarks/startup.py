@@ -0,0 +1,85 @@
+"""
+Measure worker cold-start time, which bounds how fast autoscaling can add capacity.
+
+Each run starts a fresh interpreter that imports app.main, runs the app's
+startup (lifespan) and serves a first request, and reports:
+
+- import_ms:         importing app.main, including create_app()
+- startup_ms:        the lifespan startup
+- first_request_ms:  the first GET /
+- process_ms:        from spawning the process to the first response
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+
+Results can be compared across commits with benchmarks.compare.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import percentile, write_results
+
+FIELDS = ("import_ms", "startup_ms", "first_request_ms", "process_ms")
+
+
+def probe():
+    # Runs in the child process
+    start = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+
+    from fastapi.testclient import TestClient
+
+    with TestClient(app) as client:
+        started = time.perf_counter()
+        client.get("/")
+        served = time.perf_counter()
+        print(json.dumps({
+            "import_ms": (imported - start) * 1000,
+            "startup_ms": (started - imported) * 1000,
+            "first_request_ms": (served - started) * 1000,
+        }))
+
+
+def run_once() -> dict:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--probe"],
+        check=True, capture_output=True, text=True, env=os.environ.copy(),
+    ).stdout
+    elapsed = time.perf_counter() - start
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = elapsed * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        probe()
+        return
+
+    os.environ.setdefault("DATABASE_URL", "sqlite:///./benchmark.db")
+    # The first run also warms the OS file cache; it isn't counted
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+
+    results = {}
+    for field in FIELDS:
+        values = sorted(run[field] for run in runs)
+        results[field] = {"p50_ms": round(percentile(values, 0.50), 1), "p90_ms": round(percentile(values, 0.90), 1)}
+        print(f"{field:>17}: p50={results[field]['p50_ms']}ms p90={results[field]['p90_ms']}ms")
+
+    if args.output:
+        write_results(args.output, "startup", {"runs": args.runs, "database_url": os.environ["DATABASE_URL"]}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+import pytest
+
+# Settings are read on import, so these are set before the app is imported.
+# Each session gets a fresh database (unless DATABASE_URL is set), so tests
+# that use fixed user IDs don't see rows from earlier runs, and every test
+# encrypts and decrypts with the same key.
+_database_dir = tempfile.TemporaryDirectory(prefix="transactions-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_database_dir.name}/test.db")
+os.environ.setdefault("ENCRYPTION_KEYS", "lnoi8CuzpT9eifYg_Rwfke5JFTioY9d15bWEPKllhg0=")
+
+from app.database import engine
+from app.migrate import create_schema
+
+
+# The app no longer creates tables on startup, like a deploy runs `python -m app.migrate` first
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    create_schema(engine)
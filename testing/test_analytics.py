@@ -0,0 +1,287 @@
+import random
+from datetime import datetime
+
+from fastapi import BackgroundTasks
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import SessionLocal
+from app.crud.transaction_crud import create_transaction, update_transaction, delete_transaction
+from app.crud.analytics_crud import get_user_analytics_summary, rebuild_user_analytics
+from app.schemas.transaction_schemas import TransactionCreate
+
+client = TestClient(app)
+
+
+def _new_user_id():
+    return random.randint(10_000_000, 99_999_999)
+
+
+# Running aggregates follow creates, updates and deletes.
+def test_user_analytics_aggregates_follow_mutations():
+    user_id = _new_user_id()
+    db = SessionLocal()
+    try:
+        rows = [
+            (datetime(2024, 1, 1, 9), 100.0),
+            (datetime(2024, 1, 2, 9), 200.0),
+            (datetime(2024, 1, 2, 18), 300.0),
+        ]
+        transaction_ids = [
+            create_transaction(db, {
+                "user_id": user_id,
+                "full_name": "encrypted",
+                "transaction_date": transaction_date,
+                "transaction_amount": amount,
+                "transaction_type": "credit",
+            }, BackgroundTasks())["id"]
+            for transaction_date, amount in rows
+        ]
+
+        analytics = get_user_analytics_summary(db, user_id)
+        assert analytics["total_transaction_count"] == 3
+        assert analytics["average_transaction_value"] == 200.0
+        assert analytics["day_with_most_transactions"] == "2024-01-02"
+
+        # Moving a transaction off the top day hands the title to the other day
+        update_transaction(db, transaction_ids[2], TransactionCreate(
+            user_id=user_id,
+            full_name="encrypted",
+            transaction_date=datetime(2024, 1, 1, 18),
+            transaction_amount=600.0,
+            transaction_type="debit",
+        ))
+        analytics = get_user_analytics_summary(db, user_id)
+        assert analytics["average_transaction_value"] == 300.0
+        assert analytics["day_with_most_transactions"] == "2024-01-01"
+
+        for transaction_id in transaction_ids:
+            delete_transaction(db, transaction_id)
+        assert get_user_analytics_summary(db, user_id) is None
+    finally:
+        db.close()
+
+
+# Rebuilding from the transactions table matches the incremental aggregates.
+def test_rebuild_user_analytics_matches_incremental():
+    user_id = _new_user_id()
+    db = SessionLocal()
+    try:
+        for day, amount in [(3, 10.0), (3, 20.0), (4, 30.0)]:
+            create_transaction(db, {
+                "user_id": user_id,
+                "full_name": "encrypted",
+                "transaction_date": datetime(2024, 2, day, 12),
+                "transaction_amount": amount,
+                "transaction_type": "debit",
+            }, BackgroundTasks())
+        incremental = get_user_analytics_summary(db, user_id)
+
+        rebuild_user_analytics(db, user_ids=[user_id])
+        db.commit()
+        assert get_user_analytics_summary(db, user_id) == incremental
+    finally:
+        db.close()
+
+
+# On a tie the earliest day is the top day, incrementally as after a rebuild.
+def test_top_day_ties_go_to_the_earliest_day():
+    user_id = _new_user_id()
+    db = SessionLocal()
+    try:
+        for day in (5, 4):
+            create_transaction(db, {
+                "user_id": user_id,
+                "full_name": "encrypted",
+                "transaction_date": datetime(2024, 2, day, 12),
+                "transaction_amount": 10.0,
+                "transaction_type": "debit",
+            }, BackgroundTasks())
+        assert get_user_analytics_summary(db, user_id)["day_with_most_transactions"] == "2024-02-04"
+
+        rebuild_user_analytics(db, user_ids=[user_id])
+        db.commit()
+        assert get_user_analytics_summary(db, user_id)["day_with_most_transactions"] == "2024-02-04"
+    finally:
+        db.close()
+
+
+# Successfully retrieve analytics for a user with multiple transactions.
+def test_get_user_analytics_endpoint():
+    user_id = _new_user_id()
+    for amount in (100, 300):
+        response = client.post("/transactions/", json={
+            "user_id": user_id,
+            "transaction_type": "credit",
+            "transaction_amount": amount,
+            "full_name": "John Doe",
+        })
+        assert response.status_code == 200
+
+    response = client.get(f"/transactions/analytics/{user_id}")
+    assert response.status_code == 200
+    assert response.json()["average_transaction_value"] == 200
+    assert response.json()["total_transaction_count"] == 2
+
+
+# Attempt to retrieve analytics for a non-existent user.
+def test_get_user_analytics_unknown_user():
+    response = client.get(f"/transactions/analytics/{_new_user_id()}")
+    assert response.status_code == 404
+
+
+# Retrieve per-bucket analytics for a date range.
+def test_get_user_analytics_buckets():
+    user_id = _new_user_id()
+    rows = [
+        ("2024-01-01T10:00:00", 100, "credit"),
+        ("2024-01-03T10:00:00", 50, "debit"),
+        ("2024-01-09T10:00:00", 25, "credit"),
+        ("2024-02-01T10:00:00", 10, "credit"),
+    ]
+    for transaction_date, amount, transaction_type in rows:
+        client.post("/transactions/", json={
+            "user_id": user_id,
+            "transaction_type": transaction_type,
+            "transaction_amount": amount,
+            "full_name": "John Doe",
+            "transaction_date": transaction_date,
+        })
+
+    response = client.get(f"/transactions/analytics/{user_id}?bucket=week&from=2024-01-01T00:00:00&to=2024-02-01T00:00:00")
+    assert response.status_code == 200
+    buckets = response.json()["buckets"]
+    assert [bucket["start"] for bucket in buckets] == ["2024-01-01", "2024-01-08"]
+    assert buckets[0]["credit_amount"] == 100
+    assert buckets[0]["debit_amount"] == 50
+    assert buckets[0]["debit_count"] == 1
+    assert buckets[1]["transaction_count"] == 1
+
+    response = client.get(f"/transactions/analytics/{user_id}?bucket=month")
+    assert [bucket["total_amount"] for bucket in response.json()["buckets"]] == [175, 10]
+
+    response = client.get(f"/transactions/analytics/{user_id}?from=2024-02-01T00:00:00&to=2024-01-01T00:00:00")
+    assert response.status_code == 400
+
+
+# Concurrent cache misses for the same user share a single recompute.
+def test_cache_fill_is_single_flight():
+    import threading
+    import time
+    from app.cache import ANALYTICS, get_or_fill_user_cached
+
+    user_id = _new_user_id()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"total_transaction_count": 1}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(get_or_fill_user_cached(user_id, ANALYTICS, compute)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"total_transaction_count": 1}] * 8
+
+
+# Hot values are served from the in-process tier until the user's next write.
+def test_local_cache_tier_is_invalidated_by_writes():
+    from app.cache import ANALYTICS, get_or_fill_user_cached, invalidate_user, local_cache
+
+    user_id = _new_user_id()
+    local_cache.set((ANALYTICS, user_id), {"total_transaction_count": 1})
+    assert get_or_fill_user_cached(user_id, ANALYTICS, lambda: {"total_transaction_count": 2}) == {"total_transaction_count": 1}
+
+    invalidate_user(user_id)
+    assert get_or_fill_user_cached(user_id, ANALYTICS, lambda: {"total_transaction_count": 2}) == {"total_transaction_count": 2}
+
+
+# Invalidations that can't reach Redis are queued and sent with the next one,
+# even while reads are bypassing Redis.
+def test_failed_invalidations_are_retried(monkeypatch):
+    import redis
+    from app import cache
+
+    first, second = _new_user_id(), _new_user_id()
+    monkeypatch.setattr(cache, "_redis_down_until", float("inf"))
+    attempts = []
+
+    def pipeline(**kwargs):
+        attempts.append(1)
+        raise redis.ConnectionError("down")
+
+    monkeypatch.setattr(cache.redis_client.client, "pipeline", pipeline)
+    cache.invalidate_user(first)
+    cache.invalidate_user(second)
+    assert len(attempts) == 2
+    assert {first, second} <= cache._pending_users
+
+
+# Global reports are computed from the columnar snapshot, which picks up new rows incrementally.
+def test_global_analytics_reports(monkeypatch):
+    from dataclasses import replace
+    from app import global_analytics
+
+    config = replace(global_analytics.current_settings(), global_analytics_refresh_seconds=0)
+    monkeypatch.setattr(global_analytics, "current_settings", lambda: config)
+    big_spender, small_spender = _new_user_id(), _new_user_id()
+    for user_id, transaction_type, amount, day in (
+        (big_spender, "debit", 500, "2001-02-03T10:00:00"),
+        (big_spender, "credit", 1000, "2001-02-03T11:00:00"),
+        (small_spender, "debit", 50, "2001-02-04T10:00:00"),
+    ):
+        client.post("/transactions/", json={
+            "user_id": user_id, "transaction_type": transaction_type, "transaction_amount": amount,
+            "full_name": "John Doe", "transaction_date": day,
+        })
+
+    window = "from=2001-02-01T00:00:00&to=2001-03-01T00:00:00"
+    days = client.get(f"/analytics/global/daily-volume?{window}").json()["days"]
+    assert days == [
+        {"date": "2001-02-03", "transaction_count": 2, "credit_amount": 1000.0, "debit_amount": 500.0},
+        {"date": "2001-02-04", "transaction_count": 1, "credit_amount": 0.0, "debit_amount": 50.0},
+    ]
+
+    client.post("/transactions/", json={
+        "user_id": small_spender, "transaction_type": "debit", "transaction_amount": 1000,
+        "full_name": "John Doe", "transaction_date": "2001-02-05T10:00:00",
+    })
+    ratio = client.get(f"/analytics/global/credit-debit-ratio?{window}").json()
+    assert (ratio["credit_amount"], ratio["debit_amount"], ratio["debit_count"]) == (1000.0, 1550.0, 3)
+
+    users = client.get(f"/analytics/global/top-users?limit=1&{window}").json()["users"]
+    assert users == [{"user_id": small_spender, "debit_amount": 1050.0, "transaction_count": 2}]
+
+
+# Warm-up computes the same entries the read paths would cache, for the cold users only.
+def test_warm_users_fills_cold_entries(monkeypatch):
+    from app import warmup
+    from app.crud.transaction_crud import DEFAULT_PAGE_LIMIT
+    from app.schemas.transaction_schemas import decrypt_payload
+
+    user_id = _new_user_id()
+    client.post("/transactions/", json={"user_id": user_id, "transaction_type": "credit", "transaction_amount": 40, "full_name": "John Doe"})
+
+    written = {}
+    monkeypatch.setattr(warmup, "find_cold_entries", lambda kind, user_ids: {uid: 3 for uid in user_ids})
+    monkeypatch.setattr(warmup, "set_user_cached_many", lambda kind, entries: written.update({kind: entries}))
+    assert warmup.warm_users([user_id]) == 2
+
+    version, summary = written[warmup.ANALYTICS][user_id]
+    assert (version, summary["total_transaction_count"]) == (3, 1)
+    version, page = written[warmup.TRANSACTIONS][user_id]
+    assert page["limit"] == DEFAULT_PAGE_LIMIT
+    assert decrypt_payload(page["body"]) == client.get(f"/transactions/?user_id={user_id}").content
+
+    db = SessionLocal()
+    try:
+        assert user_id in warmup.most_active_users(db, 10_000)
+    finally:
+        db.close()
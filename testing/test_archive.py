@@ -0,0 +1,90 @@
+import json
+from dataclasses import replace
+from datetime import date, datetime
+
+from fastapi import BackgroundTasks
+from fastapi.testclient import TestClient
+from app.main import app
+from app import archive
+from app.database import SessionLocal, engine
+from app.crud.analytics_crud import get_user_analytics_buckets, get_user_analytics_summary, rebuild_user_analytics
+from app.crud.transaction_crud import create_transaction
+from app.models.models import Transaction
+from app.schemas.transaction_schemas import encrypt_name
+
+client = TestClient(app)
+
+
+# Archived months leave the database but stay visible to the export and the analytics.
+def test_archived_month_is_still_read(tmp_path, monkeypatch):
+    config = replace(archive.current_settings(), archive_dir=str(tmp_path))
+    monkeypatch.setattr(archive, "current_settings", lambda: config)
+    user_id = 818181
+    db = SessionLocal()
+    try:
+        for transaction_date, amount, transaction_type in (
+            (datetime(1999, 1, 5, 10), 100.0, "credit"),
+            (datetime(1999, 1, 20, 10), 40.0, "debit"),
+            (datetime(2024, 3, 1, 10), 10.0, "credit"),
+        ):
+            create_transaction(db, {
+                "user_id": user_id,
+                "full_name": encrypt_name("John Doe"),
+                "transaction_date": transaction_date,
+                "transaction_amount": amount,
+                "transaction_type": transaction_type,
+            }, BackgroundTasks())
+
+        assert archive.archive_month(engine, date(1999, 1, 1)) == 2
+        assert db.query(Transaction).filter(Transaction.user_id == user_id).count() == 1
+        assert json.loads((tmp_path / "manifest.json").read_text())["files"][0]["rows"] == 2
+
+        buckets = get_user_analytics_buckets(db, user_id, "month", datetime(1999, 1, 1), datetime(2025, 1, 1))
+        assert [(entry["start"], entry["transaction_count"]) for entry in buckets] == [("1999-01-01", 2), ("2024-03-01", 1)]
+        assert buckets[0]["credit_amount"] == 100.0 and buckets[0]["debit_amount"] == 40.0
+
+        rebuild_user_analytics(db, [user_id])
+        db.commit()
+        assert get_user_analytics_summary(db, user_id)["total_transaction_count"] == 3
+    finally:
+        db.close()
+
+    response = client.get(f"/transactions/export?user_id={user_id}")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["transaction_amount"] for row in rows] == [100.0, 40.0, 10.0]
+    assert rows[0]["full_name"] == "John Doe"
+
+
+# A failed commit leaves the rows in the database and no archive file or manifest entry.
+def test_failed_archive_commit_removes_the_file(tmp_path, monkeypatch):
+    import pytest
+    from sqlalchemy import event
+
+    config = replace(archive.current_settings(), archive_dir=str(tmp_path))
+    monkeypatch.setattr(archive, "current_settings", lambda: config)
+    user_id = 828383
+    db = SessionLocal()
+    try:
+        create_transaction(db, {
+            "user_id": user_id,
+            "full_name": encrypt_name("John Doe"),
+            "transaction_date": datetime(1998, 6, 5, 10),
+            "transaction_amount": 25.0,
+            "transaction_type": "credit",
+        }, BackgroundTasks())
+
+        def fail_commit(connection):
+            raise RuntimeError("commit failed")
+
+        event.listen(engine, "commit", fail_commit)
+        try:
+            with pytest.raises(RuntimeError):
+                archive.archive_month(engine, date(1998, 6, 1))
+        finally:
+            event.remove(engine, "commit", fail_commit)
+
+        assert db.query(Transaction).filter(Transaction.user_id == user_id).count() == 1
+        assert archive.load_manifest(str(tmp_path))["files"] == []
+        assert [path.name for path in tmp_path.iterdir() if path.name != archive.MANIFEST] == []
+    finally:
+        db.close()
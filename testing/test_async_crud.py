@@ -0,0 +1,35 @@
+import asyncio
+import random
+from datetime import datetime
+
+from fastapi import BackgroundTasks
+from app.main import app
+from app.database import get_async_db, get_async_engine
+from app.crud import async_transaction_crud
+
+
+# The async CRUD path keeps the running analytics in step, like the sync one.
+def test_async_crud_create_and_delete():
+    user_id = random.randint(10_000_000, 99_999_999)
+
+    async def scenario():
+        async for db in get_async_db():
+            created = await async_transaction_crud.create_transaction(db, {
+                "user_id": user_id,
+                "full_name": "encrypted",
+                "transaction_date": datetime(2024, 3, 1, 12),
+                "transaction_amount": 40.0,
+                "transaction_type": "credit",
+            }, BackgroundTasks())
+            assert (await async_transaction_crud.get_transaction(db, created.id)).user_id == user_id
+            assert len(await async_transaction_crud.get_transactions(db, user_id=user_id)) == 1
+
+            analytics = await async_transaction_crud.get_user_analytics(db, user_id)
+            assert analytics["total_transaction_count"] == 1
+            assert analytics["day_with_most_transactions"] == "2024-03-01"
+
+            await async_transaction_crud.delete_transaction(db, created.id)
+            assert await async_transaction_crud.get_user_analytics(db, user_id) is None
+        await get_async_engine().dispose()
+
+    asyncio.run(scenario())
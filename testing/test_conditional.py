@@ -0,0 +1,64 @@
+from fastapi.testclient import TestClient
+from app.main import app
+from app import conditional
+from app.conditional import ConditionalRead, etag_matches
+
+client = TestClient(app)
+
+# 2024-01-01T00:00:00Z in microseconds, as a write would set it
+VERSION = 1_704_067_200_000_000
+
+
+def _use_version(monkeypatch, version):
+    async def acurrent_version(scope, owner_id):
+        return version, False
+
+    monkeypatch.setattr(conditional, "current_version", lambda scope, owner_id: (version, False))
+    monkeypatch.setattr(conditional, "acurrent_version", acurrent_version)
+
+
+# A response carries validators from the user's version, and revalidating with them gets a 304.
+def test_conditional_analytics_request(monkeypatch):
+    user_id = 585858
+    client.post("/transactions/", json={"user_id": user_id, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"})
+    _use_version(monkeypatch, VERSION)
+
+    response = client.get(f"/transactions/analytics/{user_id}?bucket=day")
+    assert response.status_code == 200
+    tag = response.headers["ETag"]
+    assert tag == f'W/"user-{user_id}-{VERSION}"'
+    assert response.headers["Last-Modified"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+
+    assert client.get(f"/transactions/analytics/{user_id}?bucket=day", headers={"If-None-Match": tag}).status_code == 304
+    assert client.get(f"/transactions/analytics/{user_id}?bucket=day", headers={"If-Modified-Since": "Tue, 02 Jan 2024 00:00:00 GMT"}).status_code == 304
+
+    # A write moves the version on
+    _use_version(monkeypatch, VERSION + 1)
+    response = client.get(f"/transactions/analytics/{user_id}?bucket=day", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != tag
+
+
+def test_etag_matches():
+    assert etag_matches('"a", W/"user-1-5"', 'W/"user-1-5"')
+    assert etag_matches("*", 'W/"user-1-5"')
+    assert not etag_matches('W/"user-1-4"', 'W/"user-1-5"')
+
+
+# Values that aren't known to belong to the current version don't get validators.
+def test_stale_values_are_not_labelled(monkeypatch):
+    _use_version(monkeypatch, VERSION)
+    read = ConditionalRead(None, "user", 1)
+    read.current()
+    assert read._label_version(VERSION) == VERSION
+    assert read._label_version(VERSION - 1) is None
+    assert read._label_version(None) is None
+
+
+# `If-None-Match: *` is answered by the lookup, so a missing transaction is still a 404.
+def test_if_none_match_any(monkeypatch):
+    _use_version(monkeypatch, VERSION)
+    assert client.get("/transactions/989898989", headers={"If-None-Match": "*"}).status_code == 404
+
+    transaction_id = client.post("/transactions/", json={"user_id": 595959, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"}).json()["id"]
+    assert client.get(f"/transactions/{transaction_id}", headers={"If-None-Match": "*"}).status_code == 200
@@ -0,0 +1,96 @@
+from cryptography.fernet import Fernet, MultiFernet
+
+from app.main import app
+from app import reencrypt
+from app.database import SessionLocal
+from app.models.models import Transaction
+from app.schemas import transaction_schemas
+
+
+# Keys come from ENCRYPTION_KEYS, current key first.
+def test_load_encryption_keys_from_env(monkeypatch):
+    current, retired = Fernet.generate_key(), Fernet.generate_key()
+    monkeypatch.setenv("ENCRYPTION_KEYS", f"{current.decode()}, {retired.decode()}")
+    assert transaction_schemas.load_encryption_keys() == [current, retired]
+
+
+# Rows written with a retired key are rewritten with the current one.
+def test_reencrypt_batch_rotates_retired_key(monkeypatch):
+    retired = Fernet.generate_key()
+    keyring = MultiFernet([Fernet(transaction_schemas.key), Fernet(retired)])
+    monkeypatch.setattr(transaction_schemas, "_cipher", keyring)
+
+    db = SessionLocal()
+    try:
+        transaction = Transaction(
+            user_id=515151,
+            full_name=Fernet(retired).encrypt(b"John Doe").decode(),
+            transaction_amount=10,
+            transaction_type="credit",
+        )
+        db.add(transaction)
+        db.commit()
+
+        assert reencrypt.reencrypt_batch(db, transaction.id - 1, batch_size=1) == (transaction.id, 1, 0)
+
+        db.refresh(transaction)
+        assert transaction_schemas.decrypt_name(transaction.full_name) == "John Doe"
+
+        # Already on the current key, so nothing left to do
+        assert reencrypt.reencrypt_batch(db, transaction.id - 1, batch_size=1) == (transaction.id, 0, 0)
+    finally:
+        db.close()
+
+
+# A row no key can decrypt is skipped, and the rest of the batch is still rewritten.
+def test_reencrypt_batch_skips_undecryptable_rows(monkeypatch):
+    retired, lost = Fernet.generate_key(), Fernet.generate_key()
+    keyring = MultiFernet([Fernet(transaction_schemas.key), Fernet(retired)])
+    monkeypatch.setattr(transaction_schemas, "_cipher", keyring)
+    invalidated = []
+    monkeypatch.setattr(reencrypt, "invalidate_users", lambda user_ids, transaction_ids: invalidated.append((set(user_ids), list(transaction_ids))))
+
+    db = SessionLocal()
+    try:
+        broken, rotated = (
+            Transaction(user_id=525252, full_name=Fernet(encryption_key).encrypt(b"John Doe").decode(), transaction_amount=10, transaction_type="credit")
+            for encryption_key in (lost, retired)
+        )
+        db.add_all([broken, rotated])
+        db.commit()
+
+        assert reencrypt.reencrypt_batch(db, broken.id - 1, batch_size=2) == (rotated.id, 1, 1)
+        assert invalidated == [({525252}, [rotated.id])]
+    finally:
+        db.close()
+
+
+# A row updated after the batch read it keeps the update instead of the re-encrypted old name.
+def test_reencrypt_batch_keeps_concurrent_updates(monkeypatch):
+    retired = Fernet.generate_key()
+    keyring = MultiFernet([Fernet(transaction_schemas.key), Fernet(retired)])
+    db = SessionLocal()
+    try:
+        transaction = Transaction(user_id=535353, full_name=Fernet(retired).encrypt(b"John Doe").decode(), transaction_amount=10, transaction_type="credit")
+        db.add(transaction)
+        db.commit()
+        updated_name = transaction_schemas.encrypt_name("Jane Doe")
+
+        class ConcurrentUpdate:
+            # Another request renames the transaction while the batch re-encrypts it
+            def rotate(self, token):
+                other = SessionLocal()
+                try:
+                    other.get(Transaction, transaction.id).full_name = updated_name
+                    other.commit()
+                finally:
+                    other.close()
+                return keyring.rotate(token)
+
+        monkeypatch.setattr(transaction_schemas, "_cipher", ConcurrentUpdate())
+        assert reencrypt.reencrypt_batch(db, transaction.id - 1, batch_size=1) == (transaction.id, 0, 0)
+
+        db.refresh(transaction)
+        assert transaction.full_name == updated_name
+    finally:
+        db.close()
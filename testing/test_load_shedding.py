@@ -0,0 +1,50 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from dataclasses import replace
+
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from app.main import configure, create_app
+from app import ratelimit
+from app.database import pool_metrics
+from app.settings import settings
+
+
+# The rate limiting middleware is only added to apps whose settings enable a limit
+@contextmanager
+def limited_client(**limits):
+    try:
+        with TestClient(create_app(replace(settings, **limits))) as client:
+            yield client
+    finally:
+        asyncio.run(configure(settings))
+
+
+# A slow connection checkout makes the worker reject requests early, for a short while.
+def test_slow_pool_wait_sheds_load(monkeypatch):
+    metrics = pool_metrics["primary"]
+    monkeypatch.setattr(metrics, "last_wait_seconds", 1.0)
+    monkeypatch.setattr(metrics, "last_wait_at", time.monotonic())
+
+    with limited_client(load_shed_pool_wait=0.5, load_shed_retry_after=2) as client:
+        response = client.get("/transactions/?user_id=1")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+        assert client.get("/metrics").status_code == 200
+
+        metrics.last_wait_at = time.monotonic() - ratelimit.POOL_WAIT_WINDOW
+        assert client.get("/transactions/?user_id=1").status_code == 200
+
+
+def test_in_flight_limit_sheds_load():
+    with limited_client(max_in_flight_requests=0) as client:
+        assert client.get("/transactions/analytics/1").status_code == 503
+
+
+# Requests naming a user draw from both the client's and the user's token bucket.
+def test_request_buckets(monkeypatch):
+    config = replace(ratelimit.current_settings(), rate_limit_client_rate=10.0, rate_limit_user_rate=2.0)
+    monkeypatch.setattr(ratelimit, "current_settings", lambda: config)
+    request = Request({"type": "http", "path": "/transactions/analytics/42", "query_string": b"", "headers": [], "client": ("10.0.0.1", 1234)})
+    assert [key for key, _, _ in ratelimit.request_buckets(request)] == ["rate_limit:client:10.0.0.1", "rate_limit:user:42"]
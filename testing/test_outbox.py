@@ -0,0 +1,35 @@
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from app.main import app
+from app.database import SessionLocal
+from app.models.models import OutboxEvent
+from app.routers.stream_routes import format_event, stream_id
+
+client = TestClient(app)
+
+
+# Creates, updates and deletes each leave an outbox event, committed with the change.
+def test_changes_are_written_to_the_outbox():
+    user_id = 929292
+    transaction = {"user_id": user_id, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"}
+    transaction_id = client.post("/transactions/", json=transaction).json()["id"]
+    client.delete(f"/transactions/{transaction_id}")
+
+    db = SessionLocal()
+    try:
+        events = db.scalars(select(OutboxEvent).where(OutboxEvent.user_id == user_id).order_by(OutboxEvent.id)).all()
+    finally:
+        db.close()
+    assert [(event.event_type, event.transaction_id) for event in events] == [("created", transaction_id), ("deleted", transaction_id)]
+    assert json.loads(events[0].payload)["transaction_amount"] == 10
+
+
+def test_format_event():
+    fields = {"outbox_id": "7", "event": "created", "transaction_id": "3", "user_id": "5", "payload": '{"id": 3}'}
+    event = format_event("1700000000000-1", fields)
+    assert event.startswith("id: 1700000000000-1\nevent: created\ndata: ")
+    assert event.endswith("\n\n")
+    assert json.loads(event.split("data: ", 1)[1]) == {"outbox_id": 7, "transaction_id": 3, "user_id": 5, "transaction": {"id": 3}}
+    assert stream_id("1700000000000-2") > stream_id("1700000000000-1")
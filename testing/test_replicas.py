@@ -0,0 +1,48 @@
+from starlette.requests import Request
+
+from app import cache, database
+from app.database import ReplicaSet, build_engine, get_read_db
+
+
+def _read_bind(query_string: bytes = b"", path_params: dict = None):
+    request = Request({"type": "http", "query_string": query_string, "path_params": path_params or {}, "headers": []})
+    sessions = get_read_db(request)
+    db = next(sessions)
+    try:
+        return db.get_bind()
+    finally:
+        sessions.close()
+
+
+# Reads are spread over the healthy replicas and skip the ones that fail their health check.
+def test_replica_round_robin_skips_unhealthy(tmp_path):
+    first = build_engine(f"sqlite:///{tmp_path / 'replica_a.db'}", name="test_replica_a")
+    second = build_engine(f"sqlite:///{tmp_path / 'replica_b.db'}", name="test_replica_b")
+    broken = build_engine(f"sqlite:///{tmp_path / 'missing' / 'replica_c.db'}", name="test_replica_c")
+
+    replica_set = ReplicaSet([first, second, broken], check_interval=60)
+    replica_set.check()
+
+    assert replica_set.healthy == [True, True, False]
+    assert {replica_set.choose() for _ in range(4)} == {0, 1}
+
+    replica_set.healthy = [False, False, False]
+    assert replica_set.choose() is None
+
+
+# Users and transactions written in the read-your-writes window are read from the primary.
+def test_get_read_db_routes_recent_writes_to_primary(tmp_path, monkeypatch):
+    replica = build_engine(f"sqlite:///{tmp_path / 'replica.db'}", name="test_replica")
+    monkeypatch.setattr(database, "_replicas", ReplicaSet([replica], check_interval=60))
+    monkeypatch.setattr(cache, "TRACK_RECENT_WRITES", True)
+    monkeypatch.setattr(cache, "_recent_writes", cache.LRUCache(100, 60))
+
+    assert _read_bind(b"user_id=515151") is replica
+
+    cache.invalidate_user(515151, [616161])
+    assert _read_bind(b"user_id=515151") is database.engine
+    assert _read_bind(path_params={"transaction_id": "616161"}) is database.engine
+    assert _read_bind(b"user_id=717171") is replica
+
+    database.replicas.healthy = [False]
+    assert _read_bind(b"user_id=717171") is database.engine
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from app.schemas.transaction_schemas import decrypt_name, key
+from app.seeders import DatasetSpec, _init_worker, full_name, generate_rows, iter_chunks, user_counts
+
+
+# Zipf counts add up to the requested total and favour the lowest user IDs.
+def test_user_counts():
+    counts = user_counts(100, 10_001, "zipf")
+    assert counts.sum() == 10_001
+    assert counts[0] > counts[1] > counts[10] > counts[99] > 0
+    assert user_counts(3, 10, "uniform").tolist() == [4, 3, 3]
+
+
+# Heavy users are split over several chunks, and no chunk exceeds the chunk size.
+def test_iter_chunks_split_users():
+    chunks = list(iter_chunks(user_counts(3, 25, "uniform"), chunk_size=10))
+    assert [sum(count for _, count in chunk) for chunk in chunks] == [10, 10, 5]
+    assert chunks[0] == [(1, 9), (2, 1)]
+
+
+def test_generate_rows():
+    _init_worker(key)
+    spec = DatasetSpec(datetime(2024, 1, 1), datetime(2024, 2, 1), credit_ratio=1.0)
+    rows = generate_rows((0, [(1, 2), (5, 3)], spec))
+    assert [row[0] for row in rows] == [1, 1, 5, 5, 5]
+    assert decrypt_name(rows[2][1]) == full_name(5)
+    assert rows[2][1] != rows[3][1]
+    assert all(spec.start <= row[2] <= spec.end and row[3] > 0 and row[4] == "credit" for row in rows)
+    # The same chunk is generated the same way in any worker
+    assert [row[2:] for row in generate_rows((0, [(1, 2), (5, 3)], spec))] == [row[2:] for row in rows]
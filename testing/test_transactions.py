@@ -1,3 +1,4 @@
+import json
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from app.main import app
@@ -75,6 +76,24 @@ def test_create_transaction_negative_transaction_amount():
     assert response.status_code == 422
 
 
+# Retrying a create with the same Idempotency-Key returns the first transaction instead of creating another.
+def test_create_transaction_idempotency_key():
+    user_id = 464646
+    transaction = {"user_id": user_id, "transaction_type": "credit", "transaction_amount": 75, "full_name": "John Doe"}
+    headers = {"Idempotency-Key": "test-create-464646"}
+
+    first = client.post("/transactions/", json=transaction, headers=headers)
+    retry = client.post("/transactions/", json=transaction, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(client.get(f"/transactions/?user_id={user_id}").json()) == 1
+
+    # The same key with a different body is rejected
+    response = client.post("/transactions/", json={**transaction, "transaction_amount": 80}, headers=headers)
+    assert response.status_code == 422
+
+
 # Retrieve transaction history for a user with no transactions.
 def test_retrieve_transaction_history_with_transactions():
     # Create sample transactions
@@ -102,6 +121,7 @@ def test_retrieve_transaction_history_with_transactions():
     assert response.status_code == 200
     retrieved_transactions = response.json()
     assert len(retrieved_transactions) > 1
+    assert retrieved_transactions[0]["full_name"] == "John Doe"
 # Edge Cases:
 
 # Retrieve transaction history with a large number of transactions to test performance.
@@ -136,6 +156,20 @@ def test_update_transaction_valid_data():
     assert response.json()["transaction_amount"] == 500
     assert response.json()["full_name"] == "Jane Doe"
 
+# The updated name is stored encrypted, like a created one.
+def test_update_transaction_encrypts_full_name():
+    from app.database import SessionLocal
+    from app.models.models import Transaction
+
+    transaction = {"user_id": 838383, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"}
+    transaction_id = client.post("/transactions/", json=transaction).json()["id"]
+
+    response = client.put(f"/transactions/{transaction_id}", json={**transaction, "full_name": "Jane Doe"})
+    assert response.status_code == 200
+    assert response.json()["full_name"] == "Jane Doe"
+    with SessionLocal() as db:
+        assert decrypt_name(db.get(Transaction, transaction_id).full_name) == "Jane Doe"
+
 # Update only specific fields of a transaction.
 
 
@@ -175,4 +209,283 @@ def test_update_transaction_valid_data():
 
 # Retrieve analytics for a user with no transactions.
 
-# Test performance with a large dataset.
\ No newline at end of file
+# Test performance with a large dataset.
+
+# Bulk create transactions from a JSON array, with per-row results.
+def test_bulk_create_transactions_json_array():
+    response = client.post(
+        "/transactions/bulk?batch_size=2",
+        json=[
+            {"user_id": 7, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"},
+            {"user_id": 7, "transaction_type": "invalid", "transaction_amount": 10, "full_name": "John Doe"},
+            {"user_id": 8, "transaction_type": "debit", "transaction_amount": 20, "full_name": "Jane Doe"},
+            {"user_id": 8, "transaction_type": "debit", "transaction_amount": 30, "full_name": "Jane Doe"},
+        ]
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 3
+    assert body["failed"] == 1
+    assert [result["status"] for result in body["results"]] == ["created", "invalid", "created", "created"]
+
+    created_id = body["results"][0]["id"]
+    response = client.get(f"/transactions/{created_id}")
+    assert response.json()["full_name"] == "John Doe"
+
+
+# A batch that fails to save is reported without the database error.
+def test_bulk_create_transactions_hides_errors():
+    with patch("app.routers.transaction_routes.bulk_create_transactions", side_effect=RuntimeError("INSERT INTO transactions ...")):
+        response = client.post("/transactions/bulk", json=[
+            {"user_id": 7, "transaction_type": "credit", "transaction_amount": 10, "full_name": "John Doe"},
+        ])
+    assert response.json()["results"] == [
+        {"index": 0, "status": "failed", "id": None, "errors": [{"msg": "The batch could not be saved"}]},
+    ]
+
+
+# Bulk create transactions from an NDJSON stream.
+def test_bulk_create_transactions_ndjson():
+    lines = [
+        '{"user_id": 9, "transaction_type": "credit", "transaction_amount": 5, "full_name": "John Doe"}',
+        'not json',
+        '{"user_id": 9, "transaction_type": "debit", "transaction_amount": 15, "full_name": "John Doe"}',
+    ]
+    response = client.post(
+        "/transactions/bulk",
+        content="\n".join(lines),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["created", "invalid", "created"]
+
+
+# Page through a user's transaction history with the continuation token.
+def test_retrieve_transaction_history_paginated():
+    user_id = 424242
+    for day in range(1, 6):
+        response = client.post("/transactions/", json={
+            "user_id": user_id,
+            "transaction_type": "credit",
+            "transaction_amount": day,
+            "full_name": "John Doe",
+            "transaction_date": f"2024-05-0{day}T12:00:00"
+        })
+        assert response.status_code == 200
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"user_id": user_id, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/transactions/", params=params)
+        assert response.status_code == 200
+        seen.extend(transaction["transaction_amount"] for transaction in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == [5, 4, 3, 2, 1]
+
+
+# The list endpoint's direct row encoding matches the single-transaction response.
+def test_list_encoding_matches_transaction_response():
+    response = client.post("/transactions/", json={
+        "user_id": 454545,
+        "transaction_type": "credit",
+        "transaction_amount": 12.5,
+        "full_name": "John Doe",
+        "transaction_date": "2024-05-01T12:00:00"
+    })
+    transaction_id = response.json()["id"]
+
+    listed = client.get("/transactions/?user_id=454545").json()
+    assert listed == [client.get(f"/transactions/{transaction_id}").json()]
+    assert listed[0]["full_name"] == "John Doe"
+
+
+# Reject a malformed continuation token.
+def test_retrieve_transaction_history_invalid_cursor():
+    response = client.get("/transactions/?user_id=1&cursor=not-a-cursor")
+    assert response.status_code == 400
+
+
+# Export a user's transaction history as NDJSON and CSV.
+def test_export_transactions():
+    user_id = 434343
+    for amount in (10, 20):
+        client.post("/transactions/", json={
+            "user_id": user_id,
+            "transaction_type": "debit",
+            "transaction_amount": amount,
+            "full_name": "John Doe"
+        })
+
+    response = client.get(f"/transactions/export?user_id={user_id}")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["transaction_amount"] for row in rows] == [10, 20]
+
+    response = client.get(f"/transactions/export?user_id={user_id}&format=csv")
+    assert response.status_code == 200
+    assert response.text.splitlines()[0].startswith("id,user_id,full_name")
+    assert len(response.text.splitlines()) == 3
+
+
+# Decrypted names are served from the bounded name cache until purged.
+def test_decrypt_names_with_name_cache():
+    from app.schemas.transaction_schemas import decrypt_names, name_cache, purge_name_cache
+
+    encrypted = [encrypt_name("John Doe"), encrypt_name("Jane Doe")]
+    maxsize = name_cache.maxsize
+    name_cache.maxsize = 1
+    try:
+        assert decrypt_names(encrypted + encrypted[:1]) == ["John Doe", "Jane Doe", "John Doe"]
+        assert len(name_cache) == 1
+        purge_name_cache()
+        assert len(name_cache) == 0
+    finally:
+        name_cache.maxsize = maxsize
+        purge_name_cache()
+
+
+# A name no key can decrypt is returned as stored, without failing the rest of the batch.
+def test_decrypt_names_skips_invalid_tokens():
+    from app.schemas.transaction_schemas import decrypt_names
+
+    assert decrypt_names([encrypt_name("John Doe"), "not-a-token"]) == ["John Doe", "not-a-token"]
+
+
+# A cached first page no key can decrypt is a cache miss, read from the database.
+def test_undecryptable_cached_page_is_a_miss(monkeypatch):
+    from app.routers import async_transaction_routes, transaction_routes
+
+    client.post("/transactions/", json={
+        "user_id": 474747,
+        "transaction_type": "credit",
+        "transaction_amount": 7.5,
+        "full_name": "John Doe",
+        "transaction_date": "2024-05-01T12:00:00"
+    })
+    page = {"limit": 100, "next_cursor": None, "body": "not-a-token"}
+
+    async def aget_or_fill_versioned(user_id, kind, load):
+        return page, 1
+
+    monkeypatch.setattr(transaction_routes, "get_or_fill_versioned", lambda user_id, kind, load: (page, 1))
+    monkeypatch.setattr(async_transaction_routes, "aget_or_fill_versioned", aget_or_fill_versioned)
+    response = client.get("/transactions/?user_id=474747")
+    assert response.status_code == 200
+    assert [transaction["transaction_amount"] for transaction in response.json()] == [7.5]
+
+
+# Connection pool metrics are exposed for pool sizing.
+def test_read_pool_metrics():
+    client.get("/transactions/?user_id=1")
+    response = client.get("/metrics/pool")
+    assert response.status_code == 200
+    primary = next(metrics for metrics in response.json() if metrics["engine"] == "primary")
+    assert primary["checkouts"] > 0
+    assert primary["size"] == 5
+
+
+# Request, SQL and cache metrics are exposed in the Prometheus text format.
+def test_read_metrics():
+    client.get("/transactions/?user_id=1")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/transactions/",status="200"}' in response.text
+    assert 'db_statement_duration_seconds_count{engine="primary"}' in response.text
+    assert 'db_pool_checkouts_total{engine="primary"}' in response.text
+
+
+# The Server-Timing header breaks a request down into db, cache and crypto time.
+def test_server_timing_header():
+    from dataclasses import replace
+    from app.main import create_app
+    from app.settings import settings
+
+    response = TestClient(create_app(replace(settings, server_timing=True))).get("/transactions/?user_id=1")
+    assert response.headers["Server-Timing"].startswith("app;dur=")
+    assert "db;dur=" in response.headers["Server-Timing"]
+
+
+# An app created with other settings serves from their database, once its lifespan runs.
+def test_create_app_uses_its_settings(tmp_path):
+    import asyncio
+    from dataclasses import replace
+    from sqlalchemy import create_engine, text
+    from app import database
+    from app.main import configure, create_app
+    from app.migrate import create_schema
+    from app.settings import settings
+
+    url = f"sqlite:///{tmp_path}/other.db"
+    try:
+        with TestClient(create_app(replace(settings, database_url=url))) as other_client:
+            create_schema(database.engine)
+            response = other_client.post("/transactions/", json={
+                "user_id": 828282,
+                "full_name": "John Doe",
+                "transaction_date": "2024-01-01T00:00:00",
+                "transaction_amount": 10.0,
+                "transaction_type": "credit",
+            })
+            assert response.status_code == 200
+    finally:
+        asyncio.run(configure(settings))
+
+    with create_engine(url).connect() as connection:
+        assert connection.execute(text("SELECT user_id FROM transactions")).scalars().all() == [828282]
+    assert database.engine.url.render_as_string() == settings.database_url
+
+
+# The background tasks and request limits follow the settings the app was created with.
+def test_create_app_background_tasks_and_limits_follow_its_settings(monkeypatch):
+    import asyncio
+    import threading
+    from dataclasses import replace
+    from app import warmup
+    from app.main import configure, create_app
+    from app.settings import settings
+
+    warmups = []
+    monkeypatch.setattr(warmup, "_run_scheduled", warmups.append)
+    config = replace(settings, outbox_publish_in_app=True, cache_warmup_on_startup=True, cache_warmup_interval=60.0, max_in_flight_requests=0)
+    try:
+        with TestClient(create_app(config)) as other_client:
+            assert "outbox-publisher" in {thread.name for thread in threading.enumerate()}
+            assert warmups == [60.0]
+            assert other_client.get("/transactions/analytics/1").status_code == 503
+    finally:
+        asyncio.run(configure(settings))
+    assert client.get("/transactions/analytics/1").status_code != 503
+
+
+# The cache, name cache and job stream settings come from the settings the app is configured with.
+def test_configure_applies_cache_and_job_settings():
+    import asyncio
+    from dataclasses import replace
+    from app import cache, jobs
+    from app.main import configure
+    from app.schemas.transaction_schemas import name_cache
+    from app.settings import settings
+
+    try:
+        asyncio.run(configure(replace(settings, cache_ttl=60, local_cache_size=7, name_cache_size=3, job_stream="other_jobs")))
+        assert (cache.CACHE_TTL, cache.local_cache.maxsize, name_cache.maxsize) == (60, 7, 3)
+        assert (jobs.JOB_STREAM, jobs.DEAD_LETTER_STREAM) == ("other_jobs", "other_jobs:dead")
+    finally:
+        asyncio.run(configure(settings))
+    assert (cache.local_cache.maxsize, name_cache.maxsize, jobs.JOB_STREAM) == (settings.local_cache_size, settings.name_cache_size, settings.job_stream)
+
+
+# A transaction without a date is dated when it is created, not when the app was imported.
+def test_transaction_date_defaults_to_now():
+    from datetime import datetime
+    from app.schemas.transaction_schemas import TransactionCreate
+
+    before = datetime.now()
+    transaction = TransactionCreate(user_id=1, full_name="John Doe", transaction_amount=1.0, transaction_type="credit")
+    assert before <= transaction.transaction_date <= datetime.now()
@@ -0,0 +1,38 @@
+from app import worker
+
+
+# Jobs in a batch are coalesced per user before the background work runs.
+def test_process_messages_coalesces_jobs_by_user(monkeypatch):
+    calls = []
+    monkeypatch.setattr(worker, "process_transaction_batch", calls.append)
+
+    messages = [
+        ("1-0", {"transaction_id": "11", "user_id": "1"}),
+        ("2-0", {"transaction_id": "20", "user_id": "2"}),
+        ("3-0", {"transaction_id": "12", "user_id": "1"}),
+        ("4-0", None),
+    ]
+    done = worker.process_messages(messages, max_attempts=3)
+
+    assert sorted(done) == ["1-0", "2-0", "3-0", "4-0"]
+    assert calls == [{1: [11, 12]}, {2: [20]}]
+
+
+# Failed jobs stay pending for a later retry, until they run out of attempts.
+def test_process_messages_leaves_failed_jobs_pending(monkeypatch):
+    def fail(batch):
+        raise RuntimeError("credit score service unavailable")
+
+    dead = []
+    monkeypatch.setattr(worker, "process_transaction_batch", fail)
+    monkeypatch.setattr(worker, "delivery_counts", lambda message_ids: {"1-0": 1, "2-0": 3})
+    monkeypatch.setattr(worker, "dead_letter", dead.extend)
+
+    messages = [
+        ("1-0", {"transaction_id": "11", "user_id": "1"}),
+        ("2-0", {"transaction_id": "12", "user_id": "1"}),
+    ]
+    done = worker.process_messages(messages, max_attempts=3)
+
+    assert done == ["2-0"]
+    assert dead == [("2-0", messages[1][1], 3)]